@@ -13,6 +13,7 @@ from typing import Optional, List, Union, Dict, Deque
 from collections import deque
 
 from cereal import log
+from cereal.messaging import trace
 from cereal.services import SERVICE_LIST
 
 NO_TRAVERSAL_LIMIT = 2**64-1
@@ -108,6 +109,8 @@ class SubMaster:
     self.data = {}
     self.valid = {}
     self.logMonoTime = {}
+    # logMonoTime of received messages that haven't been read yet, only used with MSG_TRACE
+    self.trace_pending: Dict[str, int] = {}
 
     self.max_freq = {}
     self.min_freq = {}
@@ -156,6 +159,8 @@ class SubMaster:
       self.recv_dts[s] = deque(maxlen=int(10*freq))
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    if self.trace_pending and s in self.trace_pending:
+      trace.consume(s, self.trace_pending.pop(s))
     return self.data[s]
 
   def _check_avg_freq(self, s: str) -> bool:
@@ -189,6 +194,9 @@ class SubMaster:
       self.data[s] = getattr(msg, s)
       self.logMonoTime[s] = msg.logMonoTime
       self.valid[s] = msg.valid
+      if trace.ENABLED:
+        trace.receive(s, msg.logMonoTime)
+        self.trace_pending[s] = msg.logMonoTime
 
     for s in self.data:
       if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
@@ -244,6 +252,8 @@ class PubMaster:
   def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
     if not isinstance(dat, bytes):
       dat = dat.to_bytes()
+    if trace.ENABLED:
+      trace.publish(s, dat)
     self.sock[s].send(dat)
 
   def wait_for_readers_to_update(self, s: str, timeout: int, dt: float = 0.05) -> bool:
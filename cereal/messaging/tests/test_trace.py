@@ -0,0 +1,73 @@
+import os
+
+import cereal.messaging as messaging
+from cereal.messaging import trace
+
+
+class TestTrace:
+
+  def test_read_write(self, tmp_path):
+    t = trace.Tracer(str(tmp_path / f"{trace.PREFIX}1"), capacity=16, name="controlsd")
+    t.record("carState", trace.PUBLISH, 100, t=1000)
+    t.record("carState", trace.RECEIVE, 100, t=1500)
+    t.record("carState", trace.CONSUME, 100, t=1700)
+
+    ring = trace.read_ring(t.path)
+    assert ring is not None
+    assert ring.pid == os.getpid()
+    assert ring.name == "controlsd"
+    assert [(e.service, e.kind, e.mono, e.t) for e in ring.events] == [
+      ("carState", trace.PUBLISH, 100, 1000),
+      ("carState", trace.RECEIVE, 100, 1500),
+      ("carState", trace.CONSUME, 100, 1700),
+    ]
+
+  def test_wraparound(self, tmp_path):
+    t = trace.Tracer(str(tmp_path / f"{trace.PREFIX}1"), capacity=8)
+    for i in range(21):
+      t.record("modelV2", trace.PUBLISH, i)
+
+    ring = trace.read_ring(t.path)
+    assert ring is not None
+    assert [e.mono for e in ring.events] == list(range(13, 21))
+
+  def test_not_a_ring(self, tmp_path):
+    fn = tmp_path / f"{trace.PREFIX}1"
+    fn.write_bytes(b"\0" * 128)
+    assert trace.read_ring(str(fn)) is None
+    assert list(trace.iter_rings(str(tmp_path))) == []
+
+  def test_stats(self, tmp_path):
+    pub = trace.Tracer(str(tmp_path / f"{trace.PREFIX}1"), capacity=16)
+    sub = trace.Tracer(str(tmp_path / f"{trace.PREFIX}2"), capacity=16)
+    for mono in (10, 20):
+      pub.record("carState", trace.PUBLISH, mono, t=mono * 1000)
+      sub.record("carState", trace.RECEIVE, mono, t=mono * 1000 + 300)
+    # only the second message is read before being overwritten
+    sub.record("carState", trace.CONSUME, 20, t=20 * 1000 + 500)
+
+    hops = trace.stats(list(trace.iter_rings(str(tmp_path))))
+    assert hops["carState"]["publish->receive"] == [300, 300]
+    assert hops["carState"]["receive->consume"] == [200]
+
+    trace.clear(str(tmp_path))
+    assert trace.ring_paths(str(tmp_path)) == []
+
+  def test_pub_sub_master(self, tmp_path, monkeypatch):
+    monkeypatch.setenv("MSG_TRACE_DIR", str(tmp_path))
+    monkeypatch.setattr(trace, "ENABLED", True)
+    monkeypatch.setattr(trace, "_tracer", None)
+
+    sock = "carState"
+    pm = messaging.PubMaster([sock])
+    sm = messaging.SubMaster([sock])
+
+    msg = messaging.new_message(sock)
+    pm.send(sock, msg)
+    sm.update_msgs(0, [msg.as_reader()])
+    sm[sock]
+    sm[sock]
+
+    rings = list(trace.iter_rings(str(tmp_path)))
+    assert len(rings) == 1
+    assert [(e.kind, e.mono) for e in rings[0].events] == [(k, msg.logMonoTime) for k in (trace.PUBLISH, trace.RECEIVE, trace.CONSUME)]
@@ -0,0 +1,201 @@
+"""
+Opt-in per-hop message tracing, enabled with MSG_TRACE=1.
+
+Every process that sends or receives messages gets its own ring of fixed size
+records in shared memory. A record is written when a message is published,
+when a SubMaster receives it and when the consumer first reads it back out of
+the SubMaster. Messages are identified across processes by (service, logMonoTime),
+so no ids have to be added to the messages themselves.
+
+One ring per process means a single writer, so no cross-process locking is
+needed and a crashed process still leaves its trace behind.
+tools/profiling/perfetto/msgtrace.py collects the rings into a Perfetto trace.
+"""
+import itertools
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+
+from cereal import log
+from cereal.services import SERVICE_LIST
+
+ENABLED = bool(int(os.getenv("MSG_TRACE", "0")))
+RECORDS = int(os.getenv("MSG_TRACE_RECORDS", str(2**16)))
+
+MAGIC = b"MSGTRACE"
+VERSION = 1
+PREFIX = "msgtrace_"
+
+# magic, version, capacity, pid, process name
+HEADER = struct.Struct("<8sIII32s")
+HEADER_SIZE = 64
+# seq, time (CLOCK_MONOTONIC ns), logMonoTime of the message, service index, kind
+RECORD = struct.Struct("<QQQHB5x")
+
+PUBLISH, RECEIVE, CONSUME = range(3)
+KINDS = ("publish", "receive", "consume")
+
+SERVICES = sorted(SERVICE_LIST.keys())
+SERVICE_INDEX = {s: i for i, s in enumerate(SERVICES)}
+
+
+class Event(NamedTuple):
+  seq: int
+  t: int
+  mono: int
+  service: str
+  kind: int
+
+
+class Ring(NamedTuple):
+  pid: int
+  name: str
+  events: List[Event]
+
+
+def trace_dir() -> str:
+  d = os.getenv("MSG_TRACE_DIR")
+  if d is not None:
+    return d
+  return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def process_name() -> str:
+  # read at first use, so names set by setproctitle in the manager are picked up
+  try:
+    with open("/proc/self/cmdline", "rb") as f:
+      name = f.read().split(b"\0")[0].decode(errors="replace").strip()
+  except OSError:
+    name = ""
+  return os.path.basename(name or sys.argv[0]) or "python"
+
+
+class Tracer:
+  def __init__(self, path: str, capacity: int = RECORDS, name: Optional[str] = None):
+    self.path = path
+    self.capacity = capacity
+    self.pid = os.getpid()
+
+    size = HEADER_SIZE + capacity * RECORD.size
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+      os.ftruncate(fd, size)
+      self.buf = mmap.mmap(fd, size)
+    finally:
+      os.close(fd)
+
+    HEADER.pack_into(self.buf, 0, MAGIC, VERSION, capacity, self.pid, (name or process_name()).encode()[:32])
+    # next() on a count is atomic under the GIL, so threads sharing a tracer never get the same slot
+    self.seq = itertools.count(1)
+
+  def record(self, service: str, kind: int, mono: int, t: Optional[int] = None) -> None:
+    seq = next(self.seq)
+    if t is None:
+      t = time.monotonic_ns()
+    RECORD.pack_into(self.buf, HEADER_SIZE + (seq % self.capacity) * RECORD.size, seq, t, mono, SERVICE_INDEX[service], kind)
+
+  def close(self) -> None:
+    self.buf.close()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+  global _tracer
+  # forked children get their own ring instead of writing into the parent's
+  if _tracer is None or _tracer.pid != os.getpid():
+    _tracer = Tracer(os.path.join(trace_dir(), f"{PREFIX}{os.getpid()}"))
+  return _tracer
+
+
+def publish(service: str, dat: Union[bytes, log.Event]) -> None:
+  if isinstance(dat, bytes):
+    with log.Event.from_bytes(dat) as msg:
+      mono = msg.logMonoTime
+  else:
+    mono = dat.logMonoTime
+  get_tracer().record(service, PUBLISH, mono)
+
+
+def receive(service: str, mono: int) -> None:
+  get_tracer().record(service, RECEIVE, mono)
+
+
+def consume(service: str, mono: int) -> None:
+  get_tracer().record(service, CONSUME, mono)
+
+
+def read_ring(path: str) -> Optional[Ring]:
+  """Reads a ring in recording order. Returns None if the file isn't a trace ring."""
+  with open(path, "rb") as f:
+    dat = f.read()
+  if len(dat) < HEADER_SIZE:
+    return None
+  magic, version, capacity, pid, name = HEADER.unpack_from(dat, 0)
+  if magic != MAGIC or version != VERSION:
+    return None
+
+  events = []
+  n = min(capacity, (len(dat) - HEADER_SIZE) // RECORD.size)
+  for seq, t, mono, service, kind in RECORD.iter_unpack(dat[HEADER_SIZE:HEADER_SIZE + n * RECORD.size]):
+    # empty slots have seq 0, the writer may be mid-record on a live ring
+    if seq == 0 or service >= len(SERVICES) or kind >= len(KINDS):
+      continue
+    events.append(Event(seq, t, mono, SERVICES[service], kind))
+  events.sort(key=lambda e: e.seq)
+
+  # after wrapping, slots can only hold the last capacity records
+  if events:
+    events = [e for e in events if e.seq > events[-1].seq - capacity]
+  return Ring(pid, name.rstrip(b"\0").decode(errors="replace"), events)
+
+
+def ring_paths(directory: Optional[str] = None) -> List[str]:
+  directory = directory or trace_dir()
+  return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.startswith(PREFIX))
+
+
+def iter_rings(directory: Optional[str] = None) -> Iterator[Ring]:
+  for path in ring_paths(directory):
+    try:
+      ring = read_ring(path)
+    except OSError:
+      continue
+    if ring is not None:
+      yield ring
+
+
+def clear(directory: Optional[str] = None) -> None:
+  for path in ring_paths(directory):
+    try:
+      os.unlink(path)
+    except FileNotFoundError:
+      pass
+
+
+def stats(rings: List[Ring]) -> Dict[str, Dict[str, List[int]]]:
+  """Per service hop latencies in ns, matched across processes by logMonoTime"""
+  published: Dict[tuple, int] = {}
+  for ring in rings:
+    for e in ring.events:
+      if e.kind == PUBLISH:
+        published[(e.service, e.mono)] = e.t
+
+  out: Dict[str, Dict[str, List[int]]] = {}
+  for ring in rings:
+    received: Dict[tuple, int] = {}
+    for e in ring.events:
+      hops = out.setdefault(e.service, {"publish->receive": [], "receive->consume": []})
+      key = (e.service, e.mono)
+      if e.kind == RECEIVE:
+        received[key] = e.t
+        if key in published:
+          hops["publish->receive"].append(e.t - published[key])
+      elif e.kind == CONSUME and key in received:
+        hops["receive->consume"].append(e.t - received.pop(key))
+  return {s: h for s, h in out.items() if h["publish->receive"] or h["receive->consume"]}
@@ -0,0 +1,73 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class Inotify:
+  """Minimal inotify(7) wrapper, raises OSError where inotify isn't available."""
+  def __init__(self):
+    libc_name = ctypes.util.find_library("c")
+    if libc_name is None:
+      raise OSError("libc not found")
+    self._libc = ctypes.CDLL(libc_name, use_errno=True)
+    if not hasattr(self._libc, "inotify_init1"):
+      raise OSError("inotify not supported")
+
+    self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self.fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+    self._poll = select.poll()
+    self._poll.register(self.fd, select.POLLIN)
+
+  def add_watch(self, path: str, mask: int) -> int:
+    wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    return wd
+
+  def read(self, timeout: float = 0) -> list[tuple[int, int, str]]:
+    """Returns the pending (wd, mask, name) events, waiting up to timeout seconds for the first one"""
+    if not self._poll.poll(int(timeout * 1000)):
+      return []
+
+    try:
+      buf = os.read(self.fd, 64 * 1024)
+    except BlockingIOError:
+      return []
+
+    events, offset = [], 0
+    while offset < len(buf):
+      wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+      offset += _EVENT_HEADER.size
+      name = buf[offset:offset + name_len].rstrip(b"\0")
+      offset += name_len
+      events.append((wd, mask, os.fsdecode(name)))
+    return events
+
+  def close(self) -> None:
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
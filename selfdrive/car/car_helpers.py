@@ -1,42 +1,62 @@
 import os
 import time
+from collections.abc import Mapping
 
 from cereal import car
-from openpilot.selfdrive.car import carlog, gen_empty_fingerprint
+from openpilot.selfdrive.car import car_index, carlog, gen_empty_fingerprint
 from openpilot.selfdrive.car.can_definitions import CanRecvCallable, CanSendCallable
 from openpilot.selfdrive.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
 from openpilot.selfdrive.car.fw_versions import ObdCallback, get_fw_versions_ordered, get_present_ecus, match_fw_to_car
-from openpilot.selfdrive.car.interfaces import get_interface_attr
 from openpilot.selfdrive.car.mock.values import CAR as MOCK
 from openpilot.selfdrive.car.vin import get_vin, is_valid_vin, VIN_UNKNOWN
 
 FRAME_FINGERPRINT = 100  # 1s
 
 
+def load_brand_interface(brand_name: str) -> tuple:
+  path = f'openpilot.selfdrive.car.{brand_name}'
+  CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
+  CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
+  CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
+  return CarInterface, CarController, CarState
+
+
 def load_interfaces(brand_names):
   ret = {}
   for brand_name in brand_names:
-    path = f'openpilot.selfdrive.car.{brand_name}'
-    CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
-    CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
-    CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
+    interface = load_brand_interface(brand_name)
     for model_name in brand_names[brand_name]:
-      ret[model_name] = (CarInterface, CarController, CarState)
+      ret[model_name] = interface
   return ret
 
 
+class LazyInterfaces(Mapping):
+  """Platform to (CarInterface, CarController, CarState), a brand's modules are imported on first access"""
+  def __init__(self, brand_names: dict[str, list[str]]):
+    self.model_to_brand = {model: brand for brand, models in brand_names.items() for model in models}
+    self.brands: dict[str, tuple] = {}
+
+  def __getitem__(self, model_name):
+    brand_name = self.model_to_brand[model_name]
+    if brand_name not in self.brands:
+      self.brands[brand_name] = load_brand_interface(brand_name)
+    return self.brands[brand_name]
+
+  def __iter__(self):
+    return iter(self.model_to_brand)
+
+  def __len__(self):
+    return len(self.model_to_brand)
+
+
 def _get_interface_names() -> dict[str, list[str]]:
   # returns a dict of brand name and its respective models
-  brand_names = {}
-  for brand_name, brand_models in get_interface_attr("CAR").items():
-    brand_names[brand_name] = [model.value for model in brand_models]
-
-  return brand_names
+  return car_index.get_brand_names()
 
 
-# imports from directory selfdrive/car/<name>/
+# imports from directory selfdrive/car/<name>/ on first use
 interface_names = _get_interface_names()
-interfaces = load_interfaces(interface_names)
+interfaces = LazyInterfaces(interface_names)
 
 
 def can_fingerprint(can_recv: CanRecvCallable) -> tuple[str | None, dict[int, dict]]:
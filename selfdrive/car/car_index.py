@@ -0,0 +1,91 @@
+"""Platform names, CAN fingerprints and FW versions of every brand, built once and cached on disk.
+
+Building it imports each brand's values and fingerprints modules, which are mostly large data
+tables. The result is pickled with plain strings for platform names, and reused as long as the
+hash of those source files doesn't change, so processes that only need one brand don't pay for
+importing all of them.
+"""
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Any
+
+from openpilot.common.basedir import BASEDIR
+
+INDEX_VERSION = 1
+CAR_DIR = os.path.join(BASEDIR, "selfdrive/car")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+_index: dict[str, Any] | None = None
+
+
+def source_files() -> list[str]:
+  return sorted(glob.glob(os.path.join(CAR_DIR, "*", "values.py")) + glob.glob(os.path.join(CAR_DIR, "*", "fingerprints.py")))
+
+
+def version_hash() -> str:
+  h = hashlib.sha1(str(INDEX_VERSION).encode())
+  for fn in source_files():
+    h.update(os.path.relpath(fn, CAR_DIR).encode())
+    with open(fn, "rb") as f:
+      h.update(f.read())
+  return h.hexdigest()
+
+
+def build_index() -> dict[str, Any]:
+  from openpilot.selfdrive.car.interfaces import get_interface_attr
+
+  def by_name(brand_attr: dict) -> dict[str, dict]:
+    return {brand: {str(model): v for model, v in (data or {}).items()} for brand, data in brand_attr.items()}
+
+  return {
+    "CAR": {brand: [model.value for model in models] for brand, models in get_interface_attr("CAR").items()},
+    "FW_VERSIONS": by_name(get_interface_attr("FW_VERSIONS", ignore_none=True)),
+    "FINGERPRINTS": by_name(get_interface_attr("FINGERPRINTS", ignore_none=True)),
+  }
+
+
+def cache_path(version: str) -> str:
+  return os.path.join(CACHE_DIR, f"car_index.{version}.pickle")
+
+
+def get_index() -> dict[str, Any]:
+  global _index
+  if _index is not None:
+    return _index
+
+  fn = cache_path(version_hash())
+  try:
+    with open(fn, "rb") as f:
+      _index = pickle.load(f)
+    return _index
+  except (OSError, pickle.UnpicklingError, EOFError):
+    pass
+
+  _index = build_index()
+  try:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for old in glob.glob(cache_path("*")):
+      if old != fn:
+        os.unlink(old)
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, delete=False) as f:
+      pickle.dump(_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, fn)
+  except OSError:
+    pass  # read-only install, build it every time
+  return _index
+
+
+def get_brand_names() -> dict[str, list[str]]:
+  """Brand name and its respective platforms"""
+  return get_index()["CAR"]
+
+
+def get_attr(attr: str, combine_brands: bool = False) -> dict[str, Any]:
+  """FW_VERSIONS or FINGERPRINTS of every brand that has them, the same as get_interface_attr(attr, ignore_none=True)"""
+  data = get_index()[attr]
+  if combine_brands:
+    return {model: v for brand_data in data.values() for model, v in brand_data.items()}
+  return data
@@ -1,4 +1,4 @@
-from openpilot.selfdrive.car.interfaces import get_interface_attr
+from openpilot.selfdrive.car import car_index
 from openpilot.selfdrive.car.body.values import CAR as BODY
 from openpilot.selfdrive.car.chrysler.values import CAR as CHRYSLER
 from openpilot.selfdrive.car.ford.values import CAR as FORD
@@ -13,8 +13,8 @@ from openpilot.selfdrive.car.tesla.values import CAR as TESLA
 from openpilot.selfdrive.car.toyota.values import CAR as TOYOTA
 from openpilot.selfdrive.car.volkswagen.values import CAR as VW
 
-FW_VERSIONS = get_interface_attr('FW_VERSIONS', combine_brands=True, ignore_none=True)
-_FINGERPRINTS = get_interface_attr('FINGERPRINTS', combine_brands=True, ignore_none=True)
+FW_VERSIONS = car_index.get_attr('FW_VERSIONS', combine_brands=True)
+_FINGERPRINTS = car_index.get_attr('FINGERPRINTS', combine_brands=True)
 
 _DEBUG_ADDRESS = {1880: 8}   # reserved for debug purposes
 
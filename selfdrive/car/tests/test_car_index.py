@@ -0,0 +1,39 @@
+import os
+import pickle
+
+from openpilot.selfdrive.car import car_index
+from openpilot.selfdrive.car.car_helpers import LazyInterfaces, interface_names
+from openpilot.selfdrive.car.interfaces import get_interface_attr
+
+
+class TestCarIndex:
+  def test_matches_interface_attrs(self):
+    assert car_index.get_brand_names() == {b: [m.value for m in models] for b, models in get_interface_attr("CAR").items()}
+    for attr in ("FW_VERSIONS", "FINGERPRINTS"):
+      assert car_index.get_attr(attr, combine_brands=True) == get_interface_attr(attr, combine_brands=True, ignore_none=True)
+
+  def test_cache_rebuilt(self, tmp_path, mocker):
+    mocker.patch.object(car_index, "CACHE_DIR", str(tmp_path))
+    mocker.patch.object(car_index, "_index", None)
+    (tmp_path / "car_index.stale.pickle").write_bytes(pickle.dumps({}))
+
+    index = car_index.get_index()
+    assert os.listdir(tmp_path) == [os.path.basename(car_index.cache_path(car_index.version_hash()))]
+
+    # a different hash can't reuse the cached index
+    mocker.patch.object(car_index, "_index", None)
+    build = mocker.spy(car_index, "build_index")
+    mocker.patch.object(car_index, "version_hash", return_value="changed")
+    assert car_index.get_index() == index
+    assert build.call_count == 1
+    assert os.listdir(tmp_path) == ["car_index.changed.pickle"]
+
+  def test_lazy_interfaces(self, mocker):
+    load = mocker.patch("openpilot.selfdrive.car.car_helpers.load_brand_interface", side_effect=lambda brand: (brand,))
+    interfaces = LazyInterfaces(interface_names)
+    assert set(interfaces) == {m for models in interface_names.values() for m in models}
+
+    toyota = interface_names["toyota"]
+    assert interfaces[toyota[0]] == ("toyota",)
+    assert interfaces[toyota[-1]] == ("toyota",)
+    assert load.call_count == 1
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from openpilot.selfdrive.car import car_index
+
+# imports what card needs before fingerprinting, then loads a single platform
+SNIPPET = """
+import resource, time
+t = time.monotonic()
+from openpilot.selfdrive.car.car_helpers import interfaces
+interfaces[{platform!r}]
+print(time.monotonic() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def run(platform: str) -> tuple[float, int]:
+  out = subprocess.check_output([sys.executable, "-c", SNIPPET.format(platform=platform)], text=True)
+  t, rss = out.split()
+  return float(t) * 1e3, int(rss)
+
+
+def clear_cache() -> None:
+  for fn in glob.glob(car_index.cache_path("*")):
+    os.unlink(fn)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time importing the car interfaces in a fresh interpreter, with a cold and warm car index")
+  parser.add_argument("--platform", default="TOYOTA_RAV4_TSS2")
+  parser.add_argument("-n", type=int, default=5)
+  args = parser.parse_args()
+
+  for name, cold in (("cold", True), ("warm", False)):
+    if not cold:
+      run(args.platform)  # make sure the index is cached
+    ts, rss = [], []
+    for _ in range(args.n):
+      if cold:
+        clear_cache()
+      t, r = run(args.platform)
+      ts.append(t)
+      rss.append(r)
+    print(f"{name} index: {np.median(ts):.1f} median ms, {max(ts):.1f} max ms, {max(rss) / 1024:.1f} MB max rss")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from openpilot.system import micd
+
+N_BLOCKS = 1000
+
+
+def synthetic_blocks(n_blocks):
+  t = np.arange(n_blocks * micd.SAMPLE_BUFFER) / micd.SAMPLE_RATE
+  x = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.01 * np.random.default_rng(0).standard_normal(len(t))
+  return x.astype(np.float32).reshape(n_blocks, micd.SAMPLE_BUFFER, 1)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run micd on a synthetic signal, timing the audio callback and the window processing")
+  parser.add_argument("-n", type=int, default=N_BLOCKS, help="number of audio blocks")
+  args = parser.parse_args()
+
+  mic = micd.Mic()
+  blocks = synthetic_blocks(args.n)
+
+  callback_ts, process_ts = [], []
+  tracemalloc.start()
+  for block in blocks:
+    t = time.perf_counter_ns()
+    mic.callback(block, len(block), None, None)
+    callback_ts.append((time.perf_counter_ns() - t) * 1e-3)
+
+    t = time.perf_counter_ns()
+    mic.process()
+    process_ts.append((time.perf_counter_ns() - t) * 1e-3)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  print(f'{args.n} blocks of {micd.SAMPLE_BUFFER} samples, {micd.FFT_SAMPLES} sample windows, {micd.FFT_HOP} sample hop')
+  print(f'callback: {np.mean(callback_ts):.1f} mean us, {max(callback_ts):.1f} max us')
+  print(f'process:  {np.mean(process_ts):.1f} mean us, {max(process_ts):.1f} max us')
+  print(f'peak traced memory: {peak / 1024:.1f} KiB')
@@ -14,39 +14,53 @@ class PublishState:
     self.prev_brake_5ms2_probs = np.zeros(ModelConstants.FCW_5MS2_PROBS_WIDTH, dtype=np.float32)
     self.prev_brake_3ms2_probs = np.zeros(ModelConstants.FCW_3MS2_PROBS_WIDTH, dtype=np.float32)
 
-def fill_xyzt(builder, t, x, y, z, x_std=None, y_std=None, z_std=None):
+X_IDXS = np.array(ModelConstants.X_IDXS, dtype=np.float64)
+T_IDXS = np.array(ModelConstants.T_IDXS, dtype=np.float64)
+# polyfit is linear in y for a fixed x and degree, so the fit reduces to one precomputed matrix product
+POLY_PATH_FIT = np.polynomial.polynomial.polyfit(T_IDXS, np.eye(ModelConstants.IDX_N), deg=ModelConstants.POLY_PATH_DEGREE)
+
+def fill_lists(builder, fields, values):
+  # sets one list field per row of a 2D array, converting the whole array to Python floats in one go
+  for field, row in zip(fields, values.tolist(), strict=True):
+    setattr(builder, field, row)
+
+def fill_xyzt(builder, t, xyz, xyz_std=None):
   builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.z = z.tolist()
-  if x_std is not None:
-    builder.xStd = x_std.tolist()
-  if y_std is not None:
-    builder.yStd = y_std.tolist()
-  if z_std is not None:
-    builder.zStd = z_std.tolist()
-
-def fill_xyvat(builder, t, x, y, v, a, x_std=None, y_std=None, v_std=None, a_std=None):
+  fill_lists(builder, ('x', 'y', 'z'), xyz)
+  if xyz_std is not None:
+    fill_lists(builder, ('xStd', 'yStd', 'zStd'), xyz_std)
+
+def fill_xyvat(builder, t, xyva, xyva_std=None):
   builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.v = v.tolist()
-  builder.a = a.tolist()
-  if x_std is not None:
-    builder.xStd = x_std.tolist()
-  if y_std is not None:
-    builder.yStd = y_std.tolist()
-  if v_std is not None:
-    builder.vStd = v_std.tolist()
-  if a_std is not None:
-    builder.aStd = a_std.tolist()
-
-def fill_xyz_poly(builder, degree, x, y, z):
-  xyz = np.stack([x, y, z], axis=1)
-  coeffs = np.polynomial.polynomial.polyfit(ModelConstants.T_IDXS, xyz, deg=degree)
-  builder.xCoefficients = coeffs[:, 0].tolist()
-  builder.yCoefficients = coeffs[:, 1].tolist()
-  builder.zCoefficients = coeffs[:, 2].tolist()
+  fill_lists(builder, ('x', 'y', 'v', 'a'), xyva)
+  if xyva_std is not None:
+    fill_lists(builder, ('xStd', 'yStd', 'vStd', 'aStd'), xyva_std)
+
+def fill_xyz_poly(builder, xyz):
+  fill_lists(builder, ('xCoefficients', 'yCoefficients', 'zCoefficients'), xyz @ POLY_PATH_FIT.T)
+
+def get_plan_t_idxs(plan_x):
+  # times at X_IDXS according to model plan
+  plan_t = np.full(ModelConstants.IDX_N, np.nan)
+  plan_t[0] = 0.0
+  # for each X_IDXS, the first plan point that's further away, as found by scanning the plan from the start.
+  # written as not closer, so a NaN in the plan stops the scan like it does in the scalar loop
+  further = ~(plan_x[np.newaxis, 1:] < X_IDXS[1:, np.newaxis])
+  found = further.any(axis=1)
+  n = ModelConstants.IDX_N if found.all() else int(np.argmin(found)) + 1
+  if n < ModelConstants.IDX_N:
+    # if the Plan doesn't extend far enough, set plan_t to the max value (10s), then stop
+    plan_t[n] = T_IDXS[-1]
+
+  # interpolate to find `t` for each xidx
+  tidx = np.argmax(further[:n-1], axis=1)
+  current_x_val = plan_x[tidx]
+  next_x_val = plan_x[tidx+1]
+  dx = next_x_val - current_x_val
+  with np.errstate(divide='ignore', invalid='ignore'):
+    p = np.where(np.abs(dx) > 1e-9, (X_IDXS[1:n] - current_x_val) / dx, np.nan)
+  plan_t[1:n] = p * T_IDXS[tidx+1] + (1 - p) * T_IDXS[tidx]
+  return plan_t
 
 def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._DynamicStructBuilder,
                    net_output_data: dict[str, np.ndarray], publish_state: PublishState,
@@ -75,71 +89,61 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   modelV2.modelExecutionTime = model_execution_time
 
   # plan
+  plan = net_output_data['plan'][0].T
   position = modelV2.position
-  fill_xyzt(position, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.POSITION].T, *net_output_data['plan_stds'][0,:,Plan.POSITION].T)
+  fill_xyzt(position, ModelConstants.T_IDXS, plan[Plan.POSITION], net_output_data['plan_stds'][0,:,Plan.POSITION].T)
   velocity = modelV2.velocity
-  fill_xyzt(velocity, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.VELOCITY].T)
+  fill_xyzt(velocity, ModelConstants.T_IDXS, plan[Plan.VELOCITY])
   acceleration = modelV2.acceleration
-  fill_xyzt(acceleration, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ACCELERATION].T)
+  fill_xyzt(acceleration, ModelConstants.T_IDXS, plan[Plan.ACCELERATION])
   orientation = modelV2.orientation
-  fill_xyzt(orientation, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.T_FROM_CURRENT_EULER].T)
+  fill_xyzt(orientation, ModelConstants.T_IDXS, plan[Plan.T_FROM_CURRENT_EULER])
   orientation_rate = modelV2.orientationRate
-  fill_xyzt(orientation_rate, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ORIENTATION_RATE].T)
+  fill_xyzt(orientation_rate, ModelConstants.T_IDXS, plan[Plan.ORIENTATION_RATE])
 
   # poly path
   poly_path = driving_model_data.path
-  fill_xyz_poly(poly_path, ModelConstants.POLY_PATH_DEGREE, *net_output_data['plan'][0,:,Plan.POSITION].T)
+  fill_xyz_poly(poly_path, plan[Plan.POSITION])
 
   # lateral planning
   action = modelV2.action
   action.desiredCurvature = float(net_output_data['desired_curvature'][0,0])
 
-  # times at X_IDXS according to model plan
-  PLAN_T_IDXS = [np.nan] * ModelConstants.IDX_N
-  PLAN_T_IDXS[0] = 0.0
-  plan_x = net_output_data['plan'][0,:,Plan.POSITION][:,0].tolist()
-  for xidx in range(1, ModelConstants.IDX_N):
-    tidx = 0
-    # increment tidx until we find an element that's further away than the current xidx
-    while tidx < ModelConstants.IDX_N - 1 and plan_x[tidx+1] < ModelConstants.X_IDXS[xidx]:
-      tidx += 1
-    if tidx == ModelConstants.IDX_N - 1:
-      # if the Plan doesn't extend far enough, set plan_t to the max value (10s), then break
-      PLAN_T_IDXS[xidx] = ModelConstants.T_IDXS[ModelConstants.IDX_N - 1]
-      break
-    # interpolate to find `t` for the current xidx
-    current_x_val = plan_x[tidx]
-    next_x_val = plan_x[tidx+1]
-    p = (ModelConstants.X_IDXS[xidx] - current_x_val) / (next_x_val - current_x_val) if abs(next_x_val - current_x_val) > 1e-9 else float('nan')
-    PLAN_T_IDXS[xidx] = p * ModelConstants.T_IDXS[tidx+1] + (1 - p) * ModelConstants.T_IDXS[tidx]
+  PLAN_T_IDXS = get_plan_t_idxs(plan[Plan.POSITION][0].astype(np.float64)).tolist()
 
   # lane lines
+  lane_lines = np.empty((4, 3, ModelConstants.IDX_N), dtype=np.float64)
+  lane_lines[:, 0] = X_IDXS
+  lane_lines[:, 1:] = net_output_data['lane_lines'][0,:,:,:2].transpose(0, 2, 1)
   modelV2.init('laneLines', 4)
   for i in range(4):
-    lane_line = modelV2.laneLines[i]
-    fill_xyzt(lane_line, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['lane_lines'][0,i,:,0], net_output_data['lane_lines'][0,i,:,1])
+    fill_xyzt(modelV2.laneLines[i], PLAN_T_IDXS, lane_lines[i])
   modelV2.laneLineStds = net_output_data['lane_lines_stds'][0,:,0,0].tolist()
-  modelV2.laneLineProbs = net_output_data['lane_lines_prob'][0,1::2].tolist()
+  lane_line_probs = net_output_data['lane_lines_prob'][0,1::2].tolist()
+  modelV2.laneLineProbs = lane_line_probs
 
   lane_line_meta = driving_model_data.laneLineMeta
-  lane_line_meta.leftY = modelV2.laneLines[1].y[0]
-  lane_line_meta.leftProb = modelV2.laneLineProbs[1]
-  lane_line_meta.rightY = modelV2.laneLines[2].y[0]
-  lane_line_meta.rightProb = modelV2.laneLineProbs[2]
+  lane_line_meta.leftY = lane_lines[1, 1, 0].item()
+  lane_line_meta.leftProb = lane_line_probs[1]
+  lane_line_meta.rightY = lane_lines[2, 1, 0].item()
+  lane_line_meta.rightProb = lane_line_probs[2]
 
   # road edges
+  road_edges = np.empty((2, 3, ModelConstants.IDX_N), dtype=np.float64)
+  road_edges[:, 0] = X_IDXS
+  road_edges[:, 1:] = net_output_data['road_edges'][0,:,:,:2].transpose(0, 2, 1)
   modelV2.init('roadEdges', 2)
   for i in range(2):
-    road_edge = modelV2.roadEdges[i]
-    fill_xyzt(road_edge, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['road_edges'][0,i,:,0], net_output_data['road_edges'][0,i,:,1])
+    fill_xyzt(modelV2.roadEdges[i], PLAN_T_IDXS, road_edges[i])
   modelV2.roadEdgeStds = net_output_data['road_edges_stds'][0,:,0,0].tolist()
 
   # leads
+  lead_probs = net_output_data['lead_prob'][0].tolist()
   modelV2.init('leadsV3', 3)
   for i in range(3):
     lead = modelV2.leadsV3[i]
-    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *net_output_data['lead'][0,i].T, *net_output_data['lead_stds'][0,i].T)
-    lead.prob = net_output_data['lead_prob'][0,i].tolist()
+    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, net_output_data['lead'][0,i].T, net_output_data['lead_stds'][0,i].T)
+    lead.prob = lead_probs[i]
     lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
 
   # meta
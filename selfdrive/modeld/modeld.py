@@ -16,6 +16,7 @@ from openpilot.common.realtime import config_realtime_process
 from openpilot.common.transformations.camera import DEVICE_CAMERAS
 from openpilot.common.transformations.model import get_warp_matrix
 from openpilot.system import sentry
+from openpilot.system.statsd import statlog
 from openpilot.selfdrive.car.car_helpers import get_demo_car_params
 from openpilot.selfdrive.controls.lib.desire_helper import DesireHelper
 from openpilot.selfdrive.modeld.runners import ModelRunner, Runtime
@@ -26,6 +27,7 @@ from openpilot.selfdrive.modeld.models.commonmodel_pyx import ModelFrame, CLCont
 
 PROCESS_NAME = "selfdrive.modeld.modeld"
 SEND_RAW_PRED = os.getenv('SEND_RAW_PRED')
+TIMINGS_LOG_FRAMES = 20 * 60  # stage timings are summarized once a minute
 
 MODEL_PATHS = {
   ModelRunner.THNEED: Path(__file__).parent / 'models/supercombo.thneed',
@@ -69,6 +71,7 @@ class ModelState:
     net_output_size = model_metadata['output_shapes']['outputs'][1]
     self.output = np.zeros(net_output_size, dtype=np.float32)
     self.parser = Parser()
+    self.timings = {'prepare': 0., 'execute': 0., 'parse': 0.}
 
     self.model = ModelRunner(MODEL_PATHS, self.output, Runtime.GPU, False, context)
     self.model.addInput("input_imgs", None)
@@ -84,6 +87,17 @@ class ModelState:
 
   def run(self, buf: VisionBuf, wbuf: VisionBuf, transform: np.ndarray, transform_wide: np.ndarray,
                 inputs: dict[str, np.ndarray], prepare_only: bool) -> dict[str, np.ndarray] | None:
+    t0 = time.perf_counter()
+    # if getCLBuffer is not None, frame will be None
+    self.model.setInputBuffer("input_imgs", self.frame.prepare(buf, transform.flatten(), self.model.getCLBuffer("input_imgs")))
+    if wbuf is not None:
+      self.model.setInputBuffer("big_input_imgs", self.wide_frame.prepare(wbuf, transform_wide.flatten(), self.model.getCLBuffer("big_input_imgs")))
+    self.timings['prepare'] = time.perf_counter() - t0
+
+    return self.run_prepared(inputs, prepare_only)
+
+  def run_prepared(self, inputs: dict[str, np.ndarray], prepare_only: bool) -> dict[str, np.ndarray] | None:
+    # runs the model on the frames already set as input buffers, used directly by the offline replay
     # Model decides when action is completed, so desire input is just a pulse triggered on rising edge
     inputs['desire'][0] = 0
     self.inputs['desire'][:-ModelConstants.DESIRE_LEN] = self.inputs['desire'][ModelConstants.DESIRE_LEN:]
@@ -93,16 +107,16 @@ class ModelState:
     self.inputs['traffic_convention'][:] = inputs['traffic_convention']
     self.inputs['lateral_control_params'][:] = inputs['lateral_control_params']
 
-    # if getCLBuffer is not None, frame will be None
-    self.model.setInputBuffer("input_imgs", self.frame.prepare(buf, transform.flatten(), self.model.getCLBuffer("input_imgs")))
-    if wbuf is not None:
-      self.model.setInputBuffer("big_input_imgs", self.wide_frame.prepare(wbuf, transform_wide.flatten(), self.model.getCLBuffer("big_input_imgs")))
-
     if prepare_only:
       return None
 
+    t1 = time.perf_counter()
     self.model.execute()
+    t2 = time.perf_counter()
     outputs = self.parser.parse_outputs(self.slice_outputs(self.output))
+    t3 = time.perf_counter()
+    self.timings['execute'] = t2 - t1
+    self.timings['parse'] = t3 - t2
 
     self.inputs['features_buffer'][:-ModelConstants.FEATURE_LEN] = self.inputs['features_buffer'][ModelConstants.FEATURE_LEN:]
     self.inputs['features_buffer'][-ModelConstants.FEATURE_LEN:] = outputs['hidden_state'][0, :]
@@ -181,6 +195,10 @@ def main(demo=False):
 
   DH = DesireHelper()
 
+  timings_sum = dict.fromkeys(model.timings, 0.)
+  timings_max = dict.fromkeys(model.timings, 0.)
+  timings_frames = 0
+
   while True:
     # Keep receiving frames until we are at least 1 frame ahead of previous extra frame
     while meta_main.timestamp_sof < meta_extra.timestamp_sof + 25000000:
@@ -258,6 +276,17 @@ def main(demo=False):
     model_execution_time = mt2 - mt1
 
     if model_output is not None:
+      for k, v in model.timings.items():
+        timings_sum[k] += v
+        timings_max[k] = max(timings_max[k], v)
+      timings_frames += 1
+      if timings_frames == TIMINGS_LOG_FRAMES:
+        for k in timings_sum:
+          statlog.gauge(f"modeld_{k}_ms_mean", timings_sum[k] / timings_frames * 1000)
+          statlog.gauge(f"modeld_{k}_ms_max", timings_max[k] * 1000)
+          timings_sum[k] = timings_max[k] = 0.
+        timings_frames = 0
+
       modelv2_send = messaging.new_message('modelV2')
       drivingdata_send = messaging.new_message('drivingModelData')
       posenet_send = messaging.new_message('cameraOdometry')
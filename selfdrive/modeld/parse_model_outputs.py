@@ -13,9 +13,30 @@ def softmax(x, axis=-1):
   x /= np.sum(x, axis=axis, keepdims=True)
   return x
 
+def sigmoid_into(x, out):
+  np.negative(x, out=out)
+  np.exp(out, out=out)
+  out += 1.
+  np.reciprocal(out, out=out)
+  return out
+
+def take_rows(x, idxs, out):
+  # out[b, j] = x[b, idxs[b, j]], like np.take_along_axis on axis 1 but writing into a preallocated buffer
+  batch, n = x.shape[0], x.shape[1]
+  rows = idxs + (np.arange(batch) * n)[:, None]
+  return np.take(x.reshape(batch * n, -1), rows, axis=0, out=out, mode='clip')
+
 class Parser:
   def __init__(self, ignore_missing=False):
     self.ignore_missing = ignore_missing
+    # parsed outputs are written into these and reused across calls, so they are only valid until the next parse
+    self.buffers: dict[str, np.ndarray] = {}
+
+  def get_buffer(self, key, shape, dtype):
+    buf = self.buffers.get(key)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+      buf = self.buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
 
   def check_missing(self, outs, name):
     if name not in outs and not self.ignore_missing:
@@ -34,49 +55,46 @@ class Parser:
     if self.check_missing(outs, name):
       return
     raw = outs[name]
-    outs[name] = sigmoid(raw)
+    outs[name] = sigmoid_into(raw, self.get_buffer(name, raw.shape, raw.dtype))
 
   def parse_mdn(self, name, outs, in_N=0, out_N=1, out_shape=None):
     if self.check_missing(outs, name):
       return
     raw = outs[name]
     raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
+    batch = raw.shape[0]
 
     n_values = (raw.shape[2] - out_N)//2
     pred_mu = raw[:,:,:n_values]
-    pred_std = np.exp(raw[:,:,n_values: 2*n_values])
+    pred_std = np.exp(raw[:,:,n_values: 2*n_values], out=self.get_buffer(name + '_std_raw', pred_mu.shape, raw.dtype))
 
     if in_N > 1:
-      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
-      for i in range(out_N):
-        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+      weights = self.get_buffer(name + '_weights', (batch, in_N, out_N), raw.dtype)
+      weights[:] = raw[:,:,raw.shape[2] - out_N:]
+      softmax(weights, axis=1)
 
       if out_N == 1:
-        for fidx in range(weights.shape[0]):
-          idxs = np.argsort(weights[fidx][:,0])[::-1]
-          weights[fidx] = weights[fidx][idxs]
-          pred_mu[fidx] = pred_mu[fidx][idxs]
-          pred_std[fidx] = pred_std[fidx][idxs]
-      full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
+        # sort hypotheses by descending weight
+        order = np.argsort(weights[:,:,0], axis=1)[:,::-1]
+        weights[:] = np.take_along_axis(weights, order[:,:,np.newaxis], axis=1)
+        pred_mu = take_rows(pred_mu, order, self.get_buffer(name + '_hypotheses', pred_mu.shape, raw.dtype))
+        pred_std = take_rows(pred_std, order, self.get_buffer(name + '_stds_hypotheses', pred_std.shape, raw.dtype))
+      full_shape = tuple([batch, in_N] + list(out_shape))
       outs[name + '_weights'] = weights
       outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
       outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
 
-      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      for fidx in range(weights.shape[0]):
-        for hidx in range(out_N):
-          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
-          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
-          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+      best = np.argmax(weights, axis=1)
+      pred_mu_final = take_rows(pred_mu, best, self.get_buffer(name + '_mu_final', (batch, out_N, n_values), raw.dtype))
+      pred_std_final = take_rows(pred_std, best, self.get_buffer(name + '_std_final', (batch, out_N, n_values), raw.dtype))
     else:
       pred_mu_final = pred_mu
       pred_std_final = pred_std
 
     if out_N > 1:
-      final_shape = tuple([raw.shape[0], out_N] + list(out_shape))
+      final_shape = tuple([batch, out_N] + list(out_shape))
     else:
-      final_shape = tuple([raw.shape[0],] + list(out_shape))
+      final_shape = tuple([batch,] + list(out_shape))
     outs[name] = pred_mu_final.reshape(final_shape)
     outs[name + '_stds'] = pred_std_final.reshape(final_shape)
 
@@ -0,0 +1,51 @@
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.fill_model_msg import get_plan_t_idxs, fill_xyz_poly
+
+
+def plan_t_idxs_reference(plan_x):
+  plan_t = [np.nan] * ModelConstants.IDX_N
+  plan_t[0] = 0.0
+  for xidx in range(1, ModelConstants.IDX_N):
+    tidx = 0
+    while tidx < ModelConstants.IDX_N - 1 and plan_x[tidx+1] < ModelConstants.X_IDXS[xidx]:
+      tidx += 1
+    if tidx == ModelConstants.IDX_N - 1:
+      plan_t[xidx] = ModelConstants.T_IDXS[ModelConstants.IDX_N - 1]
+      break
+    current_x_val = plan_x[tidx]
+    next_x_val = plan_x[tidx+1]
+    p = (ModelConstants.X_IDXS[xidx] - current_x_val) / (next_x_val - current_x_val) if abs(next_x_val - current_x_val) > 1e-9 else float('nan')
+    plan_t[xidx] = p * ModelConstants.T_IDXS[tidx+1] + (1 - p) * ModelConstants.T_IDXS[tidx]
+  return plan_t
+
+
+class PolyBuilder:
+  pass
+
+
+class TestFillModelMsg:
+  def test_plan_t_idxs(self):
+    rng = np.random.default_rng(0)
+    plans = [np.linspace(0, d, ModelConstants.IDX_N) for d in (0., 50., 192., 250.)]
+    plans += [np.cumsum(rng.uniform(-1, 10, ModelConstants.IDX_N)) for _ in range(100)]
+    plans += [rng.uniform(0, 250, ModelConstants.IDX_N) for _ in range(100)]
+    # bad model outputs
+    for i in (0, 1, 5, ModelConstants.IDX_N - 1):
+      plan_x = np.linspace(0, 250, ModelConstants.IDX_N)
+      plan_x[i] = np.nan
+      plans.append(plan_x)
+    plans.append(np.full(ModelConstants.IDX_N, np.nan))
+    for plan_x in plans:
+      plan_x = plan_x.astype(np.float32)
+      np.testing.assert_array_equal(get_plan_t_idxs(plan_x.astype(np.float64)), plan_t_idxs_reference(plan_x.tolist()))
+
+  def test_poly_path(self):
+    xyz = np.random.default_rng(1).standard_normal((3, ModelConstants.IDX_N)).astype(np.float32)
+    builder = PolyBuilder()
+    fill_xyz_poly(builder, xyz)
+    expected = np.polynomial.polynomial.polyfit(ModelConstants.T_IDXS, xyz.T, deg=ModelConstants.POLY_PATH_DEGREE)
+    np.testing.assert_allclose(builder.xCoefficients, expected[:, 0], rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(builder.yCoefficients, expected[:, 1], rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(builder.zCoefficients, expected[:, 2], rtol=1e-6, atol=1e-9)
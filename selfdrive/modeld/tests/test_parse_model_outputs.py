@@ -0,0 +1,58 @@
+import numpy as np
+
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+
+MC = ModelConstants
+OUTPUT_SIZES = {
+  'plan': MC.PLAN_MHP_N * (2 * MC.IDX_N * MC.PLAN_WIDTH + MC.PLAN_MHP_SELECTION),
+  'lane_lines': 2 * MC.NUM_LANE_LINES * MC.IDX_N * MC.LANE_LINES_WIDTH,
+  'road_edges': 2 * MC.NUM_ROAD_EDGES * MC.IDX_N * MC.LANE_LINES_WIDTH,
+  'pose': 2 * MC.POSE_WIDTH,
+  'road_transform': 2 * MC.POSE_WIDTH,
+  'sim_pose': 2 * MC.POSE_WIDTH,
+  'wide_from_device_euler': 2 * MC.WIDE_FROM_DEVICE_WIDTH,
+  'lead': MC.LEAD_MHP_N * (2 * MC.LEAD_TRAJ_LEN * MC.LEAD_WIDTH + MC.LEAD_MHP_SELECTION),
+  'desired_curvature': 2 * MC.DESIRED_CURV_WIDTH,
+  'lead_prob': 3,
+  'lane_lines_prob': 8,
+  'meta': 55,
+  'desire_state': MC.DESIRE_PRED_WIDTH,
+  'desire_pred': MC.DESIRE_PRED_LEN * MC.DESIRE_PRED_WIDTH,
+}
+
+
+def random_outputs(batch, seed=0):
+  rng = np.random.default_rng(seed)
+  return {k: rng.standard_normal((batch, v)).astype(np.float32) for k, v in OUTPUT_SIZES.items()}
+
+
+class TestParser:
+  def test_batch_matches_single(self):
+    raw = random_outputs(4)
+    batched = {k: v.copy() for k, v in Parser().parse_outputs({k: v.copy() for k, v in raw.items()}).items()}
+
+    parser = Parser()
+    for i in range(4):
+      single = parser.parse_outputs({k: v[i:i+1].copy() for k, v in raw.items()})
+      for k, v in single.items():
+        np.testing.assert_array_equal(v[0], batched[k][i], err_msg=k)
+
+  def test_hypothesis_selection(self):
+    outs = Parser().parse_outputs(random_outputs(3, seed=1))
+    # plan hypotheses are sorted by weight, and the best one is selected
+    assert np.all(np.diff(outs['plan_weights'][:, :, 0], axis=1) <= 0)
+    np.testing.assert_array_equal(outs['plan'], outs['plan_hypotheses'][:, 0])
+
+    # each lead selection picks the hypothesis with the highest weight for that slot
+    best = np.argmax(outs['lead_weights'], axis=1)
+    for b in range(3):
+      for j in range(MC.LEAD_MHP_SELECTION):
+        np.testing.assert_array_equal(outs['lead'][b, j], outs['lead_hypotheses'][b, best[b, j]])
+        np.testing.assert_array_equal(outs['lead_stds'][b, j], outs['lead_stds_hypotheses'][b, best[b, j]])
+
+  def test_buffers_reused(self):
+    parser = Parser()
+    first = parser.parse_outputs(random_outputs(1, seed=2))['plan_stds']
+    second = parser.parse_outputs(random_outputs(1, seed=3))['plan_stds']
+    assert np.shares_memory(first, second)
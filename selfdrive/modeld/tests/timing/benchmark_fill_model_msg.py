@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+import os
+import time
+import numpy as np
+
+import cereal.messaging as messaging
+from openpilot.selfdrive.modeld.fill_model_msg import fill_model_msg, fill_pose_msg, PublishState
+from openpilot.selfdrive.modeld.parse_model_outputs import Parser
+from openpilot.selfdrive.modeld.tests.test_parse_model_outputs import random_outputs
+
+N = int(os.getenv("N", "2000"))
+
+if __name__ == "__main__":
+  outputs = Parser().parse_outputs(random_outputs(1))
+  outputs['plan'][0, :, 0] = np.linspace(0, 150, outputs['plan'].shape[1])
+  publish_state = PublishState()
+
+  t = []
+  for i in range(N):
+    st = time.perf_counter()
+    modelv2_send = messaging.new_message('modelV2')
+    drivingdata_send = messaging.new_message('drivingModelData')
+    posenet_send = messaging.new_message('cameraOdometry')
+    fill_model_msg(drivingdata_send, modelv2_send, outputs, publish_state, i, i, i, 0., 0, 0., True)
+    fill_pose_msg(posenet_send, outputs, i, 0, 0, True)
+    t.append(time.perf_counter() - st)
+
+  t = np.array(t[10:]) * 1e6
+  print(f"fill_model_msg + fill_pose_msg over {N} frames: avg {t.mean():.1f}us, median {np.median(t):.1f}us, max {t.max():.1f}us")
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Array-backed DriverMonitoring for offline evaluation.
+
+DriverMonitoring.run_step is a sequential state machine, so time is still stepped through in order, but every state
+variable is an array over K lanes. Each lane has its own DRIVER_MONITOR_SETTINGS (and always-on/RHD defaults), which
+makes a whole threshold sweep cost about as much as a single replay. The per-sample inputs are extracted from a
+route's logs once into columns. Lanes match run_step exactly for the same inputs.
+"""
+import argparse
+import math
+from collections import deque
+from dataclasses import dataclass, fields
+from multiprocessing import Pool
+
+import numpy as np
+
+from cereal import car
+from cereal.services import SERVICE_LIST
+from openpilot.selfdrive.monitoring.helpers import DRIVER_MONITOR_SETTINGS, DistractedType, EFL, W, H
+
+EventName = car.CarEvent.EventName
+EVENT_NAMES = {v: k for k, v in EventName.schema.enumerants.items()}
+NO_ALERT = -1
+
+# services dmonitoringd subscribes to, polled on driverStateV2
+DM_SERVICES = ('driverStateV2', 'liveCalibration', 'carState', 'controlsState', 'modelV2')
+DM_POLL = 'driverStateV2'
+
+
+@dataclass
+class DriverData:
+  """One side of driverStateV2, one row per sample"""
+  has_data: np.ndarray
+  face_prob: np.ndarray
+  roll: np.ndarray
+  pitch: np.ndarray
+  yaw: np.ndarray
+  pitch_std: np.ndarray
+  yaw_std: np.ndarray
+  left_blink_prob: np.ndarray
+  right_blink_prob: np.ndarray
+  left_eye_prob: np.ndarray
+  right_eye_prob: np.ndarray
+  sunglasses_prob: np.ndarray
+  not_ready_prob: np.ndarray
+  ready_prob: np.ndarray
+
+
+@dataclass
+class DriverMonitoringInputs:
+  """Everything run_step reads from its SubMaster, one row per driverStateV2 sample"""
+  valid: np.ndarray
+  wheel_on_right_prob: np.ndarray
+  left: DriverData
+  right: DriverData
+  car_speed: np.ndarray
+  driver_engaged: np.ndarray
+  standstill: np.ndarray
+  wrong_gear: np.ndarray
+  op_engaged: np.ndarray
+  brake_disengage_prob: np.ndarray
+
+  def __len__(self):
+    return len(self.valid)
+
+  @staticmethod
+  def from_samples(samples):
+    """
+    samples: iterable of (valid, sm) where sm maps the DM_SERVICES to their latest message, as run_step sees them,
+    and valid is what dmonitoringd's sm.all_checks() returned for that sample
+    """
+    cols: dict[str, list] = {k: [] for k in ('valid', 'wheel_on_right_prob', 'car_speed', 'driver_engaged', 'standstill', 'wrong_gear',
+                                            'op_engaged', 'brake_disengage_prob', 'cal_rpy')}
+    sides: dict[str, dict[str, list]] = {'left': {}, 'right': {}}
+    for valid, sm in samples:
+      cs, ds = sm['carState'], sm['driverStateV2']
+      bp = sm['modelV2'].meta.disengagePredictions.brakeDisengageProbs
+      cols['valid'].append(valid)
+      cols['wheel_on_right_prob'].append(ds.wheelOnRightProb)
+      cols['car_speed'].append(cs.vEgo)
+      cols['driver_engaged'].append(cs.steeringPressed or cs.gasPressed)
+      cols['standstill'].append(cs.standstill)
+      cols['wrong_gear'].append(cs.gearShifter in (car.CarState.GearShifter.reverse, car.CarState.GearShifter.park))
+      cols['op_engaged'].append(sm['controlsState'].enabled)
+      # run_step raises on an empty list as well, only samples it never sees may lack it
+      cols['brake_disengage_prob'].append(bp[0] if valid or len(bp) else 0.)
+      cal_rpy = sm['liveCalibration'].rpyCalib
+      cal_rpy = list(cal_rpy) if len(cal_rpy) == 3 else [0., 0., 0.]
+
+      for side, dd in (('left', ds.leftDriverData), ('right', ds.rightDriverData)):
+        c = sides[side]
+        has_data = all(len(x) > 0 for x in (dd.faceOrientation, dd.facePosition, dd.faceOrientationStd,
+                                            dd.facePositionStd, dd.readyProb, dd.notReadyProb))
+        if has_data:
+          roll, pitch, yaw = face_orientation_from_net(dd.faceOrientation, dd.facePosition, cal_rpy)
+          vals = (True, dd.faceProb, roll, pitch, yaw, dd.faceOrientationStd[0], dd.faceOrientationStd[1],
+                  dd.leftBlinkProb, dd.rightBlinkProb, dd.leftEyeProb, dd.rightEyeProb, dd.sunglassesProb,
+                  dd.notReadyProb[0], dd.readyProb[0])
+        else:
+          # the wheel position learner reads faceProb from both sides, with or without the rest of the data
+          vals = (False, dd.faceProb) + (0.,) * 12
+        for f, v in zip(fields(DriverData), vals, strict=True):
+          c.setdefault(f.name, []).append(v)
+
+    def as_array(name, v):
+      dtype = bool if name in ('valid', 'driver_engaged', 'standstill', 'wrong_gear', 'op_engaged', 'has_data') else np.float64
+      return np.array(v, dtype=dtype)
+
+    del cols['cal_rpy']
+    return DriverMonitoringInputs(left=DriverData(**{k: as_array(k, v) for k, v in sides['left'].items()}),
+                                  right=DriverData(**{k: as_array(k, v) for k, v in sides['right'].items()}),
+                                  **{k: as_array(k, v) for k, v in cols.items()})
+
+  @staticmethod
+  def from_logs(lr):
+    """
+    Samples the latest messages at each driverStateV2, like dmonitoringd's SubMaster polling on it. Messages are
+    taken as received at their logMonoTime, which stands in for the wall time SubMaster's alive and frequency checks use.
+    """
+    def gen():
+      checks = SubMasterChecks(DM_SERVICES, DM_POLL)
+      sm, received = {}, {}
+      for msg in sorted(lr, key=lambda m: m.logMonoTime):
+        which = msg.which()
+        if which not in DM_SERVICES:
+          continue
+        sm[which], received[which] = getattr(msg, which), msg.valid
+        if which == DM_POLL:
+          checks.update(msg.logMonoTime / 1e9, received)
+          received = {}
+          if len(sm) == len(DM_SERVICES):
+            yield checks.all_checks(), sm
+    return DriverMonitoringInputs.from_samples(gen())
+
+
+class SubMasterChecks:
+  """SubMaster's alive, frequency and valid bookkeeping without the sockets, for replaying all_checks() from logs"""
+  def __init__(self, services, poll):
+    self.services = services
+    update_freq = SERVICE_LIST[poll].frequency
+    self.recv_time = dict.fromkeys(services, 0.)
+    self.alive = dict.fromkeys(services, False)
+    self.freq_ok = dict.fromkeys(services, False)
+    self.valid = dict.fromkeys(services, True)
+    self.recv_dts: dict[str, deque[float]] = {}
+    self.min_freq, self.max_freq = {}, {}
+
+    # same limits as SubMaster.__init__
+    for s in services:
+      freq = max(min(SERVICE_LIST[s].frequency, update_freq), 1.)
+      if s == poll:
+        max_freq = min_freq = freq
+      else:
+        max_freq = min(freq, update_freq)
+        if SERVICE_LIST[s].frequency >= 2*update_freq:
+          min_freq = update_freq
+        elif update_freq >= 2*SERVICE_LIST[s].frequency:
+          min_freq = freq
+        else:
+          min_freq = min(freq, freq / 2.)
+      self.max_freq[s] = max_freq*1.2
+      self.min_freq[s] = min_freq*0.8
+      self.recv_dts[s] = deque(maxlen=int(10*freq))
+
+  def update(self, cur_time, received):
+    """received maps each service that got a message since the last update to that message's valid flag"""
+    # same as SubMaster.update_msgs, with conflated sockets
+    for s, valid in received.items():
+      if self.recv_time[s] > 1e-5:
+        self.recv_dts[s].append(cur_time - self.recv_time[s])
+      self.recv_time[s] = cur_time
+      self.valid[s] = valid
+
+    for s in self.services:
+      if SERVICE_LIST[s].frequency > 1e-5:
+        self.alive[s] = (cur_time - self.recv_time[s]) < (10. / SERVICE_LIST[s].frequency)
+
+        dts = self.recv_dts[s]
+        assert dts.maxlen is not None
+        recent_dts = list(dts)[-int(dts.maxlen / 10):]
+        try:
+          avg_freq = 1 / (sum(dts) / len(dts))
+          avg_freq_recent = 1 / (sum(recent_dts) / len(recent_dts))
+        except ZeroDivisionError:
+          avg_freq = 0
+          avg_freq_recent = 0
+        self.freq_ok[s] = (self.min_freq[s] <= avg_freq <= self.max_freq[s]) or (self.min_freq[s] <= avg_freq_recent <= self.max_freq[s])
+      else:
+        self.freq_ok[s] = True
+        self.alive[s] = True
+
+  def all_checks(self):
+    return all(self.alive.values()) and all(self.freq_ok[s] for s in self.services if SERVICE_LIST[s].frequency > 0.99) and all(self.valid.values())
+
+
+def face_orientation_from_net(angles_desc, pos_desc, rpy_calib):
+  # same as helpers.face_orientation_from_net, kept scalar so the angles are bit-identical
+  pitch_net, yaw_net, roll_net = angles_desc
+  face_pixel_position = ((pos_desc[0]+0.5)*W, (pos_desc[1]+0.5)*H)
+  yaw_focal_angle = math.atan2(face_pixel_position[0] - W//2, EFL)
+  pitch_focal_angle = math.atan2(face_pixel_position[1] - H//2, EFL)
+  pitch = pitch_net + pitch_focal_angle - rpy_calib[1]
+  yaw = -yaw_net + yaw_focal_angle - rpy_calib[2]
+  return roll_net, pitch, yaw
+
+
+class RunningStatArray:
+  """common.stat_live.RunningStat over K lanes, with masked pushes"""
+  def __init__(self, k, max_trackable):
+    self.max_trackable = np.broadcast_to(np.asarray(max_trackable), (k,))
+    self.M = np.zeros(k)
+    self.S = np.zeros(k)
+    self.M_last = np.zeros(k)
+    self.S_last = np.zeros(k)
+    self.n = np.zeros(k, dtype=np.int64)
+
+  def push_data(self, new_data, mask):
+    self.n = np.where(mask & ((self.max_trackable < 0) | (self.n < self.max_trackable)), self.n + 1, self.n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      M = self.M_last + (new_data - self.M_last) / self.n
+    S = self.S_last + (new_data - self.M_last) * (new_data - M)
+    first = self.n == 0
+    M = np.where(first, new_data, M)
+    S = np.where(first, self.S, S)
+    self.M = np.where(mask, M, self.M)
+    self.S = np.where(mask, S, self.S)
+    self.M_last = np.where(mask, M, self.M_last)
+    self.S_last = np.where(mask & ~first, S, np.where(mask, 0., self.S_last))
+
+  def std(self):
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return np.sqrt(np.where(self.n >= 2, self.S / (self.n - 1.), 0.))
+
+
+class RunningStatFilterArray:
+  def __init__(self, k, max_trackable=-1):
+    self.raw_stat = RunningStatArray(k, -1)
+    self.filtered_stat = RunningStatArray(k, max_trackable)
+
+  def push_and_update(self, new_data, mask):
+    _std_last = self.raw_stat.std()
+    self.raw_stat.push_data(new_data, mask)
+    _delta_std = self.raw_stat.std() - _std_last
+    self.filtered_stat.push_data(new_data, mask & (_delta_std <= 0))
+
+
+class SettingsArray:
+  """DRIVER_MONITOR_SETTINGS with every value stacked over the lanes"""
+  def __init__(self, settings: list[DRIVER_MONITOR_SETTINGS]):
+    for name in vars(settings[0]):
+      setattr(self, name, np.array([getattr(s, name) for s in settings]))
+
+
+class BatchedDriverMonitoring:
+  def __init__(self, settings: list[DRIVER_MONITOR_SETTINGS], rhd_saved=False, always_on=False):
+    k = len(settings)
+    self.k = k
+    self.settings = s = SettingsArray(settings)
+    self.always_on = np.broadcast_to(np.asarray(always_on, dtype=bool), (k,))
+    self.wheel_on_right_default = np.broadcast_to(np.asarray(rhd_saved, dtype=bool), (k,))
+
+    self.wheelpos_learner = RunningStatFilterArray(k)
+    self.pitch_offseter = RunningStatFilterArray(k, s._POSE_OFFSET_MAX_COUNT)
+    self.yaw_offseter = RunningStatFilterArray(k, s._POSE_OFFSET_MAX_COUNT)
+    self.ee1_offseter = RunningStatFilterArray(k, s._POSE_OFFSET_MAX_COUNT)
+    self.ee2_offseter = RunningStatFilterArray(k, s._POSE_OFFSET_MAX_COUNT)
+
+    zeros, false = np.zeros(k), np.zeros(k, dtype=bool)
+    self.pose_yaw, self.pose_pitch, self.pose_roll = zeros.copy(), zeros.copy(), zeros.copy()
+    self.pose_pitch_std, self.pose_yaw_std = zeros.copy(), zeros.copy()
+    self.pose_calibrated, self.pose_low_std = false.copy(), np.ones(k, dtype=bool)
+    self.cfactor_pitch, self.cfactor_yaw = np.ones(k), np.ones(k)
+    self.blink_left, self.blink_right = zeros.copy(), zeros.copy()
+    self.eev1, self.eev2 = zeros.copy(), np.ones(k)
+    self.ee1_calibrated, self.ee2_calibrated = false.copy(), false.copy()
+
+    self.distracted_types = np.zeros(k, dtype=np.int64)
+    self.driver_distracted = false.copy()
+    self.distraction_filter_x = zeros.copy()
+    self.distraction_filter_alpha = s._DT_DMON / (s._DISTRACTED_FILTER_TS + s._DT_DMON)
+    self.wheel_on_right = false.copy()
+    self.wheel_on_right_last = np.full(k, -1, dtype=np.int8)  # -1 for not set yet
+    self.face_detected = false.copy()
+    self.terminal_alert_cnt = np.zeros(k, dtype=np.int64)
+    self.terminal_time = np.zeros(k, dtype=np.int64)
+    self.step_change = zeros.copy()
+    self.active_monitoring_mode = np.ones(k, dtype=bool)
+    self.is_model_uncertain = false.copy()
+    self.hi_stds = np.zeros(k, dtype=np.int64)
+    self.threshold_pre = s._DISTRACTED_PRE_TIME_TILL_TERMINAL / s._DISTRACTED_TIME
+    self.threshold_prompt = s._DISTRACTED_PROMPT_TIME_TILL_TERMINAL / s._DISTRACTED_TIME
+
+    self.awareness, self.awareness_active, self.awareness_passive = np.ones(k), np.ones(k), np.ones(k)
+    self.alert = np.full(k, NO_ALERT, dtype=np.int64)
+    self.too_distracted = false.copy()
+    self._set_timers(np.ones(k, dtype=bool), np.ones(k, dtype=bool))
+
+  def _reset_awareness(self, mask):
+    self.awareness = np.where(mask, 1., self.awareness)
+    self.awareness_active = np.where(mask, 1., self.awareness_active)
+    self.awareness_passive = np.where(mask, 1., self.awareness_passive)
+
+  def _set_timers(self, active_monitoring, mask):
+    s = self.settings
+    keep = self.active_monitoring_mode & (self.awareness <= self.threshold_prompt)
+    distracted_step = s._DT_DMON / s._DISTRACTED_TIME
+    self.step_change = np.where(mask & keep, np.where(active_monitoring, distracted_step, 0.), self.step_change)
+    mask = mask & ~keep & ~(self.awareness <= 0.)
+
+    to_active = mask & active_monitoring
+    from_passive = to_active & ~self.active_monitoring_mode
+    to_passive = mask & ~active_monitoring
+    from_active = to_passive & self.active_monitoring_mode
+    awareness = self.awareness
+    self.awareness_passive = np.where(from_passive, awareness, self.awareness_passive)
+    self.awareness_active = np.where(from_active, awareness, self.awareness_active)
+    self.awareness = np.where(from_passive, self.awareness_active, np.where(from_active, self.awareness_passive, awareness))
+
+    self.threshold_pre = np.where(to_active, s._DISTRACTED_PRE_TIME_TILL_TERMINAL / s._DISTRACTED_TIME,
+                                  np.where(to_passive, s._AWARENESS_PRE_TIME_TILL_TERMINAL / s._AWARENESS_TIME, self.threshold_pre))
+    self.threshold_prompt = np.where(to_active, s._DISTRACTED_PROMPT_TIME_TILL_TERMINAL / s._DISTRACTED_TIME,
+                                     np.where(to_passive, s._AWARENESS_PROMPT_TIME_TILL_TERMINAL / s._AWARENESS_TIME, self.threshold_prompt))
+    self.step_change = np.where(to_active, distracted_step, np.where(to_passive, s._DT_DMON / s._AWARENESS_TIME, self.step_change))
+    self.active_monitoring_mode = np.where(to_active, True, np.where(to_passive, False, self.active_monitoring_mode))
+
+  def _set_policy(self, bp, car_speed):
+    s = self.settings
+    k1 = max(-0.00156*((car_speed-16)**2)+0.6, 0.2)
+    bp_normal = max(min(bp / k1, 0.5), 0)
+    # interp(bp_normal, [0, 0.5], [slack, strict])
+    pitch = s._POSE_PITCH_THRESHOLD_SLACK if bp_normal <= 0 else \
+      (bp_normal - 0) * (s._POSE_PITCH_THRESHOLD_STRICT - s._POSE_PITCH_THRESHOLD_SLACK) / (0.5 - 0) + s._POSE_PITCH_THRESHOLD_SLACK
+    yaw = s._POSE_YAW_THRESHOLD_SLACK if bp_normal <= 0 else \
+      (bp_normal - 0) * (s._POSE_YAW_THRESHOLD_STRICT - s._POSE_YAW_THRESHOLD_SLACK) / (0.5 - 0) + s._POSE_YAW_THRESHOLD_SLACK
+    self.cfactor_pitch = pitch / s._POSE_PITCH_THRESHOLD
+    self.cfactor_yaw = yaw / s._POSE_YAW_THRESHOLD
+
+  def _get_distracted_types(self):
+    s = self.settings
+    pitch_offset = np.minimum(np.maximum(self.pitch_offseter.filtered_stat.M, s._PITCH_MIN_OFFSET), s._PITCH_MAX_OFFSET)
+    yaw_offset = np.minimum(np.maximum(self.yaw_offseter.filtered_stat.M, s._YAW_MIN_OFFSET), s._YAW_MAX_OFFSET)
+    pitch_error = self.pose_pitch - np.where(self.pose_calibrated, pitch_offset, s._PITCH_NATURAL_OFFSET)
+    yaw_error = self.pose_yaw - np.where(self.pose_calibrated, yaw_offset, s._YAW_NATURAL_OFFSET)
+    pitch_error = np.where(pitch_error > 0, 0, np.abs(pitch_error))  # no positive pitch limit
+    yaw_error = np.abs(yaw_error)
+    pitch_threshold = np.where(self.pose_calibrated, s._POSE_PITCH_THRESHOLD*self.cfactor_pitch, s._PITCH_NATURAL_THRESHOLD)
+    pose = (pitch_error > pitch_threshold) | (yaw_error > s._POSE_YAW_THRESHOLD*self.cfactor_yaw)
+
+    blink = (self.blink_left + self.blink_right)*0.5 > s._BLINK_THRESHOLD
+
+    ee1_offset = np.maximum(np.minimum(self.ee1_offseter.filtered_stat.M, s._EE_MAX_OFFSET1), s._EE_MIN_OFFSET1)
+    e2e = np.where(self.ee1_calibrated, self.eev1 > ee1_offset * s._EE_THRESH12, self.eev1 > s._EE_THRESH11)
+
+    return pose * DistractedType.DISTRACTED_POSE + blink * DistractedType.DISTRACTED_BLINK + e2e * DistractedType.DISTRACTED_E2E
+
+  def _update_states(self, inp: DriverMonitoringInputs, t, mask):
+    s = self.settings
+    car_speed, op_engaged = inp.car_speed[t], inp.op_engaged[t]
+    left, right = inp.left, inp.right
+
+    face_seen = (left.face_prob[t] > s._FACE_THRESHOLD) | (right.face_prob[t] > s._FACE_THRESHOLD)
+    self.wheelpos_learner.push_and_update(inp.wheel_on_right_prob[t], mask & (car_speed > s._WHEELPOS_CALIB_MIN_SPEED) & face_seen)
+    wheel_on_right = np.where(self.wheelpos_learner.filtered_stat.n > s._WHEELPOS_FILTER_MIN_COUNT,
+                              self.wheelpos_learner.filtered_stat.M > s._WHEELPOS_THRESHOLD, self.wheel_on_right_default)
+    # make sure no switching when engaged
+    if op_engaged:
+      wheel_on_right = np.where(self.wheel_on_right_last >= 0, self.wheel_on_right_last.astype(bool), wheel_on_right)
+    self.wheel_on_right = np.where(mask, wheel_on_right, self.wheel_on_right)
+
+    def side(name):
+      return np.where(wheel_on_right, getattr(right, name)[t], getattr(left, name)[t])
+
+    mask = mask & side('has_data')
+    face_prob = side('face_prob')
+    face_detected = face_prob > s._FACE_THRESHOLD
+    self.face_detected = np.where(mask, face_detected, self.face_detected)
+    self.pose_roll = np.where(mask, side('roll'), self.pose_roll)
+    self.pose_pitch = np.where(mask, side('pitch'), self.pose_pitch)
+    yaw = side('yaw')
+    self.pose_yaw = np.where(mask, np.where(wheel_on_right, yaw * -1, yaw), self.pose_yaw)
+    self.wheel_on_right_last = np.where(mask, wheel_on_right, self.wheel_on_right_last).astype(np.int8)
+    self.pose_pitch_std = np.where(mask, side('pitch_std'), self.pose_pitch_std)
+    self.pose_yaw_std = np.where(mask, side('yaw_std'), self.pose_yaw_std)
+    self.pose_low_std = np.where(mask, np.maximum(self.pose_pitch_std, self.pose_yaw_std) < s._POSESTD_THRESHOLD, self.pose_low_std)
+    sunglasses_ok = side('sunglasses_prob') < s._SG_THRESHOLD
+    self.blink_left = np.where(mask, side('left_blink_prob') * (side('left_eye_prob') > s._EYE_THRESHOLD) * sunglasses_ok, self.blink_left)
+    self.blink_right = np.where(mask, side('right_blink_prob') * (side('right_eye_prob') > s._EYE_THRESHOLD) * sunglasses_ok, self.blink_right)
+    self.eev1 = np.where(mask, side('not_ready_prob'), self.eev1)
+    self.eev2 = np.where(mask, side('ready_prob'), self.eev2)
+
+    self.distracted_types = np.where(mask, self._get_distracted_types(), self.distracted_types)
+    driver_distracted = (self.distracted_types != 0) & (face_prob > s._FACE_THRESHOLD) & self.pose_low_std
+    self.driver_distracted = np.where(mask, driver_distracted, self.driver_distracted)
+    alpha = self.distraction_filter_alpha
+    self.distraction_filter_x = np.where(mask, (1. - alpha) * self.distraction_filter_x + alpha * self.driver_distracted, self.distraction_filter_x)
+
+    # update offseter
+    # only update when driver is actively driving the car above a certain speed
+    update = mask & self.face_detected & (car_speed > s._POSE_CALIB_MIN_SPEED) & self.pose_low_std & (not op_engaged or ~self.driver_distracted)
+    self.pitch_offseter.push_and_update(self.pose_pitch, update)
+    self.yaw_offseter.push_and_update(self.pose_yaw, update)
+    self.ee1_offseter.push_and_update(self.eev1, update)
+    self.ee2_offseter.push_and_update(self.eev2, update)
+
+    pose_calibrated = (self.pitch_offseter.filtered_stat.n > s._POSE_OFFSET_MIN_COUNT) & (self.yaw_offseter.filtered_stat.n > s._POSE_OFFSET_MIN_COUNT)
+    self.pose_calibrated = np.where(mask, pose_calibrated, self.pose_calibrated)
+    self.ee1_calibrated = np.where(mask, self.ee1_offseter.filtered_stat.n > s._POSE_OFFSET_MIN_COUNT, self.ee1_calibrated)
+    self.ee2_calibrated = np.where(mask, self.ee2_offseter.filtered_stat.n > s._POSE_OFFSET_MIN_COUNT, self.ee2_calibrated)
+
+    self.is_model_uncertain = np.where(mask, self.hi_stds > s._HI_STD_FALLBACK_TIME, self.is_model_uncertain)
+    self._set_timers(self.face_detected & ~self.is_model_uncertain, mask)
+    hi_std_inc = mask & self.face_detected & ~self.pose_low_std & ~self.driver_distracted
+    hi_std_reset = mask & ~hi_std_inc & self.face_detected & self.pose_low_std
+    self.hi_stds = np.where(hi_std_inc, self.hi_stds + 1, np.where(hi_std_reset, 0, self.hi_stds))
+
+  def _update_events(self, inp: DriverMonitoringInputs, t):
+    s = self.settings
+    driver_engaged, op_engaged, standstill = inp.driver_engaged[t], inp.op_engaged[t], inp.standstill[t]
+    car_speed = inp.car_speed[t]
+
+    self.alert = np.full(self.k, NO_ALERT, dtype=np.int64)
+    self.too_distracted = (self.terminal_alert_cnt >= s._MAX_TERMINAL_ALERTS) | (self.terminal_time >= s._MAX_TERMINAL_DURATION) | \
+                          (self.always_on & (self.awareness <= self.threshold_prompt))
+
+    always_on_valid = self.always_on & (not inp.wrong_gear[t])
+    reset = (driver_engaged & (self.awareness > 0) & ~self.active_monitoring_mode) | (~always_on_valid & (not op_engaged)) | \
+            (always_on_valid & (not op_engaged) & (self.awareness <= 0))
+    # always reset on disengage with normal mode; disengage resets only on red if always on
+    self._reset_awareness(reset)
+    active = ~reset
+
+    driver_attentive = self.distraction_filter_x < 0.37
+    awareness_prev = self.awareness
+
+    recovering = active & driver_attentive & self.face_detected & self.pose_low_std & (self.awareness > 0)
+    engaged_reset = recovering & driver_engaged
+    self._reset_awareness(engaged_reset)
+    recovering &= ~engaged_reset
+    active &= ~engaged_reset
+    # only restore awareness when paying attention and alert is not red
+    restored = np.minimum(self.awareness + ((s._RECOVERY_FACTOR_MAX-s._RECOVERY_FACTOR_MIN) *
+                                            (1.-self.awareness) + s._RECOVERY_FACTOR_MIN)*self.step_change, 1.)
+    self.awareness = np.where(recovering, restored, self.awareness)
+    self.awareness_passive = np.where(recovering & (self.awareness == 1.), np.minimum(self.awareness_passive + self.step_change, 1.), self.awareness_passive)
+    # don't display alert banner when awareness is recovering and has cleared orange
+    active &= ~(recovering & (self.awareness > self.threshold_prompt))
+
+    _reaching_audible = self.awareness - self.step_change <= self.threshold_prompt
+    _reaching_terminal = self.awareness - self.step_change <= 0
+    standstill_exemption = standstill & _reaching_audible
+    always_on_red_exemption = always_on_valid & (not op_engaged) & _reaching_terminal
+    always_on_lowspeed_exemption = always_on_valid & (not op_engaged) & (car_speed < s._ALWAYS_ON_ALERT_MIN_SPEED) & _reaching_audible
+
+    certainly_distracted = (self.distraction_filter_x > 0.63) & self.driver_distracted & self.face_detected
+    maybe_distracted = (self.hi_stds > s._HI_STD_FALLBACK_TIME) | ~self.face_detected
+    decrease = active & (certainly_distracted | maybe_distracted) & \
+               ~(standstill_exemption | always_on_red_exemption | always_on_lowspeed_exemption)
+    self.awareness = np.where(decrease, np.maximum(self.awareness - self.step_change, -0.1), self.awareness)
+
+    terminal = active & (self.awareness <= 0.)
+    prompt = active & ~terminal & (self.awareness <= self.threshold_prompt)
+    pre = active & ~terminal & ~prompt & (self.awareness <= self.threshold_pre)
+    am = self.active_monitoring_mode
+    self.alert = np.where(terminal, np.where(am, EventName.driverDistracted, EventName.driverUnresponsive), self.alert)
+    self.alert = np.where(prompt, np.where(am, EventName.promptDriverDistracted, EventName.promptDriverUnresponsive), self.alert)
+    self.alert = np.where(pre, np.where(am, EventName.preDriverDistracted, EventName.preDriverUnresponsive), self.alert)
+    self.terminal_time = np.where(terminal, self.terminal_time + 1, self.terminal_time)
+    self.terminal_alert_cnt = np.where(terminal & (awareness_prev > 0.), self.terminal_alert_cnt + 1, self.terminal_alert_cnt)
+
+  def run(self, inp: DriverMonitoringInputs) -> dict[str, np.ndarray]:
+    """Steps through every sample, returns the state timeline as (T, K) arrays"""
+    T = len(inp)
+    timeline = {k: np.empty((T, self.k), dtype=dtype) for k, dtype in (
+      ('awareness', np.float64), ('awareness_active', np.float64), ('awareness_passive', np.float64),
+      ('step_change', np.float64), ('alert', np.int64), ('too_distracted', bool), ('face_detected', bool),
+      ('is_distracted', bool), ('distracted_type', np.int64), ('is_low_std', bool), ('hi_std_count', np.int64),
+      ('is_active_mode', bool), ('is_rhd', bool), ('pose_pitch_offset', np.float64), ('pose_yaw_offset', np.float64))}
+
+    all_lanes = np.ones(self.k, dtype=bool)
+    for t in range(T):
+      if inp.valid[t]:
+        self._set_policy(inp.brake_disengage_prob[t], inp.car_speed[t])
+        self._update_states(inp, t, all_lanes)
+        self._update_events(inp, t)
+
+      timeline['awareness'][t] = self.awareness
+      timeline['awareness_active'][t] = self.awareness_active
+      timeline['awareness_passive'][t] = self.awareness_passive
+      timeline['step_change'][t] = self.step_change
+      timeline['alert'][t] = self.alert
+      timeline['too_distracted'][t] = self.too_distracted
+      timeline['face_detected'][t] = self.face_detected
+      timeline['is_distracted'][t] = self.driver_distracted
+      timeline['distracted_type'][t] = self.distracted_types
+      timeline['is_low_std'][t] = self.pose_low_std
+      timeline['hi_std_count'][t] = self.hi_stds
+      timeline['is_active_mode'][t] = self.active_monitoring_mode
+      timeline['is_rhd'][t] = self.wheel_on_right
+      timeline['pose_pitch_offset'][t] = self.pitch_offseter.filtered_stat.M
+      timeline['pose_yaw_offset'][t] = self.yaw_offseter.filtered_stat.M
+    return timeline
+
+
+def _run_route(args):
+  route, settings, rhd_saved, always_on = args
+  from openpilot.tools.lib.logreader import LogReader
+  inputs = DriverMonitoringInputs.from_logs(LogReader(route))
+  timeline = BatchedDriverMonitoring(settings, rhd_saved, always_on).run(inputs)
+  return route, timeline
+
+
+def sweep(routes: list[str], settings: list[DRIVER_MONITOR_SETTINGS], rhd_saved=False, always_on=False, processes=None):
+  """Runs every settings lane over every route, one route per worker process"""
+  with Pool(processes) as pool:
+    return dict(pool.imap_unordered(_run_route, [(r, settings, rhd_saved, always_on) for r in routes]))
+
+
+def summarize(route, timeline, param, values) -> str:
+  """Minimum awareness and the number of times each alert was raised, per swept value"""
+  lines = [route]
+  alert = timeline['alert']
+  rising = np.vstack([alert[:1] != NO_ALERT, (alert[1:] != alert[:-1]) & (alert[1:] != NO_ALERT)])
+  for i, v in enumerate(values):
+    names = {EVENT_NAMES[int(e)]: int(c) for e, c in zip(*np.unique(alert[:, i][rising[:, i]], return_counts=True), strict=True)}
+    lines.append(f"  {param}={v}: min awareness {timeline['awareness'][:, i].min():.3f}, alerts {names}")
+  return "\n".join(lines)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Sweep a DRIVER_MONITOR_SETTINGS value over routes and count the resulting alerts")
+  parser.add_argument("routes", nargs="+")
+  parser.add_argument("--param", default="_DISTRACTED_TIME", help="settings attribute to sweep")
+  parser.add_argument("--values", type=float, nargs="+", required=True)
+  parser.add_argument("--always-on", action="store_true")
+  parser.add_argument("-j", "--processes", type=int, default=None)
+  args = parser.parse_args()
+
+  settings = []
+  for v in args.values:
+    st = DRIVER_MONITOR_SETTINGS()
+    setattr(st, args.param, v)
+    settings.append(st)
+
+  results = sweep(args.routes, settings, always_on=args.always_on, processes=args.processes)
+  for route, timeline in results.items():
+    print(summarize(route, timeline, args.param, args.values))
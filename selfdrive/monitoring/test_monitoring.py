@@ -1,8 +1,10 @@
 import numpy as np
+import pytest
 
 from cereal import car, log
 from openpilot.common.realtime import DT_DMON
 from openpilot.selfdrive.monitoring.helpers import DriverMonitoring, DRIVER_MONITOR_SETTINGS
+from openpilot.selfdrive.monitoring.batch import BatchedDriverMonitoring, DriverMonitoringInputs, NO_ALERT, summarize
 
 EventName = car.CarEvent.EventName
 dm_settings = DRIVER_MONITOR_SETTINGS()
@@ -204,3 +206,150 @@ class TestMonitoring:
     assert EventName.driverUnresponsive in \
                               events[int((INVISIBLE_SECONDS_TO_RED-1+DT_DMON*d_status.settings._HI_STD_FALLBACK_TIME+0.1)/DT_DMON)].names
 
+
+
+def make_random_samples(n, seed=0, partial=0.):
+  # piecewise-constant driver/car regimes with noise, so every branch of the state machine gets visited.
+  # partial is the chance of a side having its faceProb but none of the list fields
+  rng = np.random.default_rng(seed)
+  samples = []
+  for i in range(n):
+    if i % 200 == 0:
+      face, distracted, uncertain = rng.random() < 0.8, rng.random() < 0.4, rng.random() < 0.15
+      speed, engaged, interaction, rhd = rng.choice([0., 8., 12., 20.]), rng.random() < 0.8, rng.random() < 0.1, rng.random() < 0.2
+      standstill, gear = speed == 0. and rng.random() < 0.5, rng.choice(['drive', 'reverse', 'park'], p=[0.8, 0.1, 0.1])
+
+    sm = {}
+    ds = sm['driverStateV2'] = log.DriverStateV2.new_message()
+    ds.wheelOnRightProb = float(np.clip(rhd + rng.normal(0, 0.2), 0, 1))
+    for dd in (ds.leftDriverData, ds.rightDriverData):
+      if rng.random() < 0.02:
+        continue  # missing driver data
+      dd.faceProb = float(rng.uniform(0.6, 1.) if face else rng.uniform(0., 0.8))
+      if partial and rng.random() < partial:
+        continue
+      dd.faceOrientation = (rng.normal(0, 0.3 if distracted else 0.1, 3)).tolist()
+      dd.facePosition = rng.normal(0, 0.1, 2).tolist()
+      dd.faceOrientationStd = rng.uniform(0.2, 0.5 if uncertain else 0.32, 3).tolist()
+      dd.facePositionStd = rng.uniform(0, 0.1, 2).tolist()
+      dd.leftEyeProb, dd.rightEyeProb = rng.uniform(0.5, 1., 2).tolist()
+      dd.leftBlinkProb, dd.rightBlinkProb = (rng.uniform(0.7, 1., 2) if distracted else rng.uniform(0., 0.9, 2)).tolist()
+      dd.sunglassesProb = float(rng.uniform(0., 1.))
+      dd.notReadyProb = [float(rng.uniform(0., 0.4)), 0.]
+      dd.readyProb = [float(rng.uniform(0., 1.)), 0., 0., 0.]
+    sm['liveCalibration'] = log.LiveCalibrationData.new_message(rpyCalib=rng.normal(0, 0.02, 3).tolist())
+    sm['carState'] = car.CarState.new_message(vEgo=float(speed + rng.normal(0, 0.5)), standstill=bool(standstill), gearShifter=str(gear),
+                                              steeringPressed=bool(interaction and rng.random() < 0.5), gasPressed=bool(interaction and rng.random() < 0.5))
+    sm['controlsState'] = log.ControlsState.new_message(enabled=bool(engaged))
+    mdl = sm['modelV2'] = log.ModelDataV2.new_message()
+    mdl.meta.disengagePredictions.brakeDisengageProbs = rng.uniform(0, 1, 5).tolist()
+    samples.append((rng.random() > 0.02, {k: v.as_reader() for k, v in sm.items()}))
+  return samples
+
+
+class TestBatchedMonitoring:
+  def test_matches_run_step(self):
+    settings = [DRIVER_MONITOR_SETTINGS() for _ in range(4)]
+    settings[1]._DISTRACTED_TIME = 5.
+    settings[1]._POSE_OFFSET_MIN_COUNT = 200
+    settings[1]._POSE_CALIB_MIN_SPEED = 5
+    settings[2]._WHEELPOS_FILTER_MIN_COUNT = 50
+    settings[2]._POSE_OFFSET_MAX_COUNT = 300
+    settings[2]._HI_STD_FALLBACK_TIME = 30
+    settings[3]._AWARENESS_TIME = 10.
+    settings[3]._MAX_TERMINAL_ALERTS = 1
+    rhd_saved, always_on = [False, True, False, False], [False, False, True, True]
+
+    self._check_matches_run_step(settings, rhd_saved, always_on, make_random_samples(6000))
+
+  def test_partial_driver_data_matches_run_step(self):
+    # sides with a faceProb but no lists still feed run_step's wheel position learner
+    settings = [DRIVER_MONITOR_SETTINGS() for _ in range(2)]
+    for s in settings:
+      s._AWARENESS_TIME = 10.
+      s._DISTRACTED_TIME = 5.
+    settings[1]._WHEELPOS_FILTER_MIN_COUNT = 50
+    self._check_matches_run_step(settings, [False, True], [False, True], make_random_samples(6000, seed=1, partial=0.5))
+
+  def test_empty_brake_disengage_probs(self):
+    samples = make_random_samples(2)
+    for _, sm in samples:
+      mdl = log.ModelDataV2.new_message()
+      mdl.meta.disengagePredictions.brakeDisengageProbs = []
+      sm['modelV2'] = mdl.as_reader()
+
+    # run_step is never called on invalid samples, so they may lack it
+    inputs = DriverMonitoringInputs.from_samples([(False, sm) for _, sm in samples])
+    assert not inputs.valid.any()
+
+    with pytest.raises(IndexError):
+      DriverMonitoring().run_step(samples[0][1])
+    with pytest.raises(IndexError):
+      DriverMonitoringInputs.from_samples([(True, sm) for _, sm in samples])
+
+  def test_from_logs_all_checks(self):
+    # 30s at each service's rate, with carState dropping out between 10s and 12s and one invalid modelV2
+    services = {'driverStateV2': 20, 'modelV2': 20, 'liveCalibration': 4, 'carState': 100, 'controlsState': 100}
+    msgs = []
+    for offset, (s, freq) in enumerate(services.items()):
+      for i in range(30 * freq):
+        t = i / freq
+        if s == 'carState' and 10. <= t < 12.:
+          continue
+        msg = log.Event.new_message(logMonoTime=int((t + 0.001 * (4 - offset)) * 1e9), valid=not (s == 'modelV2' and i == 400))
+        dat = msg.init(s)
+        if s == 'modelV2':
+          dat.meta.disengagePredictions.brakeDisengageProbs = [0.1] * 5
+        msgs.append(msg.as_reader())
+
+    inputs = DriverMonitoringInputs.from_logs(msgs)
+    t = np.arange(len(inputs)) / 20
+    assert not inputs.valid[(t > 10.2) & (t < 12.)].any()
+    assert not inputs.valid[t == 20.].any()
+    assert inputs.valid[(t > 1.) & (t < 10.)].all()
+    assert inputs.valid[(t > 12.1) & (t < 30.) & (t != 20.)].all()
+
+  def test_summarize(self):
+    settings = [DRIVER_MONITOR_SETTINGS() for _ in range(2)]
+    for s, v in zip(settings, (5., 10.), strict=True):
+      s._AWARENESS_TIME = v
+    inputs = DriverMonitoringInputs.from_samples(make_random_samples(2000, seed=1, partial=0.5))
+    timeline = BatchedDriverMonitoring(settings).run(inputs)
+    assert (timeline['alert'] != NO_ALERT).any(axis=0).all()
+
+    out = summarize("route", timeline, "_AWARENESS_TIME", [5., 10.])
+    lines = out.splitlines()
+    assert lines[0] == "route"
+    assert lines[1].startswith("  _AWARENESS_TIME=5.0: min awareness")
+    assert all("'driverUnresponsive': 1" in line for line in lines[1:])
+
+  def _check_matches_run_step(self, settings, rhd_saved, always_on, samples):
+    inputs = DriverMonitoringInputs.from_samples(samples)
+    batched = BatchedDriverMonitoring(settings, rhd_saved, always_on)
+    timeline = batched.run(inputs)
+
+    for lane, s in enumerate(settings):
+      DM = DriverMonitoring(rhd_saved=rhd_saved[lane], settings=s, always_on=always_on[lane])
+      for t, (valid, sm) in enumerate(samples):
+        assert inputs.valid[t] == valid
+        if valid:
+          DM.run_step(sm)
+        names = [e for e in DM.current_events.names if e != EventName.tooDistracted]
+        assert timeline['alert'][t, lane] == (names[0] if names else NO_ALERT)
+        assert timeline['too_distracted'][t, lane] == (EventName.tooDistracted in DM.current_events.names)
+        expected = {
+          'awareness': DM.awareness, 'awareness_active': DM.awareness_active, 'awareness_passive': DM.awareness_passive,
+          'step_change': DM.step_change, 'face_detected': DM.face_detected, 'is_distracted': DM.driver_distracted,
+          'distracted_type': sum(DM.distracted_types), 'is_low_std': DM.pose.low_std, 'hi_std_count': DM.hi_stds,
+          'is_active_mode': DM.active_monitoring_mode, 'is_rhd': DM.wheel_on_right,
+        }
+        for key, v in expected.items():
+          assert timeline[key][t, lane] == v, (key, t, lane)
+        assert timeline['pose_pitch_offset'][t, lane] == DM.pose.pitch_offseter.filtered_stat.M
+        assert timeline['pose_yaw_offset'][t, lane] == DM.pose.yaw_offseter.filtered_stat.M
+
+      assert batched.wheelpos_learner.filtered_stat.n[lane] == DM.wheelpos_learner.filtered_stat.n
+      assert batched.wheelpos_learner.filtered_stat.M[lane] == DM.wheelpos_learner.filtered_stat.M
+
+      # the sequence should actually have exercised the alerting paths
+      assert (timeline['alert'][:, lane] != NO_ALERT).any()
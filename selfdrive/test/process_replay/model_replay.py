@@ -18,6 +18,7 @@ MAX_FRAMES = 100 if PC else 600
 
 NO_MODEL = "NO_MODEL" in os.environ
 SEND_EXTRA_INPUTS = bool(int(os.getenv("SEND_EXTRA_INPUTS", "0")))
+OFFLINE_MODELD = bool(int(os.getenv("OFFLINE_MODELD", "0")))
 
 
 def get_log_fn(ref_commit, test_route):
@@ -62,7 +63,11 @@ def model_replay(lr, frs):
   modeld = get_process_config("modeld")
   dmonitoringmodeld = get_process_config("dmonitoringmodeld")
 
-  modeld_msgs = replay_process(modeld, modeld_logs, frs)
+  if OFFLINE_MODELD:
+    from openpilot.selfdrive.test.process_replay.model_replay_offline import OfflineModelRunner
+    modeld_msgs = OfflineModelRunner(frs).run(modeld_logs)
+  else:
+    modeld_msgs = replay_process(modeld, modeld_logs, frs)
   dmonitoringmodeld_msgs = replay_process(dmonitoringmodeld, dmodeld_logs, frs)
   return modeld_msgs + dmonitoringmodeld_msgs
 
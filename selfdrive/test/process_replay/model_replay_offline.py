@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+import os
+import sys
+import queue
+import argparse
+import threading
+import time
+import numpy as np
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import Any
+
+import capnp
+import cereal.messaging as messaging
+from cereal import log
+from msgq.visionipc import VisionIpcServer, VisionIpcClient
+from openpilot.common.filter_simple import FirstOrderFilter
+from openpilot.common.transformations.camera import DEVICE_CAMERAS
+from openpilot.common.transformations.model import get_warp_matrix
+from openpilot.selfdrive.car.car_helpers import get_demo_car_params
+from openpilot.selfdrive.controls.lib.desire_helper import DesireHelper
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.fill_model_msg import fill_model_msg, fill_pose_msg, PublishState
+from openpilot.selfdrive.modeld.modeld import ModelState
+from openpilot.selfdrive.modeld.models.commonmodel_pyx import CLContext
+from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.process_replay import get_process_config
+from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state
+from openpilot.tools.lib.framereader import BaseFrameReader
+
+# services modeld subscribes to, other than the camera states
+SM_SERVICES = ["deviceState", "carState", "liveCalibration", "driverMonitoringState", "carControl"]
+PROCESSING_TIME = get_process_config("modeld").processing_time
+
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+QUEUE_DEPTH = int(os.getenv("QUEUE_DEPTH", "4"))
+
+# not compared against process replay, same as in model_replay: logMonoTime and modelExecutionTime are wall clock
+# times, and process replay's modeld drops frames (frameDropPerc) whenever it falls behind its VisionIpc stream
+COMPARE_IGNORE = ['logMonoTime', 'modelV2.frameDropPerc', 'modelV2.modelExecutionTime', 'drivingModelData.frameDropPerc']
+
+
+@dataclass
+class FrameTask:
+  """Everything modeld would have read from its SubMaster and VisionIpc clients for one model frame"""
+  main_state: capnp._DynamicStructReader
+  extra_state: capnp._DynamicStructReader
+  log_mono_time: int
+  frame_id: int
+  model_transform_main: np.ndarray
+  model_transform_extra: np.ndarray
+  live_calib_seen: bool
+  is_rhd: bool
+  car_state: capnp._DynamicStructReader
+  lat_active: bool
+  main_img: np.ndarray | None = None
+  extra_img: np.ndarray | None = None
+  input_imgs: np.ndarray | None = None
+  big_input_imgs: np.ndarray | None = None
+  outputs: dict[str, np.ndarray] | None = None
+  meta: dict[str, Any] = field(default_factory=dict)
+
+
+_DONE = object()
+POLL_INTERVAL = 0.1
+
+
+class _Pipeline:
+  """
+  Queues and threads shared by the stages. The first failure in any stage cancels the rest, so producers
+  blocked on a full queue give up instead of waiting for a consumer that already stopped.
+  """
+  def __init__(self, queue_depth: int):
+    self.queue_depth = queue_depth
+    self.cancel = threading.Event()
+    self.error: BaseException | None = None
+    self.threads: list[threading.Thread] = []
+
+  def new_queue(self) -> queue.Queue:
+    return queue.Queue(self.queue_depth)
+
+  def fail(self, e: BaseException) -> None:
+    if self.error is None:
+      self.error = e
+    self.cancel.set()
+
+  def put(self, q: queue.Queue, item: Any) -> bool:
+    while not self.cancel.is_set():
+      try:
+        q.put(item, timeout=POLL_INTERVAL)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def get(self, q: queue.Queue) -> Any:
+    while not self.cancel.is_set():
+      try:
+        return q.get(timeout=POLL_INTERVAL)
+      except queue.Empty:
+        pass
+    return _DONE
+
+  def start(self, target: Callable[..., None], *args: Any) -> None:
+    def run():
+      try:
+        target(*args)
+      except BaseException as e:
+        self.fail(e)
+    th = threading.Thread(target=run, daemon=True)
+    th.start()
+    self.threads.append(th)
+
+  def feed(self, it: Iterable[Any], out_q: queue.Queue) -> None:
+    for item in it:
+      if not self.put(out_q, item):
+        return
+    self.put(out_q, _DONE)
+
+  def stage(self, fn: Callable[[Any], Any], in_q: queue.Queue, out_q: queue.Queue) -> None:
+    while (item := self.get(in_q)) is not _DONE:
+      if not self.put(out_q, fn(item)):
+        return
+    self.put(out_q, _DONE)
+
+  def join(self) -> None:
+    for th in self.threads:
+      th.join()
+    if self.error is not None:
+      raise self.error
+
+
+def _batched(it: Iterable[Any], n: int) -> Iterator[list[Any]]:
+  batch = []
+  for x in it:
+    batch.append(x)
+    if len(batch) == n:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def default_reader(service: str) -> capnp._DynamicStructReader:
+  return getattr(messaging.new_message(service).as_reader(), service)
+
+
+def get_frame_tasks(msgs: list[capnp._DynamicStructReader], main_wide_camera: bool, use_extra_client: bool) -> Iterator[FrameTask]:
+  """
+  Replays the message ordering modeld sees in process replay: every message up to and including the
+  camera state(s) of a frame is visible in the SubMaster when that frame is run.
+  """
+  main_state_name = "wideRoadCameraState" if main_wide_camera else "roadCameraState"
+  sm = {s: default_reader(s) for s in SM_SERVICES}
+  seen: set[str] = set()
+  updated: set[str] = set()
+
+  model_transform_main = np.zeros((3, 3), dtype=np.float32)
+  model_transform_extra = np.zeros((3, 3), dtype=np.float32)
+  live_calib_seen = False
+  main_state, extra_state = None, None
+  road_camera_state = default_reader("roadCameraState")
+
+  for msg in msgs:
+    which = msg.which()
+    if which in SM_SERVICES:
+      sm[which] = getattr(msg, which)
+      seen.add(which)
+      updated.add(which)
+      continue
+    elif which == "roadCameraState":
+      road_camera_state = msg.roadCameraState
+      seen.add(which)
+
+    if which == main_state_name:
+      main_state = msg
+    elif use_extra_client and which == "wideRoadCameraState":
+      extra_state = msg
+    else:
+      continue
+
+    if main_state is None or (use_extra_client and extra_state is None):
+      continue
+    if not use_extra_client:
+      extra_state = main_state
+
+    if "liveCalibration" in updated and "roadCameraState" in seen and "deviceState" in seen:
+      device_from_calib_euler = np.array(sm["liveCalibration"].rpyCalib, dtype=np.float32)
+      dc = DEVICE_CAMERAS[(str(sm['deviceState'].deviceType), str(road_camera_state.sensor))]
+      model_transform_main = get_warp_matrix(device_from_calib_euler, dc.ecam.intrinsics if main_wide_camera else dc.fcam.intrinsics, False).astype(np.float32)
+      model_transform_extra = get_warp_matrix(device_from_calib_euler, dc.ecam.intrinsics, True).astype(np.float32)
+      live_calib_seen = True
+
+    yield FrameTask(main_state=main_state, extra_state=extra_state, log_mono_time=msg.logMonoTime,
+                    frame_id=road_camera_state.frameId, model_transform_main=model_transform_main,
+                    model_transform_extra=model_transform_extra, live_calib_seen=live_calib_seen,
+                    is_rhd=sm["driverMonitoringState"].isRHD, car_state=sm["carState"], lat_active=sm["carControl"].latActive)
+    updated.clear()
+    main_state, extra_state = None, None
+
+
+class OfflineModelRunner:
+  """
+  Runs modeld over logged frames without the process/msgq machinery. Decoding, warping, the model itself and
+  message filling run as a pipeline of threads; only the model stage carries the recurrent state, so it
+  processes frames strictly in order while the other stages work ahead in batches.
+  """
+  def __init__(self, frs: dict[str, BaseFrameReader], batch_size: int = BATCH_SIZE, queue_depth: int = QUEUE_DEPTH):
+    self.frs = {k: v for k, v in frs.items() if k in ("roadCameraState", "wideRoadCameraState")}
+    self.batch_size = batch_size
+    self.queue_depth = queue_depth
+    self.use_extra_client = len(self.frs) == 2
+    self.main_wide_camera = "roadCameraState" not in self.frs
+
+    self.cl_context = CLContext()
+    self.model = ModelState(self.cl_context)
+    assert self.model.model.getCLBuffer("input_imgs") is None, "offline replay needs a runner with host input buffers (ONNX)"
+    self.timings = {'decode': 0., 'warp': 0., 'model': 0., 'fill': 0.}
+
+    # frames are warped by the same OpenCL code as in modeld, so they go through a private VisionIpc server
+    vipc_name = f"modeld_offline_{os.getpid()}"
+    self.vipc_server = VisionIpcServer(vipc_name)
+    self.vipc_clients = {}
+    for state, fr in self.frs.items():
+      meta = meta_from_camera_state(state)
+      self.vipc_server.create_buffers(meta.stream, 2, False, fr.w, fr.h)
+    self.vipc_server.start_listener()
+    for state in self.frs:
+      meta = meta_from_camera_state(state)
+      client = VisionIpcClient(vipc_name, meta.stream, False, self.cl_context)
+      while not client.connect(False):
+        time.sleep(0.01)
+      self.vipc_clients[state] = client
+
+  def _decode(self, batch: list[FrameTask]) -> list[FrameTask]:
+    t = time.perf_counter()
+    for task in batch:
+      task.main_img = self.frs[task.main_state.which()].get(getattr(task.main_state, task.main_state.which()).frameId, pix_fmt="nv12")[0]
+      if self.use_extra_client:
+        task.extra_img = self.frs[task.extra_state.which()].get(getattr(task.extra_state, task.extra_state.which()).frameId, pix_fmt="nv12")[0]
+    self.timings['decode'] += time.perf_counter() - t
+    return batch
+
+  def _to_vision_buf(self, state_msg: capnp._DynamicStructReader, img: np.ndarray):
+    which = state_msg.which()
+    camera_state = getattr(state_msg, which)
+    self.vipc_server.send(meta_from_camera_state(which).stream, img.flatten().tobytes(),
+                          camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
+    buf = self.vipc_clients[which].recv()
+    assert buf is not None
+    return buf
+
+  def _warp(self, batch: list[FrameTask]) -> list[FrameTask]:
+    # ModelFrame keeps the previous frame, so warping is sequential too, just ahead of the model
+    t = time.perf_counter()
+    for task in batch:
+      buf_main = self._to_vision_buf(task.main_state, task.main_img)
+      task.input_imgs = self.model.frame.prepare(buf_main, task.model_transform_main.flatten(), None).copy()
+      if self.use_extra_client:
+        buf_extra = self._to_vision_buf(task.extra_state, task.extra_img)
+      else:
+        buf_extra = buf_main
+      task.big_input_imgs = self.model.wide_frame.prepare(buf_extra, task.model_transform_extra.flatten(), None).copy()
+      task.main_img, task.extra_img = None, None
+    self.timings['warp'] += time.perf_counter() - t
+    return batch
+
+  def _fill(self, batch: list[FrameTask]) -> list[capnp._DynamicStructReader]:
+    t = time.perf_counter()
+    out = []
+    for task in batch:
+      if task.outputs is None:
+        continue
+      e = task.meta
+      modelv2_send = messaging.new_message('modelV2')
+      drivingdata_send = messaging.new_message('drivingModelData')
+      posenet_send = messaging.new_message('cameraOdometry')
+      fill_model_msg(drivingdata_send, modelv2_send, task.outputs, self.publish_state, e['vipc_frame_id'], e['vipc_frame_id_extra'],
+                     task.frame_id, e['frame_drop_ratio'], e['timestamp_eof'], e['model_execution_time'], task.live_calib_seen)
+      modelv2_send.modelV2.meta.laneChangeState = e['lane_change_state']
+      modelv2_send.modelV2.meta.laneChangeDirection = e['lane_change_direction']
+      drivingdata_send.drivingModelData.meta.laneChangeState = e['lane_change_state']
+      drivingdata_send.drivingModelData.meta.laneChangeDirection = e['lane_change_direction']
+      fill_pose_msg(posenet_send, task.outputs, e['vipc_frame_id'], e['vipc_dropped_frames'], e['timestamp_eof'], task.live_calib_seen)
+
+      for m in (modelv2_send, drivingdata_send, posenet_send):
+        m.logMonoTime = task.log_mono_time + int(PROCESSING_TIME * 1e9)
+        out.append(m.as_reader())
+    self.timings['fill'] += time.perf_counter() - t
+    return out
+
+  def run(self, lr: Iterable[capnp._DynamicStructReader]) -> list[capnp._DynamicStructReader]:
+    msgs = sorted(migrate_all(lr, old_logtime=True, camera_states=True), key=lambda m: m.logMonoTime)
+    CP = next((m.carParams for m in msgs if m.which() == "carParams"), None) or get_demo_car_params()
+    steer_delay = CP.steerActuatorDelay + .2
+
+    self.publish_state = PublishState()
+    DH = DesireHelper()
+    frame_dropped_filter = FirstOrderFilter(0., 10., 1. / ModelConstants.MODEL_FREQ)
+    last_vipc_frame_id = 0
+    run_count = 0
+
+    pipe = _Pipeline(self.queue_depth)
+    decode_q, warp_q, model_q, fill_in_q, fill_q = (pipe.new_queue() for _ in range(5))
+    results: list[list[capnp._DynamicStructReader]] = []
+
+    def collect():
+      while (item := pipe.get(fill_q)) is not _DONE:
+        results.append(item)
+
+    pipe.start(pipe.feed, _batched(get_frame_tasks(msgs, self.main_wide_camera, self.use_extra_client), self.batch_size), decode_q)
+    pipe.start(pipe.stage, self._decode, decode_q, warp_q)
+    pipe.start(pipe.stage, self._warp, warp_q, model_q)
+    pipe.start(pipe.stage, self._fill, fill_in_q, fill_q)
+    pipe.start(collect)
+
+    # model stage, carries the recurrent state so it runs in order on this thread
+    try:
+      while (batch := pipe.get(model_q)) is not _DONE:
+        t = time.perf_counter()
+        for task in batch:
+          main_state = getattr(task.main_state, task.main_state.which())
+          extra_state = getattr(task.extra_state, task.extra_state.which())
+
+          traffic_convention = np.zeros(2)
+          traffic_convention[int(task.is_rhd)] = 1
+          vec_desire = np.zeros(ModelConstants.DESIRE_LEN, dtype=np.float32)
+          if DH.desire >= 0 and DH.desire < ModelConstants.DESIRE_LEN:
+            vec_desire[DH.desire] = 1
+
+          vipc_dropped_frames = max(0, main_state.frameId - last_vipc_frame_id - 1)
+          frames_dropped = frame_dropped_filter.update(min(vipc_dropped_frames, 10))
+          if run_count < 10:
+            frame_dropped_filter.x = 0.
+            frames_dropped = 0.
+          run_count = run_count + 1
+
+          inputs: dict[str, np.ndarray] = {
+            'desire': vec_desire,
+            'traffic_convention': traffic_convention,
+            'lateral_control_params': np.array([task.car_state.vEgo, steer_delay], dtype=np.float32),
+          }
+          mt1 = time.perf_counter()
+          self.model.model.setInputBuffer("input_imgs", task.input_imgs)
+          self.model.model.setInputBuffer("big_input_imgs", task.big_input_imgs)
+          outputs = self.model.run_prepared(inputs, vipc_dropped_frames > 0)
+          mt2 = time.perf_counter()
+          task.input_imgs, task.big_input_imgs = None, None
+
+          if outputs is not None:
+            # outputs are views into buffers the next frame reuses
+            task.outputs = {k: v.copy() for k, v in outputs.items()}
+            desire_state = task.outputs['desire_state'][0].reshape(-1)
+            lane_change_prob = desire_state[log.Desire.laneChangeLeft].item() + desire_state[log.Desire.laneChangeRight].item()
+            DH.update(task.car_state, task.lat_active, lane_change_prob)
+            task.meta = {
+              'vipc_frame_id': main_state.frameId,
+              'vipc_frame_id_extra': extra_state.frameId,
+              'vipc_dropped_frames': vipc_dropped_frames,
+              'frame_drop_ratio': frames_dropped / (1 + frames_dropped),
+              'timestamp_eof': main_state.timestampEof,
+              'model_execution_time': mt2 - mt1,
+              'lane_change_state': DH.lane_change_state,
+              'lane_change_direction': DH.lane_change_direction,
+            }
+          last_vipc_frame_id = main_state.frameId
+        self.timings['model'] += time.perf_counter() - t
+        if not pipe.put(fill_in_q, batch):
+          break
+      else:
+        pipe.put(fill_in_q, _DONE)
+    except BaseException as e:
+      pipe.fail(e)
+
+    pipe.join()
+    return [m for item in results for m in item]
+
+
+if __name__ == "__main__":
+  from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_diff
+  from openpilot.selfdrive.test.process_replay.model_replay import TEST_ROUTE, SEGMENT, MAX_FRAMES, trim_logs_to_max_frames
+  from openpilot.selfdrive.test.process_replay.process_replay import replay_process
+  from openpilot.tools.lib.framereader import FrameReader
+  from openpilot.tools.lib.logreader import LogReader
+  from openpilot.tools.lib.openpilotci import get_url
+
+  parser = argparse.ArgumentParser(description="Run modeld offline over a segment, optionally comparing against process replay")
+  parser.add_argument("--route", default=TEST_ROUTE)
+  parser.add_argument("--segment", type=int, default=SEGMENT)
+  parser.add_argument("--max-frames", type=int, default=MAX_FRAMES)
+  parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+  parser.add_argument("--compare", action="store_true",
+                      help="also run modeld through process replay and diff the outputs, except for the timing dependent " + ", ".join(COMPARE_IGNORE))
+  args = parser.parse_args()
+
+  lr = list(LogReader(get_url(args.route, args.segment)))
+  frs = {
+    'roadCameraState': FrameReader(get_url(args.route, args.segment, log_type="fcamera"), readahead=True),
+    'wideRoadCameraState': FrameReader(get_url(args.route, args.segment, log_type="ecamera"), readahead=True),
+  }
+  modeld_logs = trim_logs_to_max_frames(lr, args.max_frames, {"roadCameraState", "wideRoadCameraState"}, {"roadEncodeIdx", "wideRoadEncodeIdx", "carParams"})
+  modeld_logs = [msg for msg in modeld_logs if msg.which() != 'liveCalibration']
+  for s in ('liveCalibration', 'deviceState'):
+    msg = next(msg for msg in lr if msg.which() == s).as_builder()
+    msg.logMonoTime = lr[0].logMonoTime
+    modeld_logs.insert(1, msg.as_reader())
+
+  runner = OfflineModelRunner(frs, batch_size=args.batch_size)
+  st = time.monotonic()
+  offline_msgs = runner.run(modeld_logs)
+  et = time.monotonic()
+  n_frames = sum(m.which() == 'modelV2' for m in offline_msgs)
+  print(f"offline: {n_frames} frames in {et - st:.2f}s ({n_frames / (et - st):.1f} fps)")
+  print("stage times: " + ", ".join(f"{k} {v:.2f}s" for k, v in runner.timings.items()))
+
+  if args.compare:
+    st = time.monotonic()
+    online_msgs = replay_process(get_process_config("modeld"), modeld_logs, frs)
+    print(f"process replay: {time.monotonic() - st:.2f}s")
+
+    results: Any = {args.route: {"modeld": compare_logs(online_msgs, offline_msgs, ignore_fields=COMPARE_IGNORE)}}
+    diff_short, _, failed = format_diff(results, {args.route: {"modeld": {'ref': 'process replay', 'new': 'offline'}}}, "process replay")
+    print(diff_short)
+    sys.exit(int(failed))
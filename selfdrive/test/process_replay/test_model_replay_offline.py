@@ -0,0 +1,198 @@
+import pickle
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from cereal import car, log
+import openpilot.selfdrive.modeld.modeld as modeld
+import openpilot.selfdrive.test.process_replay.model_replay_offline as offline
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.modeld.modeld import ModelState
+from openpilot.selfdrive.test.process_replay.model_replay_offline import FrameTask, OfflineModelRunner, _Pipeline
+
+TIMEOUT = 10
+IMG_SIZE = 16
+OUTPUT_SLICES = {
+  'hidden_state': slice(0, ModelConstants.FEATURE_LEN),
+  'desired_curvature': slice(ModelConstants.FEATURE_LEN, ModelConstants.FEATURE_LEN + ModelConstants.PREV_DESIRED_CURV_LEN),
+  'desire_state': slice(ModelConstants.FEATURE_LEN + ModelConstants.PREV_DESIRED_CURV_LEN,
+                        ModelConstants.FEATURE_LEN + ModelConstants.PREV_DESIRED_CURV_LEN + ModelConstants.DESIRE_LEN),
+}
+OUTPUT_LEN = OUTPUT_SLICES['desire_state'].stop
+
+
+class FakeFrame:
+  # like ModelFrame, the prepared input holds the previous and the current warped frame
+  def __init__(self, context):
+    self.prev = np.zeros(IMG_SIZE, dtype=np.float32)
+
+  def prepare(self, buf, transform, cl_buf):
+    cur = (buf + transform.sum()).astype(np.float32)
+    out = np.concatenate([self.prev, cur])
+    self.prev = cur
+    return out
+
+
+class FakeRunner:
+  # every output depends on every input, so a difference in any input or the recurrent state shows up
+  def __init__(self, paths, output, *args):
+    self.output = output
+    self.inputs = {}
+
+  def addInput(self, name, buf):
+    self.inputs[name] = buf
+
+  def setInputBuffer(self, name, buf):
+    self.inputs[name] = buf
+
+  def getCLBuffer(self, name):
+    return None
+
+  def execute(self):
+    x = sum(float(np.dot(v, np.linspace(0.1, 1., len(v)))) for _, v in sorted(self.inputs.items()))
+    self.output[:] = np.sin(x + np.arange(len(self.output)))
+
+
+class FakeParser:
+  def parse_outputs(self, outs):
+    return outs
+
+
+def make_model_state(monkeypatch, tmp_path):
+  metadata = tmp_path / "metadata.pkl"
+  metadata.write_bytes(pickle.dumps({'output_slices': OUTPUT_SLICES, 'output_shapes': {'outputs': (1, OUTPUT_LEN)}}))
+  monkeypatch.setattr(modeld, "METADATA_PATH", metadata)
+  monkeypatch.setattr(modeld, "ModelFrame", FakeFrame)
+  monkeypatch.setattr(modeld, "ModelRunner", FakeRunner)
+  monkeypatch.setattr(modeld, "Parser", FakeParser)
+  return ModelState(None)
+
+
+def run_with_timeout(fn):
+  out = {}
+
+  def target():
+    try:
+      out['result'] = fn()
+    except BaseException as e:
+      out['error'] = e
+
+  th = threading.Thread(target=target, daemon=True)
+  th.start()
+  th.join(TIMEOUT)
+  assert not th.is_alive(), "pipeline hung"
+  return out
+
+
+class TestPipeline:
+  def test_stage_failure_cancels_producers(self):
+    pipe = _Pipeline(queue_depth=1)
+    in_q, out_q = pipe.new_queue(), pipe.new_queue()
+
+    def fail(x):
+      raise ValueError(x)
+
+    pipe.start(pipe.feed, range(100), in_q)
+    pipe.start(pipe.stage, fail, in_q, out_q)
+    out = run_with_timeout(pipe.join)
+    assert isinstance(out['error'], ValueError)
+
+  def test_runs_to_completion(self):
+    pipe = _Pipeline(queue_depth=1)
+    in_q, out_q = pipe.new_queue(), pipe.new_queue()
+    results = []
+
+    def collect():
+      while (item := pipe.get(out_q)) is not offline._DONE:
+        results.append(item)
+
+    pipe.start(pipe.feed, range(100), in_q)
+    pipe.start(pipe.stage, lambda x: x * 2, in_q, out_q)
+    pipe.start(collect)
+    run_with_timeout(pipe.join)
+    assert results == [x * 2 for x in range(100)]
+
+
+class TestOfflineModelRunner:
+  def test_decode_failure_raises(self, monkeypatch):
+    # enough frames to fill every queue, so the feed thread is blocked on a put when decoding fails
+    monkeypatch.setattr(offline, "migrate_all", lambda lr, **kwargs: lr)
+    monkeypatch.setattr(offline, "get_demo_car_params", lambda: SimpleNamespace(steerActuatorDelay=0.))
+    monkeypatch.setattr(offline, "get_frame_tasks", lambda msgs, *args: iter(range(1000)))
+
+    runner = OfflineModelRunner.__new__(OfflineModelRunner)
+    runner.batch_size = 1
+    runner.queue_depth = 1
+    runner.main_wide_camera = False
+    runner.use_extra_client = True
+    runner.timings = {'decode': 0., 'warp': 0., 'model': 0., 'fill': 0.}
+
+    def decode(batch):
+      raise RuntimeError("corrupt frame")
+    runner._decode = decode
+
+    out = run_with_timeout(lambda: runner.run([]))
+    assert isinstance(out['error'], RuntimeError)
+    assert str(out['error']) == "corrupt frame"
+
+  def test_matches_model_state_run(self, monkeypatch, tmp_path):
+    # the offline model stage has to give the model the same inputs as modeld's main loop calling ModelState.run
+    monkeypatch.setattr(offline, "migrate_all", lambda lr, **kwargs: lr)
+    monkeypatch.setattr(offline, "get_demo_car_params", lambda: SimpleNamespace(steerActuatorDelay=0.1))
+    steer_delay = 0.1 + .2
+
+    rng = np.random.default_rng(0)
+    imgs, tasks = {}, []
+    # skipped frame ids are dropped frames, which only prepare the model
+    for i, fid in enumerate(fid for fid in range(1, 41) if fid not in (12, 13, 25)):
+      imgs[('roadCameraState', fid)] = rng.random(IMG_SIZE)
+      imgs[('wideRoadCameraState', fid)] = rng.random(IMG_SIZE)
+      tasks.append(FrameTask(main_state=log.Event.new_message(roadCameraState={'frameId': fid}).as_reader(),
+                             extra_state=log.Event.new_message(wideRoadCameraState={'frameId': fid}).as_reader(),
+                             log_mono_time=fid, frame_id=fid, model_transform_main=rng.random((3, 3)).astype(np.float32),
+                             model_transform_extra=rng.random((3, 3)).astype(np.float32), live_calib_seen=True, is_rhd=i >= 20,
+                             car_state=car.CarState.new_message(vEgo=float(i)).as_reader(), lat_active=False))
+
+    online = make_model_state(monkeypatch, tmp_path)
+    expected = []
+    last_frame_id = 0
+    for task in tasks:
+      traffic_convention = np.zeros(2)
+      traffic_convention[int(task.is_rhd)] = 1
+      # DesireHelper stays off without lateral control
+      vec_desire = np.zeros(ModelConstants.DESIRE_LEN, dtype=np.float32)
+      vec_desire[log.Desire.none] = 1
+      inputs = {
+        'desire': vec_desire,
+        'traffic_convention': traffic_convention,
+        'lateral_control_params': np.array([task.car_state.vEgo, steer_delay], dtype=np.float32),
+      }
+      prepare_only = task.frame_id - last_frame_id - 1 > 0
+      outputs = online.run(imgs[('roadCameraState', task.frame_id)], imgs[('wideRoadCameraState', task.frame_id)],
+                           task.model_transform_main, task.model_transform_extra, inputs, prepare_only)
+      if outputs is not None:
+        expected.append({k: v.copy() for k, v in outputs.items()})
+      last_frame_id = task.frame_id
+    monkeypatch.setattr(offline, "get_frame_tasks", lambda msgs, *args: iter(tasks))
+
+    runner = OfflineModelRunner.__new__(OfflineModelRunner)
+    runner.batch_size = 4
+    runner.queue_depth = 2
+    runner.main_wide_camera = False
+    runner.use_extra_client = True
+    runner.timings = {'decode': 0., 'warp': 0., 'model': 0., 'fill': 0.}
+    runner.model = make_model_state(monkeypatch, tmp_path)
+    runner.frs = {s: SimpleNamespace(get=lambda fid, pix_fmt, s=s: [imgs[(s, fid)]]) for s in ('roadCameraState', 'wideRoadCameraState')}
+    runner._to_vision_buf = lambda state_msg, img: img
+    runner._fill = lambda batch: [task.outputs for task in batch if task.outputs is not None]
+
+    out = run_with_timeout(lambda: runner.run([]))
+    assert 'error' not in out, out.get('error')
+    assert len(out['result']) == len(expected) == len(tasks) - 2
+    for got, ref in zip(out['result'], expected, strict=True):
+      assert got.keys() == ref.keys()
+      for k in ref:
+        np.testing.assert_array_equal(got[k], ref[k])
+    for k, v in online.inputs.items():
+      np.testing.assert_array_equal(runner.model.inputs[k], v)
@@ -11,6 +11,10 @@ from openpilot.selfdrive.test.helpers import set_params_enabled
 
 EventName = car.CarEvent.EventName
 
+# first message of the python daemons that start on the onroad transition
+ONROAD_SERVICES = ['carState', 'controlsState', 'longitudinalPlan', 'radarState', 'liveCalibration',
+                   'liveParameters', 'liveTorqueParameters', 'driverMonitoringState']
+
 
 @pytest.mark.tici
 def test_time_to_onroad():
@@ -21,11 +25,14 @@ def test_time_to_onroad():
 
   start_time = time.monotonic()
   sm = messaging.SubMaster(['controlsState', 'deviceState', 'onroadEvents'])
+  first_sm = messaging.SubMaster(ONROAD_SERVICES)
+  first_msg: dict[str, float] = {}
   try:
     # wait for onroad. timeout assumes panda is up to date
     with Timeout(10, "timed out waiting to go onroad"):
       while not sm['deviceState'].started:
         sm.update(100)
+    onroad_time = time.monotonic()
 
     # wait for engageability
     try:
@@ -33,6 +40,10 @@ def test_time_to_onroad():
         initialized = False
         while True:
           sm.update(100)
+          first_sm.update(0)
+          for s in ONROAD_SERVICES:
+            if first_sm.updated[s] and s not in first_msg:
+              first_msg[s] = time.monotonic() - onroad_time
 
           if sm.seen['onroadEvents'] and not any(EventName.controlsInitializing == e.name for e in sm['onroadEvents']):
             initialized = True
@@ -44,6 +55,9 @@ def test_time_to_onroad():
     finally:
       print(f"onroad events: {sm['onroadEvents']}")
     print(f"engageable after {time.monotonic() - start_time:.2f}s")
+    print("time to first message after onroad:")
+    for s, dt in sorted(first_msg.items(), key=lambda x: x[1]):
+      print(f"  {s:<24} {dt:.2f}s")
 
     # once we're enageable, must stay for the next few seconds
     st = time.monotonic()
@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import base64
+import bisect
 import hashlib
 import io
 import json
@@ -14,7 +15,7 @@ import sys
 import tempfile
 import threading
 import time
-import zstandard as zstd
+from collections import Counter, deque
 from dataclasses import asdict, dataclass, replace
 from datetime import datetime
 from functools import partial
@@ -23,6 +24,7 @@ from typing import cast
 from collections.abc import Callable
 
 import requests
+import zstandard as zstd
 from jsonrpc import JSONRPCResponseManager, dispatcher
 from websocket import (ABNF, WebSocket, WebSocketException, WebSocketTimeoutException,
                        create_connection)
@@ -32,10 +34,12 @@ from cereal import log
 from cereal.services import SERVICE_LIST
 from openpilot.common.api import Api
 from openpilot.common.file_helpers import CallbackReader
+from openpilot.common.inotify import IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW, Inotify
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware import HARDWARE, PC
-from openpilot.system.loggerd.uploader import LOG_COMPRESSION_LEVEL
+from openpilot.system.loggerd import compressed_cache
+from openpilot.system.loggerd.uploader import UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
 from openpilot.system.loggerd.xattr_cache import getxattr, setxattr
 from openpilot.common.swaglog import cloudlog
 from openpilot.system.version import get_build_metadata
@@ -48,11 +52,16 @@ LOCAL_PORT_WHITELIST = {8022}
 
 LOG_ATTR_NAME = 'user.upload'
 LOG_ATTR_VALUE_MAX_UNIX_TIME = int.to_bytes(2147483647, 4, sys.byteorder)
+LOG_BATCH_MAX_BYTES = 512 * 1024
+LOG_COMPRESSION = os.getenv("ATHENA_LOG_COMPRESSION") is not None  # the server has to accept zstd compressed forwardLogs
+LOG_STATE_FLUSH_INTERVAL = 30  # seconds
+LOG_RESEND_TIMEOUT = 3600  # seconds, a batch without a response by then is assumed lost
 RECONNECT_TIMEOUT_S = 70
 
 RETRY_DELAY = 10  # seconds
 MAX_RETRY_COUNT = 30  # Try for at most 5 minutes if upload fails immediately
 MAX_AGE = 31 * 24 * 3600  # seconds
+UPLOAD_QUEUE_CACHE_INTERVAL = 1.  # seconds
 WS_FRAME_SIZE = 4096
 
 NetworkType = log.DeviceState.NetworkType
@@ -93,10 +102,56 @@ class UploadItem:
                d["progress"], d["allow_cellular"])
 
 
+class UploadQueue(Queue):
+  """FIFO of pending uploads, indexed by id and by URL without the query string.
+
+  Each item is serialized once when it's queued, so persisting the queue doesn't
+  have to convert every item again. Only change it through put and get."""
+  def _init(self, maxsize: int) -> None:
+    super()._init(maxsize)
+    # UploadQueueCache state: what this queue last wrote to the param, and whether it changed since
+    self.persisted: str | None = None
+    self.cache_pending = False
+    self.cache_time = -UPLOAD_QUEUE_CACHE_INTERVAL
+    self.encoded: deque[str] = deque()
+    self.ids: Counter[str | None] = Counter()
+    self.urls: dict[str, list[str | None]] = {}
+
+  def _put(self, item: UploadItem) -> None:
+    super()._put(item)
+    self.encoded.append(json.dumps(asdict(item), separators=(',', ':')))
+    self.ids[item.id] += 1
+    self.urls.setdefault(strip_url_query(item.url), []).append(item.id)
+
+  def _get(self) -> UploadItem:
+    item = super()._get()
+    self.encoded.popleft()
+    self.ids[item.id] -= 1
+    if self.ids[item.id] <= 0:
+      del self.ids[item.id]
+    url = strip_url_query(item.url)
+    self.urls[url].remove(item.id)
+    if not self.urls[url]:
+      del self.urls[url]
+    return item
+
+  def has_id(self, upload_id: str) -> bool:
+    with self.mutex:
+      return upload_id in self.ids
+
+  def has_url(self, url: str, exclude_ids: set[str]) -> bool:
+    with self.mutex:
+      return any(i not in exclude_ids for i in self.urls.get(strip_url_query(url), []))
+
+  def serialize(self, exclude_ids: set[str]) -> str:
+    with self.mutex:
+      return "[" + ",".join(e for i, e in zip(self.queue, self.encoded, strict=True) if i.id not in exclude_ids) + "]"
+
+
 dispatcher["echo"] = lambda s: s
 recv_queue: Queue[str] = queue.Queue()
 send_queue: Queue[str] = queue.Queue()
-upload_queue: Queue[UploadItem] = queue.Queue()
+upload_queue: UploadQueue = UploadQueue()
 low_priority_send_queue: Queue[str] = queue.Queue()
 log_recv_queue: Queue[str] = queue.Queue()
 cancelled_uploads: set[str] = set()
@@ -110,28 +165,51 @@ def strip_zst_extension(fn: str) -> str:
   return fn
 
 
+def strip_url_query(url: str) -> str:
+  return url.split('?')[0]
+
+
 class AbortTransferException(Exception):
   pass
 
 
 class UploadQueueCache:
+  """Persists the upload queue to a param. Changes within UPLOAD_QUEUE_CACHE_INTERVAL of the
+  last write are written together by a later cache or flush call."""
+  lock = threading.Lock()
 
   @staticmethod
-  def initialize(upload_queue: Queue[UploadItem]) -> None:
+  def initialize(upload_queue: UploadQueue) -> None:
     try:
       upload_queue_json = Params().get("AthenadUploadQueue")
       if upload_queue_json is not None:
         for item in json.loads(upload_queue_json):
           upload_queue.put(UploadItem.from_dict(item))
+      upload_queue.persisted = upload_queue.serialize(set())
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.initialize.exception")
 
   @staticmethod
-  def cache(upload_queue: Queue[UploadItem]) -> None:
+  def cache(upload_queue: UploadQueue) -> None:
+    upload_queue.cache_pending = True
+    UploadQueueCache.flush(upload_queue)
+
+  @staticmethod
+  def flush(upload_queue: UploadQueue, force: bool = False) -> None:
     try:
-      queue: list[UploadItem | None] = list(upload_queue.queue)
-      items = [asdict(i) for i in queue if i is not None and (i.id not in cancelled_uploads)]
-      Params().put("AthenadUploadQueue", json.dumps(items))
+      with UploadQueueCache.lock:
+        if not upload_queue.cache_pending:
+          return
+        if not force and time.monotonic() - upload_queue.cache_time < UPLOAD_QUEUE_CACHE_INTERVAL:
+          return
+        upload_queue.cache_pending = False
+        upload_queue.cache_time = time.monotonic()
+
+        items = upload_queue.serialize(cancelled_uploads)
+        # retries and completions often leave the queue as it was
+        if items != upload_queue.persisted:
+          Params().put("AthenadUploadQueue", items)
+          upload_queue.persisted = items
     except Exception:
       cloudlog.exception("athena.UploadQueueCache.cache.exception")
 
@@ -164,6 +242,7 @@ def handle_long_poll(ws: WebSocket, exit_event: threading.Event | None) -> None:
     for thread in threads:
       cloudlog.debug(f"athena.joining {thread.name}")
       thread.join()
+    UploadQueueCache.flush(upload_queue, force=True)
 
 
 def jsonrpc_handler(end_event: threading.Event) -> None:
@@ -228,6 +307,7 @@ def upload_handler(end_event: threading.Event) -> None:
 
   while not end_event.is_set():
     cur_upload_items[tid] = None
+    UploadQueueCache.flush(upload_queue)
 
     try:
       cur_upload_items[tid] = item = replace(upload_queue.get(timeout=1), current=True)
@@ -289,17 +369,21 @@ def _do_upload(upload_item: UploadItem, callback: Callable = None) -> requests.R
     path = strip_zst_extension(path)
     compress = True
 
-  with open(path, "rb") as f:
-    content = f.read()
-    if compress:
-      cloudlog.event("athena.upload_handler.compress", fn=path, fn_orig=upload_item.path)
-      content = zstd.compress(content, LOG_COMPRESSION_LEVEL)
-
-  with io.BytesIO(content) as data:
-    return requests.put(upload_item.url,
-                        data=CallbackReader(data, callback, len(content)) if callback else data,
-                        headers={**upload_item.headers, 'Content-Length': str(len(content))},
+  upload_path = path
+  if compress:
+    cloudlog.event("athena.upload_handler.compress", fn=path, fn_orig=upload_item.path)
+    upload_path = compressed_cache.get_compressed(path)
+
+  # streamed from disk, the compressed copy is kept until the upload goes through
+  with open(upload_path, "rb") as f:
+    sz = os.fstat(f.fileno()).st_size
+    resp = requests.put(upload_item.url,
+                        data=CallbackReader(f, callback, sz) if callback else f,
+                        headers={**upload_item.headers, 'Content-Length': str(sz)},
                         timeout=30)
+  if compress and resp.status_code in (200, 201, 401, 403, 412):
+    compressed_cache.evict(upload_path)
+  return resp
 
 
 # security: user should be able to request any message from their car
@@ -329,28 +413,99 @@ def getVersion() -> dict[str, str]:
   }
 
 
-def scan_dir(path: str, prefix: str) -> list[str]:
-  files = []
-  # only walk directories that match the prefix
-  # (glob and friends traverse entire dir tree)
-  with os.scandir(path) as i:
-    for e in i:
-      rel_path = os.path.relpath(e.path, Paths.log_root())
-      if e.is_dir(follow_symlinks=False):
-        # add trailing slash
-        rel_path = os.path.join(rel_path, '')
-        # if prefix is a partial dir name, current dir will start with prefix
-        # if prefix is a partial file name, prefix with start with dir name
-        if rel_path.startswith(prefix) or prefix.startswith(rel_path):
-          files.extend(scan_dir(e.path, prefix))
-      else:
-        if rel_path.startswith(prefix):
-          files.append(rel_path)
-  return files
+class DataDirectoryIndex:
+  """Sorted listing of the log root for listDataDirectory.
+
+  Only directories that match the prefix are visited, and a directory is only listed
+  again when its mtime changes, which happens whenever an entry is added or removed."""
+  def __init__(self, root: str):
+    self.root = root
+    self.lock = threading.Lock()
+    # relative dir with trailing slash -> (mtime_ns, sorted file names, sorted subdir names)
+    self.dirs: dict[str, tuple[int, list[str], list[str]]] = {}
+
+  def _listing(self, rel_dir: str) -> tuple[list[str], list[str]]:
+    path = os.path.join(self.root, rel_dir)
+    try:
+      mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+      self.dirs.pop(rel_dir, None)
+      return [], []
+
+    cached = self.dirs.get(rel_dir)
+    if cached is None or cached[0] != mtime_ns:
+      files, subdirs = [], []
+      with os.scandir(path) as i:
+        for e in i:
+          (subdirs if e.is_dir(follow_symlinks=False) else files).append(e.name)
+      subdirs.sort()
+
+      # forget directories that were removed
+      if cached is not None:
+        removed = tuple(os.path.join(rel_dir, d, '') for d in set(cached[2]) - set(subdirs))
+        if removed:
+          for d in [d for d in self.dirs if d.startswith(removed)]:
+            del self.dirs[d]
+
+      cached = (mtime_ns, sorted(files), subdirs)
+      self.dirs[rel_dir] = cached
+    return cached[1], cached[2]
+
+  @staticmethod
+  def _matching(names: list[str], prefix: str) -> list[str]:
+    lo = bisect.bisect_left(names, prefix)
+    hi = lo
+    while hi < len(names) and names[hi].startswith(prefix):
+      hi += 1
+    return names[lo:hi]
+
+  def _list(self, rel_dir: str, prefix: str, out: list[str]) -> None:
+    files, subdirs = self._listing(rel_dir)
+
+    # part of the prefix that names are matched against in this directory
+    rest = prefix[len(rel_dir):]
+    if '/' in rest:
+      # only the directory named by the next path component can match
+      head = rest.split('/', 1)[0]
+      files, subdirs = [], [d for d in self._matching(subdirs, head) if d == head]
+    else:
+      files, subdirs = self._matching(files, rest), self._matching(subdirs, rest)
+
+    out.extend(rel_dir + f for f in files)
+    for d in subdirs:
+      self._list(os.path.join(rel_dir, d, ''), prefix, out)
+
+  def list(self, prefix: str = '') -> list[str]:
+    out: list[str] = []
+    with self.lock:
+      self._list('', prefix, out)
+    return out
+
+
+data_directory_index: DataDirectoryIndex | None = None
+
+
+def get_data_directory_index() -> DataDirectoryIndex:
+  global data_directory_index
+  if data_directory_index is None or data_directory_index.root != Paths.log_root():
+    data_directory_index = DataDirectoryIndex(Paths.log_root())
+  return data_directory_index
+
 
 @dispatcher.add_method
-def listDataDirectory(prefix='') -> list[str]:
-  return scan_dir(Paths.log_root(), prefix)
+def listDataDirectory(prefix='', details=False) -> list[str] | list[dict[str, str | int | bool]]:
+  files = get_data_directory_index().list(prefix)
+  if not details:
+    return files
+
+  ret: list[dict[str, str | int | bool]] = []
+  for fn in files:
+    path = os.path.join(Paths.log_root(), fn)
+    try:
+      ret.append({"fn": fn, "size": os.path.getsize(path), "uploaded": getxattr(path, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE})
+    except OSError:
+      pass  # file could be deleted by the deleter
+  return ret
 
 
 @dispatcher.add_method
@@ -381,8 +536,8 @@ def uploadFilesToUrls(files_data: list[UploadFileDict]) -> UploadFilesToUrlRespo
       continue
 
     # Skip item if already in queue
-    url = file.url.split('?')[0]
-    if any(url == item['url'].split('?')[0] for item in listUploadQueue()):
+    url = strip_url_query(file.url)
+    if upload_queue.has_url(url, cancelled_uploads) or any(i is not None and strip_url_query(i.url) == url for i in list(cur_upload_items.values())):
       continue
 
     item = UploadItem(
@@ -419,8 +574,7 @@ def cancelUpload(upload_id: str | list[str]) -> dict[str, int | str]:
   if not isinstance(upload_id, list):
     upload_id = [upload_id]
 
-  uploading_ids = {item.id for item in list(upload_queue.queue)}
-  cancelled_ids = uploading_ids.intersection(upload_id)
+  cancelled_ids = {i for i in upload_id if upload_queue.has_id(i)}
   if len(cancelled_ids) == 0:
     return {"success": 0, "error": "not found"}
 
@@ -538,61 +692,136 @@ def takeSnapshot() -> str | dict[str, str] | None:
     raise Exception("not available while camerad is started")
 
 
-def get_logs_to_send_sorted() -> list[str]:
-  # TODO: scan once then use inotify to detect file creation/deletion
-  curr_time = int(time.time())
-  logs = []
-  for log_entry in os.listdir(Paths.swaglog_root()):
-    log_path = os.path.join(Paths.swaglog_root(), log_entry)
+class SwaglogSendState:
+  """Time each swaglog file was last forwarded, 0 for never and MAX_UNIX_TIME once acknowledged.
+
+  Kept in memory and written back to the files' xattrs every LOG_STATE_FLUSH_INTERVAL,
+  the directory is only listed on startup and when the inotify queue overflows."""
+  def __init__(self, root: str):
+    self.root = root
+    self.time_sent: dict[str, int] = {}
+    self.dirty: set[str] = set()
+
+  def scan(self) -> None:
+    # this process is the only writer, so the in memory state is never older than the xattrs
+    self.flush()
+    known, self.time_sent = self.time_sent, {}
+    for log_entry in os.listdir(self.root):
+      if log_entry in known:
+        self.time_sent[log_entry] = known[log_entry]
+      else:
+        self.add(log_entry)
+
+  def add(self, log_entry: str) -> None:
     time_sent = 0
     try:
-      value = getxattr(log_path, LOG_ATTR_NAME)
+      value = getxattr(os.path.join(self.root, log_entry), LOG_ATTR_NAME)
       if value is not None:
         time_sent = int.from_bytes(value, sys.byteorder)
-    except (ValueError, TypeError):
+    except (OSError, ValueError, TypeError):
       pass
+    self.time_sent[log_entry] = time_sent
+
+  def remove(self, log_entry: str) -> None:
+    self.time_sent.pop(log_entry, None)
+    self.dirty.discard(log_entry)
+
+  def mark(self, log_entries: list[str], time_sent: int) -> None:
+    for log_entry in log_entries:
+      if log_entry in self.time_sent:
+        self.time_sent[log_entry] = time_sent
+        self.dirty.add(log_entry)
+
+  def to_send(self, curr_time: int) -> list[str]:
     # assume send failed and we lost the response if sent more than one hour ago
-    if not time_sent or curr_time - time_sent > 3600:
-      logs.append(log_entry)
-  # excluding most recent (active) log file
-  return sorted(logs)[:-1]
+    logs = [e for e, t in self.time_sent.items() if not t or curr_time - t > LOG_RESEND_TIMEOUT]
+    # excluding most recent (active) log file
+    newest = max(self.time_sent, default=None)
+    return sorted(e for e in logs if e != newest)
+
+  def flush(self) -> None:
+    for log_entry in self.dirty:
+      try:
+        setxattr(os.path.join(self.root, log_entry), LOG_ATTR_NAME, int.to_bytes(self.time_sent[log_entry], 4, sys.byteorder))
+      except OSError:
+        pass  # file could be deleted by log rotation
+    self.dirty.clear()
+
+
+def get_logs_to_send_sorted() -> list[str]:
+  state = SwaglogSendState(Paths.swaglog_root())
+  state.scan()
+  return state.to_send(int(time.time()))
+
+
+def read_log_batch(root: str, log_entries: list[str]) -> tuple[list[str], str]:
+  """Reads the newest logs until LOG_BATCH_MAX_BYTES, skipping files removed by log rotation"""
+  sent, logs, size = [], [], 0
+  for log_entry in reversed(log_entries):
+    try:
+      with open(os.path.join(root, log_entry)) as f:
+        data = f.read()
+    except OSError:
+      continue
+    if sent and size + len(data) > LOG_BATCH_MAX_BYTES:
+      break
+    sent.append(log_entry)
+    logs.append(data if data.endswith("\n") or not data else data + "\n")
+    size += len(data)
+  # oldest first, so the lines stay in order on the server
+  return sent, "".join(reversed(logs))
 
 
 def log_handler(end_event: threading.Event) -> None:
   if PC:
     return
 
-  log_files = []
-  last_scan = 0.
+  root = Paths.swaglog_root()
+  state = SwaglogSendState(root)
+  try:
+    watcher = Inotify()
+    watcher.add_watch(root, IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO)
+  except OSError:
+    cloudlog.exception("athena.log_handler.inotify_failed")
+    watcher = None
+  state.scan()
+
+  # batch id -> (time sent, files in the batch)
+  in_flight: dict[str, tuple[float, list[str]]] = {}
+  last_scan = last_flush = time.monotonic()
   while not end_event.is_set():
     try:
-      curr_scan = time.monotonic()
-      if curr_scan - last_scan > 10:
-        log_files = get_logs_to_send_sorted()
-        last_scan = curr_scan
-
-      # send one log
+      if watcher is not None:
+        for _, mask, name in watcher.read(0):
+          if mask & IN_Q_OVERFLOW:
+            state.scan()
+          elif mask & (IN_CREATE | IN_MOVED_TO):
+            state.add(name)
+          elif mask & (IN_DELETE | IN_MOVED_FROM):
+            state.remove(name)
+      elif time.monotonic() - last_scan > 10:
+        state.scan()
+        last_scan = time.monotonic()
+
+      # send a batch of the newest logs
       curr_log = None
-      if len(log_files) > 0:
-        log_entry = log_files.pop() # newest log file
-        cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
-        try:
-          curr_time = int(time.time())
-          log_path = os.path.join(Paths.swaglog_root(), log_entry)
-          setxattr(log_path, LOG_ATTR_NAME, int.to_bytes(curr_time, 4, sys.byteorder))
-          with open(log_path) as f:
-            jsonrpc = {
-              "method": "forwardLogs",
-              "params": {
-                "logs": f.read()
-              },
-              "jsonrpc": "2.0",
-              "id": log_entry
-            }
-            low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
-            curr_log = log_entry
-        except OSError:
-          pass  # file could be deleted by log rotation
+      log_entries, logs = read_log_batch(root, state.to_send(int(time.time())))
+      if log_entries:
+        curr_log = log_entries[0]
+        cloudlog.debug(f"athena.log_handler.forward_request {curr_log} ({len(log_entries)} files)")
+        state.mark(log_entries, int(time.time()))
+        in_flight[curr_log] = (time.monotonic(), log_entries)
+
+        params: dict[str, str] = {"logs": logs}
+        if LOG_COMPRESSION:
+          params = {"logs": base64.b64encode(zstd.compress(logs.encode())).decode(), "compression": "zstd"}
+        jsonrpc = {
+          "method": "forwardLogs",
+          "params": params,
+          "jsonrpc": "2.0",
+          "id": curr_log
+        }
+        low_priority_send_queue.put_nowait(json.dumps(jsonrpc))
 
       # wait for response up to ~100 seconds
       # always read queue at least once to process any old responses that arrive
@@ -604,21 +833,31 @@ def log_handler(end_event: threading.Event) -> None:
           log_entry = log_resp.get("id")
           log_success = "result" in log_resp and log_resp["result"].get("success")
           cloudlog.debug(f"athena.log_handler.forward_response {log_entry} {log_success}")
-          if log_entry and log_success:
-            log_path = os.path.join(Paths.swaglog_root(), log_entry)
-            try:
-              setxattr(log_path, LOG_ATTR_NAME, LOG_ATTR_VALUE_MAX_UNIX_TIME)
-            except OSError:
-              pass  # file could be deleted by log rotation
+          _, batch = in_flight.pop(log_entry, (0., [log_entry] if log_entry else []))
+          if log_success:
+            state.mark(batch, int.from_bytes(LOG_ATTR_VALUE_MAX_UNIX_TIME, sys.byteorder))
           if curr_log == log_entry:
             break
         except queue.Empty:
           if curr_log is None:
             break
 
+      # batches that never got a response are resent by to_send, a late response only acknowledges its id
+      for batch_id, (sent_time, _) in list(in_flight.items()):
+        if time.monotonic() - sent_time > LOG_RESEND_TIMEOUT:
+          del in_flight[batch_id]
+
+      if time.monotonic() - last_flush > LOG_STATE_FLUSH_INTERVAL:
+        state.flush()
+        last_flush = time.monotonic()
+
     except Exception:
       cloudlog.exception("athena.log_handler.exception")
 
+  state.flush()
+  if watcher is not None:
+    watcher.close()
+
 
 def stat_handler(end_event: threading.Event) -> None:
   STATS_DIR = Paths.stats_root()
@@ -23,6 +23,8 @@ from openpilot.system.athena.athenad import MAX_RETRY_COUNT, dispatcher
 from openpilot.system.athena.tests.helpers import HTTPRequestHandler, MockWebsocket, MockApi, EchoSocket
 from openpilot.selfdrive.test.helpers import http_server_context
 from openpilot.system.hardware.hw import Paths
+from openpilot.system.loggerd.uploader import UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from openpilot.system.loggerd.xattr_cache import setxattr
 
 
 def seed_athena_server(host, port):
@@ -76,7 +78,7 @@ class TestAthenadMethods:
       self.params.put(k, v)
     self.params.put_bool("GsmMetered", True)
 
-    athenad.upload_queue = queue.Queue()
+    athenad.upload_queue = athenad.UploadQueue()
     athenad.cur_upload_items.clear()
     athenad.cancelled_uploads.clear()
 
@@ -174,6 +176,30 @@ class TestAthenadMethods:
     assert resp, 'list empty!'
     assert len(resp) == len(expected)
 
+  def test_list_data_directory_cached(self, mocker):
+    route = '2021-03-29--13-32-47'
+    files = [f'{route}--{s}/{f}' for s in range(3) for f in ('qlog', 'rlog')]
+    for file in files:
+      self._create_file(file)
+    assert dispatcher["listDataDirectory"]() == sorted(files)
+
+    scandir = mocker.spy(os, "scandir")
+    assert dispatcher["listDataDirectory"](f'{route}--1/') == [f'{route}--1/qlog', f'{route}--1/rlog']
+    assert scandir.call_count == 0
+
+    # only the changed directories are listed again
+    self._create_file(f'{route}--1/qcamera.ts', data=b'1234')
+    shutil.rmtree(os.path.join(Paths.log_root(), f'{route}--2'))
+    scandir.reset_mock()
+    assert dispatcher["listDataDirectory"]() == sorted(files[:4] + [f'{route}--1/qcamera.ts'])
+    assert scandir.call_count == 2
+
+    setxattr(os.path.join(Paths.log_root(), f'{route}--1/qlog'), UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    assert dispatcher["listDataDirectory"](f'{route}--1/q', details=True) == [
+      {"fn": f'{route}--1/qcamera.ts', "size": 4, "uploaded": False},
+      {"fn": f'{route}--1/qlog', "size": 0, "uploaded": True},
+    ]
+
   def test_strip_extension(self):
     # any requested log file with an invalid extension won't return as existing
     fn = self._create_file('qlog.bz2')
@@ -349,12 +375,51 @@ class TestAthenadMethods:
     athenad.UploadQueueCache.cache(athenad.upload_queue)
 
     # deserialize item
-    athenad.upload_queue.queue.clear()
+    athenad.upload_queue = athenad.UploadQueue()
     athenad.UploadQueueCache.initialize(athenad.upload_queue)
 
     assert athenad.upload_queue.qsize() == 1
     assert asdict(athenad.upload_queue.queue[-1]) == asdict(item1)
 
+  def test_upload_queue_persistence_debounced(self):
+    items = [athenad.UploadItem(path="_", url=f"http://localhost/{i}", headers={}, created_at=0, id=f'id{i}') for i in range(2)]
+    athenad.upload_queue.put_nowait(items[0])
+    athenad.UploadQueueCache.cache(athenad.upload_queue)
+    assert len(json.loads(self.params.get("AthenadUploadQueue"))) == 1
+
+    # a change right after a write is held back until the next flush
+    athenad.upload_queue.put_nowait(items[1])
+    athenad.UploadQueueCache.cache(athenad.upload_queue)
+    assert len(json.loads(self.params.get("AthenadUploadQueue"))) == 1
+    athenad.UploadQueueCache.flush(athenad.upload_queue, force=True)
+    assert len(json.loads(self.params.get("AthenadUploadQueue"))) == 2
+
+  def test_upload_queue_persisted_after_param_removed(self):
+    item = athenad.UploadItem(path="_", url="_", headers={}, created_at=0, id='id1')
+    athenad.upload_queue.put_nowait(item)
+    athenad.UploadQueueCache.cache(athenad.upload_queue)
+
+    # a new queue with the same contents still writes, the param could have been cleared in between
+    self.params.remove("AthenadUploadQueue")
+    athenad.upload_queue = athenad.UploadQueue()
+    athenad.upload_queue.put_nowait(item)
+    athenad.UploadQueueCache.cache(athenad.upload_queue)
+    assert len(json.loads(self.params.get("AthenadUploadQueue"))) == 1
+
+  def test_upload_queue_index(self):
+    items = [athenad.UploadItem(path="_", url=f"http://localhost/{i}?sig=a", headers={}, created_at=0, id=f'id{i}') for i in range(3)]
+    for item in items:
+      athenad.upload_queue.put_nowait(item)
+
+    assert athenad.upload_queue.has_id('id1')
+    assert athenad.upload_queue.has_url("http://localhost/1?sig=b", set())
+    assert not athenad.upload_queue.has_url("http://localhost/1?sig=b", {'id1'})
+
+    assert athenad.upload_queue.get_nowait() == items[0]
+    assert not athenad.upload_queue.has_id('id0')
+    assert not athenad.upload_queue.has_url("http://localhost/0", set())
+    assert json.loads(athenad.upload_queue.serialize({'id2'})) == [asdict(items[1])]
+
   def test_start_local_proxy(self, mock_create_connection):
     end_event = threading.Event()
 
@@ -426,3 +491,55 @@ class TestAthenadMethods:
     # ensure the list is all logs except most recent
     sl = athenad.get_logs_to_send_sorted()
     assert sl == fl[:-1]
+
+  def test_log_state_rescan_keeps_marks(self):
+    root = Paths.swaglog_root()
+    shutil.rmtree(root, ignore_errors=True)
+    for i in range(3):
+      self._create_file(f'swaglog.{i:010}', root)
+
+    state = athenad.SwaglogSendState(root)
+    state.scan()
+    state.mark(['swaglog.0000000000'], int(time.time()))
+    os.remove(os.path.join(root, 'swaglog.0000000001'))
+    self._create_file('swaglog.0000000003', root)
+
+    # marks made since the last flush survive a rescan, and are written back to the files
+    state.scan()
+    assert state.to_send(int(time.time())) == ['swaglog.0000000002']
+    assert athenad.get_logs_to_send_sorted() == ['swaglog.0000000002']
+
+  def test_log_handler_batches(self, mocker):
+    mocker.patch.object(athenad, "PC", False)
+    mocker.patch.object(athenad, "LOG_STATE_FLUSH_INTERVAL", 0)
+    athenad.low_priority_send_queue.queue.clear()
+    root = Paths.swaglog_root()
+    shutil.rmtree(root, ignore_errors=True)
+    for i in range(5):
+      self._create_file(f'swaglog.{i:010}', root, f'line {i}\n'.encode())
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=athenad.log_handler, args=(end_event,))
+    thread.start()
+    try:
+      # all but the active file in one call, oldest first
+      req = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+      assert req['method'] == 'forwardLogs'
+      assert req['id'] == 'swaglog.0000000003'
+      assert req['params']['logs'] == ''.join(f'line {i}\n' for i in range(4))
+      athenad.log_recv_queue.put_nowait(json.dumps({'result': {'success': 1}, 'id': req['id'], 'jsonrpc': '2.0'}))
+
+      # rotation is picked up without relisting
+      self._create_file('swaglog.0000000005', root, b'line 5\n')
+      req = json.loads(athenad.low_priority_send_queue.get(timeout=5))
+      assert req['id'] == 'swaglog.0000000004'
+      assert req['params']['logs'] == 'line 4\n'
+      athenad.log_recv_queue.put_nowait(json.dumps({'result': {'success': 1}, 'id': req['id'], 'jsonrpc': '2.0'}))
+    finally:
+      end_event.set()
+      thread.join()
+
+    # send state is written back to the files
+    for i in range(5):
+      assert os.getxattr(os.path.join(root, f'swaglog.{i:010}'), athenad.LOG_ATTR_NAME) == athenad.LOG_ATTR_VALUE_MAX_UNIX_TIME
+    assert athenad.get_logs_to_send_sorted() == []
@@ -2,6 +2,7 @@ from abc import abstractmethod, ABC
 from collections import namedtuple
 
 from cereal import log
+from openpilot.system.hardware.sysfs_sampler import Sensor
 
 ThermalConfig = namedtuple('ThermalConfig', ['cpu', 'gpu', 'mem', 'bat', 'pmic'])
 NetworkType = log.DeviceState.NetworkType
@@ -122,6 +123,10 @@ class HardwareBase(ABC):
   def get_nvme_temperatures(self):
     pass
 
+  def get_sysfs_sensors(self) -> list[Sensor]:
+    """Sensors hardwared samples on every tick, named after the getter they replace"""
+    return []
+
   @abstractmethod
   def initialize_hardware(self):
     pass
@@ -23,6 +23,7 @@ from openpilot.system.statsd import statlog
 from openpilot.common.swaglog import cloudlog
 from openpilot.system.hardware.power_monitoring import PowerMonitoring
 from openpilot.system.hardware.fan_controller import TiciFanController
+from openpilot.system.hardware.sysfs_sampler import SysfsSampler
 from openpilot.system.version import terms_version, training_version
 
 ThermalStatus = log.DeviceState.ThermalStatus
@@ -77,12 +78,34 @@ def read_tz(x):
     return 0
 
 
-def read_thermal(thermal_config):
+def build_sampler(thermal_config, sensors, root: str = "/") -> SysfsSampler:
+  sampler = SysfsSampler(root)
+  zones = [*thermal_config.cpu[0], *thermal_config.gpu[0], thermal_config.mem[0], *thermal_config.pmic[0]]
+  for z in zones:
+    if z is not None:
+      sampler.add_thermal_zone(z)
+  for sensor in sensors:
+    sampler.add(sensor)
+  return sampler
+
+
+def sampled(values, name, getter):
+  # HARDWARE getter for anything the sampler doesn't cover on this device
+  return values[name] if name in values else getter()
+
+
+def read_thermal(thermal_config, values=None):
+  if values is None:
+    tz = read_tz
+  else:
+    def tz(z):
+      return values.get(f"tz.{z}", 0)
+
   dat = messaging.new_message('deviceState', valid=True)
-  dat.deviceState.cpuTempC = [read_tz(z) / thermal_config.cpu[1] for z in thermal_config.cpu[0]]
-  dat.deviceState.gpuTempC = [read_tz(z) / thermal_config.gpu[1] for z in thermal_config.gpu[0]]
-  dat.deviceState.memoryTempC = read_tz(thermal_config.mem[0]) / thermal_config.mem[1]
-  dat.deviceState.pmicTempC = [read_tz(z) / thermal_config.pmic[1] for z in thermal_config.pmic[0]]
+  dat.deviceState.cpuTempC = [tz(z) / thermal_config.cpu[1] for z in thermal_config.cpu[0]]
+  dat.deviceState.gpuTempC = [tz(z) / thermal_config.gpu[1] for z in thermal_config.gpu[0]]
+  dat.deviceState.memoryTempC = tz(thermal_config.mem[0]) / thermal_config.mem[1]
+  dat.deviceState.pmicTempC = [tz(z) / thermal_config.pmic[1] for z in thermal_config.pmic[0]]
   return dat
 
 
@@ -201,6 +224,7 @@ def hardware_thread(end_event, hw_queue) -> None:
 
   HARDWARE.initialize_hardware()
   thermal_config = HARDWARE.get_thermal_config()
+  sampler = build_sampler(thermal_config, HARDWARE.get_sysfs_sensors())
 
   fan_controller = None
 
@@ -235,7 +259,8 @@ def hardware_thread(end_event, hw_queue) -> None:
     if (sm.frame % round(SERVICE_LIST['pandaStates'].frequency * DT_HW) != 0) and not ign_edge:
       continue
 
-    msg = read_thermal(thermal_config)
+    values = sampler.sample()
+    msg = read_thermal(thermal_config, values)
     msg.deviceState.deviceType = HARDWARE.get_device_type()
 
     try:
@@ -245,7 +270,7 @@ def hardware_thread(end_event, hw_queue) -> None:
 
     msg.deviceState.freeSpacePercent = get_available_percent(default=100.0)
     msg.deviceState.memoryUsagePercent = int(round(psutil.virtual_memory().percent))
-    msg.deviceState.gpuUsagePercent = int(round(HARDWARE.get_gpu_usage_percent()))
+    msg.deviceState.gpuUsagePercent = int(round(sampled(values, "gpu_usage_percent", HARDWARE.get_gpu_usage_percent)))
     online_cpu_usage = [int(round(n)) for n in psutil.cpu_percent(percpu=True)]
     offline_cpu_usage = [0., ] * (len(msg.deviceState.cpuTempC) - len(online_cpu_usage))
     msg.deviceState.cpuUsagePercent = online_cpu_usage + offline_cpu_usage
@@ -260,7 +285,7 @@ def hardware_thread(end_event, hw_queue) -> None:
     msg.deviceState.nvmeTempC = last_hw_state.nvme_temps
     msg.deviceState.modemTempC = last_hw_state.modem_temps
 
-    msg.deviceState.screenBrightnessPercent = HARDWARE.get_screen_brightness()
+    msg.deviceState.screenBrightnessPercent = sampled(values, "screen_brightness", HARDWARE.get_screen_brightness)
 
     # this subset is only used for offroad
     temp_sources = [
@@ -378,11 +403,11 @@ def hardware_thread(end_event, hw_queue) -> None:
     power_monitor.calculate(voltage, onroad_conditions["ignition"])
     msg.deviceState.offroadPowerUsageUwh = power_monitor.get_power_used()
     msg.deviceState.carBatteryCapacityUwh = max(0, power_monitor.get_car_battery_capacity())
-    current_power_draw = HARDWARE.get_current_power_draw()
+    current_power_draw = sampled(values, "current_power_draw", HARDWARE.get_current_power_draw)
     statlog.sample("power_draw", current_power_draw)
     msg.deviceState.powerDrawW = current_power_draw
 
-    som_power_draw = HARDWARE.get_som_power_draw()
+    som_power_draw = sampled(values, "som_power_draw", HARDWARE.get_som_power_draw)
     statlog.sample("som_power_draw", som_power_draw)
     msg.deviceState.somPowerDrawW = som_power_draw
 
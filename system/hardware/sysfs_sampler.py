@@ -0,0 +1,93 @@
+import os
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+READ_SIZE = 4096  # sysfs attributes are at most a page
+THERMAL_DIR = "sys/devices/virtual/thermal"
+
+
+@dataclass
+class Sensor:
+  """A value parsed from one or more sysfs files. parser gets the contents of each path, in order"""
+  name: str
+  paths: tuple[str, ...]
+  parser: Callable[..., Any] = int
+  interval: float = 0.  # seconds between reads, 0 reads it on every sample
+  default: Any = 0
+
+  fds: list[int | None] = field(default_factory=list)
+  value: Any = None
+  next_read: float = 0.
+
+
+class SysfsSampler:
+  """Keeps sysfs files open and reads them all with pread once per sample(), instead of an open/read/close per value.
+
+  Paths are absolute, and are looked up under root so it can run against a fake sysfs tree.
+  """
+  def __init__(self, root: str = "/"):
+    self.root = root
+    self.sensors: dict[str, Sensor] = {}
+    self._thermal_zones: dict[str, int] | None = None
+
+  def add(self, sensor: Sensor) -> None:
+    sensor.fds = [None] * len(sensor.paths)
+    sensor.value = sensor.default
+    self.sensors[sensor.name] = sensor
+
+  def thermal_zones(self) -> dict[str, int]:
+    """Thermal zone number by its type"""
+    if self._thermal_zones is None:
+      self._thermal_zones = {}
+      thermal_dir = os.path.join(self.root, THERMAL_DIR)
+      for n in os.listdir(thermal_dir) if os.path.isdir(thermal_dir) else []:
+        if not n.startswith("thermal_zone"):
+          continue
+        with open(os.path.join(thermal_dir, n, "type")) as f:
+          self._thermal_zones[f.read().strip()] = int(n.removeprefix("thermal_zone"))
+    return self._thermal_zones
+
+  def add_thermal_zone(self, zone: int | str, interval: float = 0.) -> None:
+    """Adds the temperature of a zone, by number or type, as tz.<zone>. Missing zones read as 0"""
+    zone_num = self.thermal_zones().get(zone) if isinstance(zone, str) else zone
+    if zone_num is None:
+      return
+    self.add(Sensor(f"tz.{zone}", (f"/{THERMAL_DIR}/thermal_zone{zone_num}/temp",), interval=interval))
+
+  def _pread(self, sensor: Sensor, i: int) -> bytes:
+    if sensor.fds[i] is None:
+      sensor.fds[i] = os.open(os.path.join(self.root, sensor.paths[i].lstrip("/")), os.O_RDONLY | os.O_CLOEXEC)
+    return os.pread(sensor.fds[i], READ_SIZE, 0)
+
+  def _read(self, sensor: Sensor) -> Any:
+    try:
+      return sensor.parser(*[self._pread(sensor, i) for i in range(len(sensor.paths))])
+    except OSError:
+      # file went away (or never existed), open it again next time
+      self._close(sensor)
+      return sensor.default
+    except Exception:
+      return sensor.default
+
+  def sample(self, now: float | None = None) -> dict[str, Any]:
+    """Reads every sensor that is due, and returns the latest value of all of them"""
+    if now is None:
+      now = time.monotonic()
+
+    for sensor in self.sensors.values():
+      if now >= sensor.next_read:
+        sensor.value = self._read(sensor)
+        sensor.next_read = now + sensor.interval
+    return {name: sensor.value for name, sensor in self.sensors.items()}
+
+  def _close(self, sensor: Sensor) -> None:
+    for i, fd in enumerate(sensor.fds):
+      if fd is not None:
+        os.close(fd)
+        sensor.fds[i] = None
+
+  def close(self) -> None:
+    for sensor in self.sensors.values():
+      self._close(sensor)
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from openpilot.system.hardware.base import ThermalConfig
+from openpilot.system.hardware.hardwared import build_sampler, read_thermal
+from openpilot.system.hardware.sysfs_sampler import Sensor, SysfsSampler
+
+
+def write(root, path, value):
+  fn = root / path.lstrip("/")
+  fn.parent.mkdir(parents=True, exist_ok=True)
+  fn.write_text(f"{value}\n")
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+  for i, (zone_type, temp) in enumerate([("cpu0-usr", 41000), ("cpu1-usr", 43000), ("gpu0-usr", 39000), ("ddr-usr", 37000)]):
+    write(tmp_path, f"/sys/devices/virtual/thermal/thermal_zone{i}/type", zone_type)
+    write(tmp_path, f"/sys/devices/virtual/thermal/thermal_zone{i}/temp", temp)
+  write(tmp_path, "/sys/class/kgsl/kgsl-3d0/gpubusy", "  250  1000")
+  return tmp_path
+
+
+class TestSysfsSampler:
+  def test_thermal(self, sysfs):
+    config = ThermalConfig(cpu=(["cpu0-usr", "cpu1-usr"], 1000), gpu=(("gpu0-usr", "gpu1-usr"), 1000),
+                           mem=("ddr-usr", 1000), bat=(None, 1), pmic=((None,), 1))
+    sampler = build_sampler(config, [], root=str(sysfs))
+    msg = read_thermal(config, sampler.sample())
+    assert list(msg.deviceState.cpuTempC) == [41., 43.]
+    assert list(msg.deviceState.gpuTempC) == [39., 0.]  # missing zone
+    assert msg.deviceState.memoryTempC == 37.
+    assert list(msg.deviceState.pmicTempC) == [0.]
+    sampler.close()
+
+  def test_reads_through_open_fds(self, sysfs, mocker):
+    sampler = SysfsSampler(str(sysfs))
+    sampler.add(Sensor("gpu", ("/sys/class/kgsl/kgsl-3d0/gpubusy",), lambda s: int(s.split()[0]) / int(s.split()[1])))
+    sampler.add_thermal_zone("cpu0-usr")
+    assert sampler.sample(now=0) == {"gpu": 0.25, "tz.cpu0-usr": 41000}
+
+    # sysfs rewrites the attribute in place, the open fd sees the new value
+    with open(sysfs / "sys/devices/virtual/thermal/thermal_zone0/temp", "r+") as f:
+      f.write("55000\n")
+    open_spy = mocker.spy(os, "open")
+    pread_spy = mocker.spy(os, "pread")
+    assert sampler.sample(now=1)["tz.cpu0-usr"] == 55000
+    assert open_spy.call_count == 0
+    assert pread_spy.call_count == 2
+    sampler.close()
+
+  def test_interval(self, sysfs):
+    sampler = SysfsSampler(str(sysfs))
+    sampler.add_thermal_zone(0, interval=10.)
+    sampler.add_thermal_zone(1)
+    sampler.sample(now=0)
+    for zone in (0, 1):
+      write(sysfs, f"/sys/devices/virtual/thermal/thermal_zone{zone}/temp", 60000)
+
+    assert sampler.sample(now=5) == {"tz.0": 41000, "tz.1": 60000}
+    assert sampler.sample(now=10) == {"tz.0": 60000, "tz.1": 60000}
+    sampler.close()
+
+  def test_missing_file(self, sysfs):
+    sampler = SysfsSampler(str(sysfs))
+    sampler.add(Sensor("power", ("/sys/class/hwmon/hwmon1/power1_input",), lambda p: int(p) / 1e6, default=-1))
+    assert sampler.sample(now=0) == {"power": -1}
+
+    write(sysfs, "/sys/class/hwmon/hwmon1/power1_input", 4500000)
+    assert sampler.sample(now=1) == {"power": 4.5}
+
+    write(sysfs, "/sys/class/hwmon/hwmon1/power1_input", "garbage")
+    assert sampler.sample(now=2) == {"power": -1}
+    sampler.close()
@@ -8,6 +8,7 @@ import subprocess
 import time
 from collections.abc import Generator
 
+import numpy as np
 import requests
 
 import openpilot.system.updated.casync.casync as casync
@@ -184,9 +185,11 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
   path = get_partition_path(target_slot_number, partition)
   seed_path = path[:-1] + ('b' if path[-1] == 'a' else 'a')
 
-  target = casync.parse_caibx(partition['casync_caibx'])
+  target_index = casync.parse_caibx_index(partition['casync_caibx'])
+  target = casync.chunks_from_index(target_index)
 
   sources: list[tuple[str, casync.ChunkReader, casync.ChunkDict]] = []
+  seed_indexes: list[tuple[str, np.ndarray]] = []
 
   # First source is the current partition.
   try:
@@ -195,7 +198,9 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
 
     try:
       cloudlog.info(f"casync fetching {caibx_url}")
-      sources += [('seed', casync.FileChunkReader(seed_path), casync.build_chunk_dict(casync.parse_caibx(caibx_url)))]
+      seed_index = casync.parse_caibx_index(caibx_url)
+      sources += [('seed', casync.FileChunkReader(seed_path), casync.build_chunk_dict(casync.chunks_from_index(seed_index)))]
+      seed_indexes.append(('seed', seed_index))
     except requests.RequestException:
       cloudlog.error(f"casync failed to load {caibx_url}")
   except Exception:
@@ -207,6 +212,11 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
   # Finally we add the remote source to download any missing chunks
   sources += [('remote', casync.RemoteChunkReader(partition['casync_store']), casync.build_chunk_dict(target))]
 
+  # upper bound, chunks already in the target partition from an interrupted update aren't known without reading it
+  plan = casync.plan_extract(target_index, seed_indexes)
+  cloudlog.info(f"casync plan {partition['name']}: seed {plan.source_bytes.get('seed', 0)} bytes, " +
+                f"download {plan.remote_bytes} bytes in {len(plan.remote)} chunks")
+
   last_p = 0
 
   def progress(cur):
@@ -1,3 +1,4 @@
+import glob
 import json
 import math
 import os
@@ -11,6 +12,7 @@ from pathlib import Path
 from cereal import log
 from openpilot.common.gpio import gpio_set, gpio_init, get_irqs_for_action
 from openpilot.system.hardware.base import HardwareBase, ThermalConfig
+from openpilot.system.hardware.sysfs_sampler import Sensor
 from openpilot.system.hardware.tici import iwlist
 from openpilot.system.hardware.tici.pins import GPIO
 from openpilot.system.hardware.tici.amplifier import Amplifier
@@ -322,7 +324,20 @@ class Tici(HardwareBase):
     except Exception:
       return []
 
+  @cached_property
+  def nvme_hwmon_inputs(self) -> list[str]:
+    # newer kernels expose the nvme sensors through hwmon, temp1 is the composite temperature
+    inputs = []
+    for label_fn in sorted(glob.glob("/sys/class/nvme/nvme0/hwmon*/temp*_label")):
+      with open(label_fn) as f:
+        if f.read().startswith("Sensor"):
+          inputs.append(label_fn.removesuffix("_label") + "_input")
+    return inputs
+
   def get_nvme_temperatures(self):
+    if len(self.nvme_hwmon_inputs):
+      return [self.read_param_file(fn, int) // 1000 for fn in self.nvme_hwmon_inputs]
+
     ret = []
     try:
       out = subprocess.check_output("sudo smartctl -aj /dev/nvme0", shell=True)
@@ -408,6 +423,20 @@ class Tici(HardwareBase):
     except Exception:
       return 0
 
+  def get_sysfs_sensors(self):
+    def gpu_usage_percent(gpubusy):
+      used, total = gpubusy.split()
+      return 100.0 * int(used) / int(total)
+
+    return [
+      Sensor("gpu_usage_percent", ('/sys/class/kgsl/kgsl-3d0/gpubusy',), gpu_usage_percent),
+      Sensor("screen_brightness", ("/sys/class/backlight/panel0-backlight/brightness", "/sys/class/backlight/panel0-backlight/max_brightness"),
+             lambda brightness, max_brightness: int(float(brightness) / (float(max_brightness) / 100.))),
+      Sensor("current_power_draw", ("/sys/class/hwmon/hwmon1/power1_input",), lambda power: int(power) / 1e6),
+      Sensor("som_power_draw", ("/sys/class/power_supply/bms/voltage_now", "/sys/class/power_supply/bms/current_now"),
+             lambda voltage, current: int(voltage) * int(current) / 1e12),
+    ]
+
   def initialize_hardware(self):
     if self.amplifier is not None:
       self.amplifier.initialize_configuration(self.get_device_type())
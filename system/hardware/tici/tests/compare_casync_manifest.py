@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 import argparse
-import collections
 import multiprocessing
 import os
 
+import numpy as np
 import requests
 from tqdm import tqdm
 
-import openpilot.system.hardware.tici.casync as casync
+import openpilot.system.updated.casync.casync as casync
 
 
-def get_chunk_download_size(chunk):
-  sha = chunk.sha.hex()
+def get_chunk_download_size(sha):
+  sha = sha.hex()
   path = os.path.join(remote_url, sha[:4], sha + ".cacnk")
   if os.path.isfile(path):
     return os.path.getsize(path)
@@ -28,46 +28,33 @@ if __name__ == "__main__":
   parser.add_argument('to')
   args = parser.parse_args()
 
-  frm = casync.parse_caibx(args.frm)
-  to = casync.parse_caibx(args.to)
+  frm = casync.parse_caibx_index(args.frm)
+  to = casync.parse_caibx_index(args.to)
   remote_url = args.to.replace('.caibx', '')
 
-  most_common = collections.Counter(t.sha for t in to).most_common(1)[0][0]
+  # Assume most common chunk is the zero chunk
+  _, inverse, counts = np.unique(to['sha'], return_inverse=True, return_counts=True)
+  to = to[inverse.ravel() != np.argmax(counts)]
 
-  frm_dict = casync.build_chunk_dict(frm)
+  no_seed = casync.plan_extract(to, [])
+  plan = casync.plan_extract(to, [('seed', frm)])
 
-  # Get content-length for each chunk
+  # Get content-length for each unique chunk
   with multiprocessing.Pool() as pool:
-    szs = list(tqdm(pool.imap(get_chunk_download_size, to), total=len(to)))
-  chunk_sizes = {t.sha: sz for (t, sz) in zip(to, szs, strict=True)}
-
-  sources: dict[str, list[int]] = {
-    'seed': [],
-    'remote_uncompressed': [],
-    'remote_compressed': [],
-  }
-
-  for chunk in to:
-    # Assume most common chunk is the zero chunk
-    if chunk.sha == most_common:
-      continue
-
-    if chunk.sha in frm_dict:
-      sources['seed'].append(chunk.length)
-    else:
-      sources['remote_uncompressed'].append(chunk.length)
-      sources['remote_compressed'].append(chunk_sizes[chunk.sha])
+    szs = list(tqdm(pool.imap(get_chunk_download_size, [bytes(s) for s in no_seed.remote['sha']]), total=len(no_seed.remote)))
+  chunk_sizes = {bytes(s): sz for (s, sz) in zip(no_seed.remote['sha'], szs, strict=True)}
+  remote_compressed = [chunk_sizes[bytes(s)] for s in plan.remote['sha']]
 
   print()
-  print("Update statistics (excluding zeros)")
+  print("Update statistics (excluding zeros, repeated chunks downloaded once)")
   print()
   print("Download only with no seed:")
-  print(f"  Remote (uncompressed)\t\t{sum(sources['seed'] + sources['remote_uncompressed']) / 1000 / 1000:.2f} MB\tn = {len(to)}")
-  print(f"  Remote (compressed download)\t{sum(chunk_sizes.values()) / 1000 / 1000:.2f} MB\tn = {len(to)}")
+  print(f"  Remote (uncompressed)\t\t{no_seed.remote_bytes / 1000 / 1000:.2f} MB\tn = {len(no_seed.remote)}")
+  print(f"  Remote (compressed download)\t{sum(chunk_sizes.values()) / 1000 / 1000:.2f} MB\tn = {len(no_seed.remote)}")
   print()
   print("Upgrade with seed partition:")
-  print(f"  Seed   (uncompressed)\t\t{sum(sources['seed']) / 1000 / 1000:.2f} MB\t\t\t\tn = {len(sources['seed'])}")
-  sz, n = sum(sources['remote_uncompressed']), len(sources['remote_uncompressed'])
-  print(f"  Remote (uncompressed)\t\t{sz / 1000 / 1000:.2f} MB\t(avg {sz / 1000 / 1000 / n:4f} MB)\tn = {n}")
-  sz, n = sum(sources['remote_compressed']), len(sources['remote_compressed'])
-  print(f"  Remote (compressed download)\t{sz / 1000 / 1000:.2f} MB\t(avg {sz / 1000 / 1000 / n:4f} MB)\tn = {n}")
+  print(f"  Seed   (uncompressed)\t\t{plan.source_bytes['seed'] / 1000 / 1000:.2f} MB\t\t\t\tn = {np.count_nonzero(plan.source == 0)}")
+  sz, n = plan.remote_bytes, max(len(plan.remote), 1)
+  print(f"  Remote (uncompressed)\t\t{sz / 1000 / 1000:.2f} MB\t(avg {sz / 1000 / 1000 / n:4f} MB)\tn = {len(plan.remote)}")
+  sz = sum(remote_compressed)
+  print(f"  Remote (compressed download)\t{sz / 1000 / 1000:.2f} MB\t(avg {sz / 1000 / 1000 / n:4f} MB)\tn = {len(plan.remote)}")
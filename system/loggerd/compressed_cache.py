@@ -0,0 +1,93 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import zstandard as zstd
+
+from openpilot.system.hardware.hw import Paths
+
+LOG_COMPRESSION_LEVEL = 10  # little benefit up to level 15. level ~17 is a small step change
+LOG_COMPRESSION_THREADS = int(os.getenv("LOG_COMPRESSION_THREADS", "0"))  # zstd worker threads, 0 compresses on the calling thread
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+TEMP_PREFIX = "tmp"
+TEMP_MAX_AGE = 10 * 60  # seconds, partial copies left behind by a killed uploader
+
+
+def cache_root() -> str:
+  # outside of the log root, so the uploader doesn't see the cached files as segments
+  return os.path.normpath(Paths.log_root()) + "_upload_cache"
+
+
+def cache_path(fn: str) -> str:
+  st = os.stat(fn)
+  key = f"{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}:{LOG_COMPRESSION_LEVEL}"
+  return os.path.join(cache_root(), hashlib.sha1(key.encode()).hexdigest() + ".zst")
+
+
+def compress_file(fn: str, out_fn: str) -> None:
+  """Streams fn through zstd into out_fn, holding at most a few blocks in memory"""
+  cctx = zstd.ZstdCompressor(level=LOG_COMPRESSION_LEVEL, threads=LOG_COMPRESSION_THREADS)
+  with open(fn, 'rb') as src, tempfile.NamedTemporaryFile(dir=os.path.dirname(out_fn), prefix=TEMP_PREFIX, delete=False) as dst:
+    try:
+      cctx.copy_stream(src, dst, size=os.fstat(src.fileno()).st_size, read_size=COMPRESSION_BLOCK_SIZE, write_size=COMPRESSION_BLOCK_SIZE)
+    except BaseException:
+      os.unlink(dst.name)
+      raise
+  os.replace(dst.name, out_fn)
+
+
+def get_compressed(fn: str) -> str:
+  """Returns the path of a zstd compressed copy of fn, reusing it if an earlier upload attempt already made one"""
+  out_fn = cache_path(fn)
+  if not os.path.isfile(out_fn):
+    os.makedirs(cache_root(), exist_ok=True)
+    prune()
+    compress_file(fn, out_fn)
+  return out_fn
+
+
+def evict(out_fn: str) -> None:
+  """Removes a compressed copy returned by get_compressed"""
+  try:
+    os.unlink(out_fn)
+  except FileNotFoundError:
+    pass
+
+
+def prune(max_bytes: int = CACHE_MAX_BYTES) -> None:
+  """Removes the least recently written copies until the cache is under max_bytes, and stale partial copies"""
+  try:
+    entries = list(os.scandir(cache_root()))
+  except FileNotFoundError:
+    return
+
+  now = time.time()
+  for e in entries:
+    if e.name.startswith(TEMP_PREFIX) and not e.name.endswith(".zst"):
+      try:
+        if now - e.stat().st_mtime > TEMP_MAX_AGE:
+          os.unlink(e.path)
+      except FileNotFoundError:
+        pass
+
+  # other upload workers and athenad evict copies concurrently, so vanished entries are skipped
+  copies = []
+  for e in entries:
+    if e.name.endswith(".zst"):
+      try:
+        st = e.stat()
+      except FileNotFoundError:
+        continue
+      copies.append((st.st_mtime, st.st_size, e.path))
+
+  total = 0
+  for _, size, path in sorted(copies, reverse=True):
+    total += size
+    if total > max_bytes:
+      try:
+        os.unlink(path)
+      except FileNotFoundError:
+        pass
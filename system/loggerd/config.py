@@ -8,6 +8,7 @@ SEGMENT_LENGTH = 60
 STATS_DIR_FILE_LIMIT = 10000
 STATS_SOCKET = "ipc:///tmp/stats"
 STATS_FLUSH_TIME_S = 60
+STATS_PERCENTILES = tuple(float(p) / 100 for p in os.getenv("STATS_PERCENTILES", "5,50,95").split(","))
 
 def get_available_percent(default=None):
   try:
@@ -27,3 +28,13 @@ def get_available_bytes(default=None):
     available_bytes = default
 
   return available_bytes
+
+
+def get_total_bytes(default=None):
+  try:
+    statvfs = os.statvfs(Paths.log_root())
+    total_bytes = statvfs.f_blocks * statvfs.f_frsize
+  except OSError:
+    total_bytes = default
+
+  return total_bytes
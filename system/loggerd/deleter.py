@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 import os
-import shutil
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from openpilot.system.hardware.hw import Paths
 from openpilot.common.swaglog import cloudlog
-from openpilot.system.loggerd.config import get_available_bytes, get_available_percent
-from openpilot.system.loggerd.uploader import listdir_by_creation
-from openpilot.system.loggerd.xattr_cache import getxattr
+from openpilot.system.loggerd.config import get_available_bytes, get_available_percent, get_total_bytes
+from openpilot.system.loggerd.uploader import BandwidthLimiter, listdir_by_creation
+from openpilot.system.loggerd.xattr_cache import getxattr, invalidate
 
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
@@ -17,14 +19,17 @@ PRESERVE_ATTR_NAME = 'user.preserve'
 PRESERVE_ATTR_VALUE = b'1'
 PRESERVE_COUNT = 5
 
+# unlinking is paced, so freeing a large batch doesn't hold up loggerd's writes
+DELETE_RATE = float(os.getenv("DELETER_RATE", str(100 * 1024 * 1024)))  # bytes/s, 0 is unlimited
+
 
 def has_preserve_xattr(d: str) -> bool:
   return getxattr(os.path.join(Paths.log_root(), d), PRESERVE_ATTR_NAME) == PRESERVE_ATTR_VALUE
 
 
-def get_preserved_segments(dirs_by_creation: list[str]) -> list[str]:
+def get_preserved_segments(dirs_by_creation: list[str], is_preserved=has_preserve_xattr) -> list[str]:
   preserved = []
-  for n, d in enumerate(filter(has_preserve_xattr, reversed(dirs_by_creation))):
+  for n, d in enumerate(filter(is_preserved, reversed(dirs_by_creation))):
     if n == PRESERVE_COUNT:
       break
     date_str, _, seg_str = d.rpartition("--")
@@ -44,36 +49,167 @@ def get_preserved_segments(dirs_by_creation: list[str]) -> list[str]:
   return preserved
 
 
-def deleter_thread(exit_event):
-  while not exit_event.is_set():
-    out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
-    out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
+def get_bytes_to_free() -> int:
+  """Bytes that need to be deleted to get back above both MIN_BYTES and MIN_PERCENT"""
+  available_bytes = get_available_bytes(default=MIN_BYTES + 1)
+  available_percent = get_available_percent(default=MIN_PERCENT + 1)
+  total_bytes = get_total_bytes(default=0)
+  return int(max(MIN_BYTES - available_bytes, (MIN_PERCENT - available_percent) / 100 * total_bytes))
+
 
-    if out_of_percent or out_of_bytes:
-      dirs = listdir_by_creation(Paths.log_root())
+@dataclass
+class LogDir:
+  ctime_ns: int
+  size: int
+  locked: bool
+  preserve: bool
 
-      # skip deleting most recent N preserved segments (and their prior segment)
-      preserved_dirs = get_preserved_segments(dirs)
 
-      # remove the earliest directory we can
-      for delete_dir in sorted(dirs, key=lambda d: (d in DELETE_LAST, d in preserved_dirs)):
-        delete_path = os.path.join(Paths.log_root(), delete_dir)
+class DeleterIndex:
+  """Segment directories in the log root with their size on disk, lock and preserve status.
 
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
-          continue
+  Creating or removing a file, a lock, or setting the preserve xattr all change the ctime of
+  a directory, so only the directories that changed since the last refresh are rescanned.
+  """
+  def __init__(self, root: str):
+    self.root = root
+    self.order: list[str] = []
+    self.dirs: dict[str, LogDir] = {}
+    self.root_mtime: int | None = None
 
+  def _scan_dir(self, d: str, ctime_ns: int) -> LogDir:
+    size, locked = 0, False
+    with os.scandir(os.path.join(self.root, d)) as it:
+      for e in it:
+        locked |= e.name.endswith(".lock")
         try:
-          cloudlog.info(f"deleting {delete_path}")
-          if os.path.isfile(delete_path):
-            os.remove(delete_path)
-          else:
-            shutil.rmtree(delete_path)
-          break
-        except OSError:
-          cloudlog.exception(f"issue deleting {delete_path}")
+          size += e.stat(follow_symlinks=False).st_blocks * 512
+        except FileNotFoundError:
+          pass
+    return LogDir(ctime_ns, size, locked, has_preserve_xattr(d))
+
+  def refresh(self) -> None:
+    try:
+      root_mtime = os.stat(self.root).st_mtime_ns
+    except FileNotFoundError:
+      self.order, self.dirs, self.root_mtime = [], {}, None
+      return
+
+    if root_mtime != self.root_mtime:
+      self.root_mtime = root_mtime
+      self.order = listdir_by_creation(self.root)
+      self.dirs = {d: self.dirs[d] for d in self.order if d in self.dirs}
+
+    for d in self.order:
+      try:
+        ctime_ns = os.stat(os.path.join(self.root, d)).st_ctime_ns
+        if d not in self.dirs or self.dirs[d].ctime_ns != ctime_ns:
+          self.dirs[d] = self._scan_dir(d, ctime_ns)
+      except FileNotFoundError:
+        self.dirs.pop(d, None)
+    self.order = [d for d in self.order if d in self.dirs]
+
+  def remove(self, d: str) -> None:
+    self.dirs.pop(d, None)
+    if d in self.order:
+      self.order.remove(d)
+
+  def plan(self, bytes_to_free: int) -> list[str]:
+    """Oldest directories that free at least bytes_to_free, deleting boot, crash and preserved segments last"""
+    # skip deleting most recent N preserved segments (and their prior segment)
+    preserved = set(get_preserved_segments(self.order, lambda d: self.dirs[d].preserve))
+
+    batch, planned = [], 0
+    for d in sorted(self.order, key=lambda d: (d in DELETE_LAST, d in preserved)):
+      if self.dirs[d].locked:
+        continue
+      batch.append(d)
+      planned += self.dirs[d].size
+      if planned >= bytes_to_free:
+        break
+    return batch
+
+
+def delete_path(path: str, limiter: BandwidthLimiter) -> None:
+  """Removes a file or directory tree one file at a time, dropping cached xattrs and waiting on the limiter after each unlink"""
+  if not os.path.isdir(path) or os.path.islink(path):
+    st = os.lstat(path)
+    os.remove(path)
+    invalidate(st=st)
+    limiter.consume(st.st_blocks * 512)
+    return
+
+  for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+    for name in filenames:
+      fn = os.path.join(dirpath, name)
+      try:
+        st = os.lstat(fn)
+        os.remove(fn)
+      except FileNotFoundError:
+        continue
+      invalidate(st=st)
+      limiter.consume(st.st_blocks * 512)
+    for name in dirnames:
+      dn = os.path.join(dirpath, name)
+      st = os.lstat(dn)
+      if os.path.islink(dn):
+        os.remove(dn)
+      else:
+        os.rmdir(dn)
+      invalidate(st=st)
+  st = os.lstat(path)
+  os.rmdir(path)
+  invalidate(st=st)
+
+
+def delete_batch(root: str, batch: list[str], sizes: dict[str, int], cancel: threading.Event,
+                 limiter: BandwidthLimiter) -> tuple[list[str], int]:
+  deleted, freed = [], 0
+  for d in batch:
+    if cancel.is_set():
+      break
+
+    path = os.path.join(root, d)
+    try:
+      cloudlog.info(f"deleting {path}")
+      delete_path(path, limiter)
+      deleted.append(d)
+      freed += sizes[d]
+    except OSError:
+      cloudlog.exception(f"issue deleting {path}")
+  return deleted, freed
+
+
+def deleter_thread(exit_event):
+  index = DeleterIndex(Paths.log_root())
+  limiter = BandwidthLimiter(DELETE_RATE)
+  # unlinking runs on its own thread, so the free space keeps being checked while a batch is deleted
+  with ThreadPoolExecutor(max_workers=1, thread_name_prefix='deleter') as pool:
+    while not exit_event.is_set():
+      bytes_to_free = get_bytes_to_free()
+      if bytes_to_free <= 0:
+        exit_event.wait(30)
+        continue
+
+      index.refresh()
+      batch = index.plan(bytes_to_free)
+      if not batch:
+        exit_event.wait(.1)
+        continue
+
+      start = time.monotonic()
+      cancel = threading.Event()
+      future = pool.submit(delete_batch, index.root, batch, {d: index.dirs[d].size for d in batch}, cancel, limiter)
+      while not wait([future], timeout=.1).done:
+        if exit_event.is_set() or get_bytes_to_free() <= 0:
+          cancel.set()
+
+      deleted, freed = future.result()
+      for d in deleted:
+        index.remove(d)
+      dt = time.monotonic() - start
+      cloudlog.event("deleter_batch", planned=len(batch), deleted=len(deleted), bytes=freed, dt=dt, speed=(freed / 1e6) / dt)
       exit_event.wait(.1)
-    else:
-      exit_event.wait(30)
 
 
 def main():
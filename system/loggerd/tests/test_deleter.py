@@ -5,7 +5,9 @@ from pathlib import Path
 from collections.abc import Sequence
 
 import openpilot.system.loggerd.deleter as deleter
+from openpilot.system.loggerd import xattr_cache
 from openpilot.common.timeout import Timeout, TimeoutException
+from openpilot.system.hardware.hw import Paths
 from openpilot.system.loggerd.tests.loggerd_tests_common import UploaderTestCase
 
 Stats = namedtuple("Stats", ['f_bavail', 'f_blocks', 'f_frsize'])
@@ -115,3 +117,69 @@ class TestDeleter(UploaderTestCase):
     self.join_thread()
 
     assert f_path.exists(), "File deleted when locked"
+
+  def test_plan_frees_needed_bytes(self):
+    for i in range(5):
+      self.make_file_with_data(self.seg_format.format(i), self.f_type, 1)
+    self.make_file_with_data(self.seg_format.format(5), self.f_type, 1, lock=True)
+
+    index = deleter.DeleterIndex(Paths.log_root())
+    index.refresh()
+    size = index.dirs[self.seg_format.format(0)].size
+    assert size >= 1024 * 1024
+
+    assert index.plan(1) == [self.seg_format.format(0)]
+    assert index.plan(2 * size + 1) == [self.seg_format.format(i) for i in range(3)]
+    # locked segment is never planned
+    assert index.plan(100 * size) == [self.seg_format.format(i) for i in range(5)]
+
+  def test_index_rescans_changed_dirs(self, mocker):
+    for i in range(3):
+      self.make_file_with_data(self.seg_format.format(i), self.f_type)
+    index = deleter.DeleterIndex(Paths.log_root())
+    index.refresh()
+
+    scan = mocker.spy(index, "_scan_dir")
+    index.refresh()
+    assert scan.call_count == 0
+
+    self.make_file_with_data(self.seg_format.format(1), "qlog", lock=True)
+    index.refresh()
+    assert scan.call_count == 1
+    assert index.dirs[self.seg_format.format(1)].locked
+
+  def test_bytes_to_free(self):
+    gb = 1024 * 1024 * 1024
+    self.fake_stats = Stats(f_bavail=6 * gb // 4096, f_blocks=100 * gb // 4096, f_frsize=4096)
+    # 6GB free is above MIN_BYTES, but 4GB short of MIN_PERCENT
+    assert abs(deleter.get_bytes_to_free() - 4 * gb) < 4096
+
+    self.fake_stats = Stats(f_bavail=4 * gb // 4096, f_blocks=20 * gb // 4096, f_frsize=4096)
+    assert deleter.get_bytes_to_free() == deleter.MIN_BYTES - 4 * gb
+
+  def test_delete_batch_paced(self):
+    for i in range(3):
+      self.make_file_with_data(self.seg_dir, f"{self.f_type}.{i}", 1)
+    index = deleter.DeleterIndex(Paths.log_root())
+    index.refresh()
+    size = index.dirs[self.seg_dir].size
+
+    # the bucket starts full, the third MB waits for half a second of budget
+    limiter = deleter.BandwidthLimiter(2 * size / 3)
+    start = time.monotonic()
+    deleted, freed = deleter.delete_batch(index.root, [self.seg_dir], {self.seg_dir: size}, threading.Event(), limiter)
+    assert time.monotonic() - start > 0.4
+    assert deleted == [self.seg_dir]
+    assert freed == size
+    assert not (Path(Paths.log_root()) / self.seg_dir).exists()
+
+  def test_delete_batch_invalidates_xattrs(self):
+    xattr_cache.invalidate()
+    self.make_file_with_data(self.seg_dir, self.f_type, upload_xattr=b'1', preserve_xattr=b'1')
+    index = deleter.DeleterIndex(Paths.log_root())
+    index.refresh()
+    assert xattr_cache.cache_info()["size"] > 0
+
+    limiter = deleter.BandwidthLimiter(deleter.DELETE_RATE)
+    deleter.delete_batch(index.root, [self.seg_dir], {self.seg_dir: index.dirs[self.seg_dir].size}, threading.Event(), limiter)
+    assert xattr_cache.cache_info()["size"] == 0
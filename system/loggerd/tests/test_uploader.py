@@ -3,13 +3,19 @@ import time
 import threading
 import logging
 import json
+import pytest
+import zstandard as zstd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from openpilot.system.hardware.hw import Paths
 
 from openpilot.common.swaglog import cloudlog
-from openpilot.system.loggerd.uploader import main, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from openpilot.system.loggerd import compressed_cache
+from openpilot.system.loggerd import uploader
+from openpilot.system.loggerd.uploader import main, BandwidthLimiter, Uploader, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from openpilot.system.loggerd.xattr_cache import setxattr
 
-from openpilot.system.loggerd.tests.loggerd_tests_common import UploaderTestCase
+from openpilot.system.loggerd.tests.loggerd_tests_common import MockResponse, UploaderTestCase
 
 
 class FakeLogHandler(logging.Handler):
@@ -182,3 +188,276 @@ class TestUploader(UploaderTestCase):
     for f_path in f_paths:
       lock_path = f_path.with_suffix(f_path.suffix + ".lock")
       assert not lock_path.is_file(), "File lock not cleared on startup"
+
+
+class TestCompressedCache(UploaderTestCase):
+  def test_compress(self):
+    fn = str(self.make_file_with_data(self.seg_dir, "rlog", 2))
+    out_fn = compressed_cache.get_compressed(fn)
+    assert not out_fn.startswith(os.path.join(Paths.log_root(), ""))
+    with open(fn, 'rb') as f, open(out_fn, 'rb') as z:
+      assert zstd.ZstdDecompressor().decompress(z.read()) == f.read()
+
+  def test_reused_until_evicted(self):
+    fn = str(self.make_file_with_data(self.seg_dir, "rlog", 1))
+    out_fn = compressed_cache.get_compressed(fn)
+    mtime = os.path.getmtime(out_fn)
+    assert compressed_cache.get_compressed(fn) == out_fn
+    assert os.path.getmtime(out_fn) == mtime
+
+    compressed_cache.evict(out_fn)
+    assert not os.path.exists(out_fn)
+
+  def test_evict_after_source_deleted(self):
+    fn = str(self.make_file_with_data(self.seg_dir, "rlog", 0.1))
+    out_fn = compressed_cache.get_compressed(fn)
+    # the deleter can remove the log while its compressed copy is being uploaded
+    os.unlink(fn)
+    compressed_cache.evict(out_fn)
+    assert not os.path.exists(out_fn)
+
+  def test_prune_stale_temp_files(self):
+    os.makedirs(compressed_cache.cache_root(), exist_ok=True)
+    stale, fresh = (os.path.join(compressed_cache.cache_root(), f"{compressed_cache.TEMP_PREFIX}{n}") for n in ("stale", "fresh"))
+    for fn in (stale, fresh):
+      with open(fn, "wb") as f:
+        f.write(b"partial")
+    t = time.time() - compressed_cache.TEMP_MAX_AGE - 1
+    os.utime(stale, (t, t))
+
+    compressed_cache.prune()
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+  def test_prune(self):
+    fns = [str(self.make_file_with_data(self.seg_format.format(i), "rlog", 0.5)) for i in range(4)]
+    out_fns = [compressed_cache.get_compressed(fn) for fn in fns]
+    compressed_cache.prune(max_bytes=os.path.getsize(out_fns[-1]) * 2.5)
+    assert [os.path.exists(f) for f in out_fns] == [False, False, True, True]
+
+  def test_prune_copy_evicted_concurrently(self, mocker):
+    fns = [str(self.make_file_with_data(self.seg_format.format(i), "rlog", 0.5)) for i in range(3)]
+    out_fns = [compressed_cache.get_compressed(fn) for fn in fns]
+
+    # another upload worker evicts a copy between listing the cache and stat'ing it
+    scandir = os.scandir
+    def scandir_then_evict(path):
+      entries = list(scandir(path))
+      compressed_cache.evict(out_fns[0])
+      return iter(entries)
+    mocker.patch.object(compressed_cache.os, "scandir", scandir_then_evict)
+
+    compressed_cache.prune(max_bytes=os.path.getsize(out_fns[-1]) * 1.5)
+    assert [os.path.exists(f) for f in out_fns] == [False, False, True]
+
+
+class TestUploadIndex(UploaderTestCase):
+  def make_uploader(self):
+    return Uploader("0000000000000000", Paths.log_root())
+
+  def test_no_relist_when_unchanged(self, mocker):
+    for i in range(10):
+      self.make_file_with_data(self.seg_format.format(i), "qlog")
+      self.make_file_with_data(self.seg_format.format(i), "rlog")
+    up = self.make_uploader()
+    assert up.next_file_to_upload(False)[1] == f"{self.seg_format.format(0)}/qlog"
+
+    listdir = mocker.spy(os, "listdir")
+    for _ in range(3):
+      assert up.next_file_to_upload(False)[1] == f"{self.seg_format.format(0)}/qlog"
+    assert listdir.call_count == 0
+
+    # new segment is picked up from the change of the root
+    self.make_file_with_data("boot", "0", 0.01)
+    assert up.next_file_to_upload(False)[1] == "boot/0"
+
+  def test_lock_removed(self):
+    self.make_file_with_data(self.seg_dir, "qlog", lock=True)
+    up = self.make_uploader()
+    assert up.next_file_to_upload(False) is None
+
+    os.unlink(Path(Paths.log_root()) / self.seg_dir / "qlog.lock")
+    assert up.next_file_to_upload(False)[1] == f"{self.seg_dir}/qlog"
+
+  def test_uploaded_or_deleted(self):
+    fns = [self.make_file_with_data(self.seg_format.format(i), "qlog") for i in range(3)]
+    up = self.make_uploader()
+    assert up.next_file_to_upload(False)[2] == str(fns[0])
+
+    setxattr(str(fns[0]), UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
+    assert up.next_file_to_upload(False)[2] == str(fns[1])
+
+    os.unlink(fns[1])
+    assert up.next_file_to_upload(False)[2] == str(fns[2])
+    assert len(up.index.pending) == 1
+
+  @pytest.mark.parametrize("use_inotify", [True, False])
+  def test_lock_created_after_listing(self, use_inotify):
+    up = self.make_uploader()
+    if not use_inotify:
+      up.index.watcher = None
+    seg = Path(Paths.log_root()) / self.seg_dir
+    seg.mkdir(parents=True)
+    assert up.next_file_to_upload(False) is None
+
+    # loggerd creates the directory before the lock file
+    self.make_file_with_data(self.seg_dir, "qlog", lock=True)
+    assert up.next_file_to_upload(False) is None
+
+    os.unlink(seg / "qlog.lock")
+    assert up.next_file_to_upload(False)[1] == f"{self.seg_dir}/qlog"
+
+  def test_metered_requested_routes(self):
+    for seg in (self.seg_format.format(0), self.seg_format2.format(0)):
+      self.make_file_with_data(seg, "qlog")
+      self.make_file_with_data(seg, "qcamera.ts")
+    self.params.put("AthenadRecentlyViewedRoutes", "0000000000000000|" + self.seg_format2.rsplit("--", 1)[0])
+    up = self.make_uploader()
+
+    def upload_order(metered):
+      up.index.last_reconcile = -uploader.RECONCILE_INTERVAL
+      order = []
+      while (d := up.next_file_to_upload(metered, exclude={os.path.join(Paths.log_root(), k) for k in order})) is not None:
+        order.append(d[1])
+      return order
+
+    qlogs = [f"{self.seg_format.format(0)}/qlog", f"{self.seg_format2.format(0)}/qlog"]
+    assert upload_order(True) == qlogs + [f"{self.seg_format2.format(0)}/qcamera.ts"]
+    assert upload_order(False) == [qlogs[0], f"{self.seg_format.format(0)}/qcamera.ts", qlogs[1], f"{self.seg_format2.format(0)}/qcamera.ts"]
+
+
+class UploadServer(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def __init__(self, delay):
+    self.delay = delay
+    self.lock = threading.Lock()
+    self.active = 0
+    self.max_active = 0
+    self.received: list[str] = []
+    self.fail: set[str] = set()  # paths that get an error response
+    super().__init__(('127.0.0.1', 0), UploadRequestHandler)
+
+
+class UploadRequestHandler(BaseHTTPRequestHandler):
+  def do_PUT(self):
+    srv = self.server
+    with srv.lock:
+      srv.active += 1
+      srv.max_active = max(srv.max_active, srv.active)
+    self.rfile.read(int(self.headers['Content-Length']))
+    time.sleep(srv.delay)
+    with srv.lock:
+      srv.active -= 1
+      srv.received.append(self.path)
+    self.send_response(500 if self.path in srv.fail else 200)
+    self.end_headers()
+
+  def log_message(self, *args):
+    pass
+
+
+class TestConcurrentUpload(UploaderTestCase):
+  def setup_method(self):
+    super().setup_method()
+    log_handler.reset()
+    self.server = UploadServer(delay=0.2)
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    url = f"http://127.0.0.1:{self.server.server_port}"
+    class ServerApi:
+      def __init__(self, dongle_id):
+        pass
+
+      def get(self, *args, **kwargs):
+        return MockResponse(json.dumps({"url": f"{url}/{kwargs['path']}", "headers": {}}), 200)
+
+      def get_token(self):
+        return "fake-token"
+
+    uploader.Api = ServerApi
+    uploader.fake_upload = False
+    uploader.allow_sleep = True
+
+  def teardown_method(self):
+    self.server.shutdown()
+    self.server.server_close()
+    compressed_cache.prune(0)
+
+  def test_concurrency_limit(self):
+    uploader.concurrency_override = 3
+    fns = [self.make_file_with_data(self.seg_format.format(i), "qlog", 0.1) for i in range(8)]
+
+    end_event = threading.Event()
+    thread = threading.Thread(target=main, args=[end_event], daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while len(log_handler.upload_order) < len(fns) and time.monotonic() < deadline:
+      time.sleep(0.05)
+    end_event.set()
+    thread.join()
+
+    assert sorted(log_handler.upload_order) == sorted(f"{self.seg_format.format(i)}/qlog.zst" for i in range(8))
+    assert len(self.server.received) == len(fns), "Some files were uploaded twice"
+    assert self.server.max_active == 3
+    for fn in fns:
+      assert os.getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
+
+  def run_main_until(self, done, timeout):
+    end_event = threading.Event()
+    thread = threading.Thread(target=main, args=[end_event], daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not done() and time.monotonic() < deadline:
+      time.sleep(0.05)
+    end_event.set()
+    thread.join()
+
+  def test_uploads_continue_after_idle(self, mocker):
+    uploader.concurrency_override = 1
+    self.params.put("IsOffroad", "0")
+    mocker.patch.object(uploader.random, "uniform", return_value=0.)
+
+    # the files only show up once the loop went idle for 5s, then they have to follow each other without more idle waits
+    def make_files():
+      time.sleep(0.5)
+      for i in range(4):
+        self.make_file_with_data(self.seg_format.format(i), "qlog", 0.1)
+    threading.Thread(target=make_files, daemon=True).start()
+    self.run_main_until(lambda: len(log_handler.upload_order) == 4, 8)
+    assert len(log_handler.upload_order) == 4
+
+  def test_failed_file_backs_off_alone(self):
+    uploader.concurrency_override = 1
+    for i in range(4):
+      self.make_file_with_data(self.seg_format.format(i), "qlog", 0.1)
+    self.server.fail.add(f"/{self.seg_format.format(0)}/qlog.zst")
+
+    self.run_main_until(lambda: len(log_handler.upload_order) == 3, 5)
+    assert sorted(log_handler.upload_order) == [f"{self.seg_format.format(i)}/qlog.zst" for i in range(1, 4)]
+    # the failing file is retried with a growing backoff, not in a tight loop
+    assert 1 <= self.server.received.count(f"/{self.seg_format.format(0)}/qlog.zst") <= 4
+
+  def test_metered_single_upload(self):
+    up = Uploader("0000000000000000", Paths.log_root())
+    assert up.max_concurrency(uploader.NetworkType.wifi, True) == 1
+    uploader.concurrency_override = 0
+    assert up.max_concurrency(uploader.NetworkType.cell4G, False) == 1
+    assert up.max_concurrency(uploader.NetworkType.wifi, True) == 1
+    assert up.max_concurrency(uploader.NetworkType.ethernet, False) == uploader.UPLOAD_CONCURRENCY[uploader.NetworkType.ethernet]
+
+
+class TestBandwidthLimiter:
+  def test_rate(self):
+    limiter = BandwidthLimiter(1e6)
+    st = time.monotonic()
+    # the first second is covered by the burst
+    for _ in range(20):
+      limiter.consume(100_000)
+    assert 0.9 < time.monotonic() - st < 1.5
+
+  def test_unlimited(self):
+    limiter = BandwidthLimiter(0)
+    st = time.monotonic()
+    limiter.consume(1 << 30)
+    assert time.monotonic() - st < 0.1
@@ -0,0 +1,73 @@
+import os
+
+from openpilot.system.loggerd import xattr_cache
+from openpilot.system.loggerd.xattr_cache import cache_info, getxattr, invalidate, setxattr
+
+ATTR = 'user.test'
+
+
+class TestXattrCache:
+  def setup_method(self):
+    invalidate()
+
+  def test_hit_after_set(self, tmp_path):
+    fn = str(tmp_path / "a")
+    open(fn, "w").close()
+
+    assert getxattr(fn, ATTR) is None
+    setxattr(fn, ATTR, b'1')
+    hits = cache_info()["hits"]
+    assert getxattr(fn, ATTR) == b'1'
+    assert cache_info()["hits"] == hits + 1
+
+  def test_set_by_other_process(self, tmp_path):
+    fn = str(tmp_path / "a")
+    open(fn, "w").close()
+
+    assert getxattr(fn, ATTR) is None
+    os.setxattr(fn, ATTR, b'1')
+    assert getxattr(fn, ATTR) == b'1'
+
+  def test_replaced_file(self, tmp_path):
+    fn = str(tmp_path / "a")
+    open(fn, "w").close()
+    setxattr(fn, ATTR, b'1')
+    assert getxattr(fn, ATTR) == b'1'
+
+    os.unlink(fn)
+    open(fn, "w").close()
+    assert getxattr(fn, ATTR) is None
+
+  def test_invalidate_deleted_file(self, tmp_path):
+    fns = [str(tmp_path / str(i)) for i in range(2)]
+    for fn in fns:
+      open(fn, "w").close()
+      setxattr(fn, ATTR, b'1')
+      getxattr(fn, 'user.other')
+    assert cache_info()["size"] == 4
+
+    st = os.stat(fns[0])
+    os.unlink(fns[0])
+    invalidate(fns[0])
+    assert cache_info()["size"] == 4
+    invalidate(st=st)
+    assert cache_info()["size"] == 2
+    assert getxattr(fns[1], ATTR) == b'1'
+
+  def test_bounded(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(xattr_cache, "MAX_ENTRIES", 8)
+    fns = []
+    for i in range(20):
+      fns.append(str(tmp_path / str(i)))
+      open(fns[-1], "w").close()
+      getxattr(fns[-1], ATTR)
+
+    info = cache_info()
+    assert info["size"] == 8
+    assert info["evictions"] >= 12
+
+    # most recently used entries are kept
+    hits = info["hits"]
+    for fn in fns[-8:]:
+      getxattr(fn, ATTR)
+    assert cache_info()["hits"] == hits + 8
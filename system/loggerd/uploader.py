@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
-import io
+import bisect
+import heapq
 import json
 import os
 import random
@@ -8,16 +9,18 @@ import threading
 import time
 import traceback
 import datetime
-import zstandard as zstd
 from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 from cereal import log
 import cereal.messaging as messaging
 from openpilot.common.api import Api
+from openpilot.common.inotify import IN_CREATE, IN_DELETE, IN_IGNORED, IN_MOVED_FROM, IN_MOVED_TO, IN_ONLYDIR, IN_Q_OVERFLOW, Inotify
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware.hw import Paths
-from openpilot.system.loggerd.xattr_cache import getxattr, setxattr
+from openpilot.system.loggerd import compressed_cache
+from openpilot.system.loggerd.xattr_cache import cache_info, getxattr, setxattr
 from openpilot.common.swaglog import cloudlog
 
 NetworkType = log.DeviceState.NetworkType
@@ -25,11 +28,22 @@ UPLOAD_ATTR_NAME = 'user.upload'
 UPLOAD_ATTR_VALUE = b'1'
 
 UPLOAD_QLOG_QCAM_MAX_SIZE = 5 * 1e6  # MB
-LOG_COMPRESSION_LEVEL = 10  # little benefit up to level 15. level ~17 is a small step change
+RECONCILE_INTERVAL = 300  # seconds between full rescans of the log root
+DIR_SETTLE_TIME = 10  # seconds, a new segment can still be getting its lock file and first files
+
+# simultaneous uploads per network type, metered connections upload one file at a time
+UPLOAD_CONCURRENCY = {
+  NetworkType.ethernet: 4,
+  NetworkType.wifi: 3,
+}
+UPLOAD_BANDWIDTH_LIMIT = float(os.getenv("UPLOADER_BANDWIDTH_LIMIT", "0"))  # bytes/s shared by all uploads, 0 is unlimited
+UPLOAD_STATS_INTERVAL = 60  # seconds
+UPLOAD_BACKOFF_MAX = 120  # seconds, before a failed file is retried
 
 allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
+concurrency_override = int(os.getenv("UPLOADER_CONCURRENCY", "0"))
 
 
 class FakeRequest:
@@ -71,6 +85,257 @@ def clear_locks(root: str) -> None:
       cloudlog.exception("clear_locks failed")
 
 
+class BandwidthLimiter:
+  """Token bucket shared by all running uploads"""
+  def __init__(self, rate: float):
+    self.rate = rate
+    self.tokens = rate
+    self.last = time.monotonic()
+    self.lock = threading.Lock()
+
+  def consume(self, n: int) -> None:
+    if self.rate <= 0:
+      return
+
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+      self.last = now
+      self.tokens -= n
+      # every reader waits for its own share of the debt
+      delay = -self.tokens / self.rate
+    if delay > 0:
+      time.sleep(delay)
+
+
+class UploadStats:
+  """Bytes sent by all uploads, logged as throughput every UPLOAD_STATS_INTERVAL"""
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.bytes = 0
+    self.files = 0
+    self.start = time.monotonic()
+
+  def add(self, n: int) -> None:
+    with self.lock:
+      self.bytes += n
+
+  def file_done(self) -> None:
+    with self.lock:
+      self.files += 1
+
+  def log(self, network_type: int, metered: bool, active: int, force: bool = False) -> None:
+    now = time.monotonic()
+    dt = now - self.start
+    if dt < UPLOAD_STATS_INTERVAL and not force:
+      return
+
+    with self.lock:
+      sent, files = self.bytes, self.files
+      self.bytes, self.files, self.start = 0, 0, now
+    if sent or files:
+      cloudlog.event("upload_throughput", bytes=sent, files=files, dt=dt, speed=(sent / 1e6) / dt, active=active,
+                     network_type=network_type, metered=metered, xattr_cache=cache_info())
+
+
+class UploadReader:
+  """File wrapper that accounts the bytes requests reads from it against the bandwidth budget"""
+  def __init__(self, f, limiter: BandwidthLimiter, stats: UploadStats):
+    self.f = f
+    self.limiter = limiter
+    self.stats = stats
+
+  def __getattr__(self, attr):
+    return getattr(self.f, attr)
+
+  def read(self, *args, **kwargs):
+    chunk = self.f.read(*args, **kwargs)
+    self.limiter.consume(len(chunk))
+    self.stats.add(len(chunk))
+    return chunk
+
+
+class UploadIndex:
+  """Files the uploader could pick, kept sorted in upload order.
+
+  New and deleted segments show up as a change of the root's mtime. Segment directories are watched
+  with inotify and only relisted when something in them changes. Where inotify isn't available, locked,
+  recently modified and immediate folders are stat'ed on each refresh instead. Anything else, like
+  xattrs set by other processes, is caught by a periodic full rescan."""
+
+  def __init__(self, root: str, immediate_folders: list[str], immediate_priority: dict[str, int]):
+    self.root = root
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+
+    # (tier, dir sort, name priority, name, logdir). qcameras are kept apart, so metered connections
+    # can look up the requested routes instead of walking past every other segment's qcamera
+    self.pending: list[tuple] = []
+    self.pending_qcam: list[tuple] = []
+    self.dir_keys: dict[str, set[tuple]] = {}
+    self.ctimes: dict[tuple[str, str], float] = {}
+    self.dirs: dict[str, tuple[int, bool]] = {}  # logdir -> (mtime, locked)
+    self.root_mtime: int | None = None
+    self.last_reconcile = -RECONCILE_INTERVAL
+
+    self.watcher: Inotify | None = None
+    self.wds: dict[int, str] = {}
+    self.changed: set[str] = set()
+    try:
+      self.watcher = Inotify()
+    except OSError:
+      cloudlog.exception("uploader.inotify_failed")
+
+  def _upload_key(self, logdir: str, name: str) -> tuple | None:
+    if any(f in os.path.join(logdir, name) for f in self.immediate_folders):
+      tier = 0
+    elif name in self.immediate_priority:
+      tier = 1
+    else:
+      # never picked by next_file_to_upload
+      return None
+    return tier, tuple(get_directory_sort(logdir)), self.immediate_priority.get(name, 1000), name, logdir
+
+  def _keys(self, key: tuple) -> list[tuple]:
+    return self.pending_qcam if key[0] == 1 and key[3] == "qcamera.ts" else self.pending
+
+  def _remove_key(self, key: tuple) -> None:
+    keys = self._keys(key)
+    i = bisect.bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+      del keys[i]
+    self.ctimes.pop((key[4], key[3]), None)
+
+  def _remove_dir(self, logdir: str) -> None:
+    self.dirs.pop(logdir, None)
+    for key in self.dir_keys.pop(logdir, ()):
+      self._remove_key(key)
+
+  def _watch(self, logdir: str) -> None:
+    if self.watcher is None:
+      return
+    try:
+      wd = self.watcher.add_watch(os.path.join(self.root, logdir), IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR)
+      self.wds[wd] = logdir
+    except OSError:
+      pass
+
+  def _scan_dir(self, logdir: str) -> None:
+    path = os.path.join(self.root, logdir)
+    self._remove_dir(logdir)
+    # watched before listing, so a lock file created in between is still seen
+    self._watch(logdir)
+    try:
+      mtime = os.stat(path).st_mtime_ns
+      names = os.listdir(path)
+    except OSError:
+      return
+
+    locked = any(name.endswith(".lock") for name in names)
+    self.dirs[logdir] = (mtime, locked)
+    if locked:
+      return
+
+    for name in names:
+      key = self._upload_key(logdir, name)
+      if key is None:
+        continue
+
+      fn = os.path.join(path, name)
+      # skip files already uploaded
+      try:
+        ctime = os.path.getctime(fn)
+        is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
+      except OSError:
+        cloudlog.event("uploader_getxattr_failed", key=os.path.join(logdir, name), fn=fn)
+        # deleter could have deleted, so skip
+        continue
+      if not is_uploaded:
+        bisect.insort(self._keys(key), key)
+        self.dir_keys.setdefault(logdir, set()).add(key)
+        self.ctimes[(logdir, name)] = ctime
+
+  def _read_events(self) -> None:
+    assert self.watcher is not None
+    for wd, mask, _ in self.watcher.read(0):
+      if mask & IN_Q_OVERFLOW:
+        self.last_reconcile = -RECONCILE_INTERVAL
+      elif mask & IN_IGNORED:
+        self.wds.pop(wd, None)
+      elif wd in self.wds:
+        self.changed.add(self.wds[wd])
+
+  def _changed_dirs(self) -> set[str]:
+    if self.watcher is not None:
+      self._read_events()
+      changed, self.changed = self.changed, set()
+      return changed
+
+    changed = set()
+    now = time.time_ns()
+    for logdir, (mtime, locked) in self.dirs.items():
+      # an unlocked directory is final, unless it's so new that loggerd hasn't created the lock yet
+      recent = now - mtime < DIR_SETTLE_TIME * 1e9
+      if locked or recent or logdir + "/" in self.immediate_folders:
+        try:
+          # mtime resolution can hide a second change in the same tick, so recent directories are always relisted
+          if recent or os.stat(os.path.join(self.root, logdir)).st_mtime_ns != mtime:
+            changed.add(logdir)
+        except OSError:
+          changed.add(logdir)
+    return changed
+
+  def refresh(self) -> None:
+    try:
+      root_mtime = os.stat(self.root).st_mtime_ns
+    except OSError:
+      root_mtime = None
+
+    if self.watcher is not None:
+      self._read_events()
+
+    now = time.monotonic()
+    if now - self.last_reconcile > RECONCILE_INTERVAL:
+      self.last_reconcile = now
+      self.pending, self.pending_qcam, self.dir_keys, self.ctimes, self.dirs = [], [], {}, {}, {}
+      self.changed = set()
+      self.root_mtime = root_mtime
+      for logdir in listdir_by_creation(self.root):
+        self._scan_dir(logdir)
+      return
+
+    if root_mtime != self.root_mtime:
+      self.root_mtime = root_mtime
+      logdirs = set(listdir_by_creation(self.root))
+      for logdir in self.dirs.keys() - logdirs:
+        self._remove_dir(logdir)
+      for logdir in logdirs - self.dirs.keys():
+        self._scan_dir(logdir)
+
+    for logdir in self._changed_dirs():
+      self._scan_dir(logdir)
+
+  def discard(self, logdir: str, name: str) -> None:
+    key = self._upload_key(logdir, name)
+    if key is not None:
+      self._remove_key(key)
+      self.dir_keys.get(logdir, set()).discard(key)
+
+  def candidates(self, requested_routes: list[str] | None = None) -> Iterator[tuple]:
+    """Pending files in upload order. With requested_routes, only qcameras of those routes are included."""
+    if requested_routes is None:
+      return heapq.merge(self.pending, self.pending_qcam)
+
+    qcams = []
+    for route in requested_routes:
+      i = bisect.bisect_left(self.pending_qcam, (1, tuple(get_directory_sort(route + "--"))))
+      j = i
+      while j < len(self.pending_qcam) and self.pending_qcam[j][4].startswith(route):
+        j += 1
+      qcams.append(self.pending_qcam[i:j])
+    return heapq.merge(self.pending, *qcams)
+
+
 class Uploader:
   def __init__(self, dongle_id: str, root: str):
     self.dongle_id = dongle_id
@@ -84,58 +349,58 @@ class Uploader:
 
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.zst": 0, "qcamera.ts": 1}
+    self.index = UploadIndex(root, self.immediate_folders, self.immediate_priority)
+    self.limiter = BandwidthLimiter(UPLOAD_BANDWIDTH_LIMIT)
+    self.stats = UploadStats()
+
+  def max_concurrency(self, network_type: int, metered: bool) -> int:
+    if concurrency_override > 0:
+      return concurrency_override
+    if metered:
+      return 1
+    return UPLOAD_CONCURRENCY.get(network_type, 1)
+
+  def next_file_to_upload(self, metered: bool, exclude: set[str] = None) -> tuple[str, str, str] | None:
+    self.index.refresh()
+
+    requested_routes: list[str] = []
+    if metered:
+      r = self.params.get("AthenadRecentlyViewedRoutes", encoding="utf8")
+      requested_routes = [] if r is None else r.split(",")
+
+    # qcameras are only uploaded on metered connections for routes viewed recently
+    routes = [r.split('|')[-1] for r in requested_routes] if metered else None
+    stale, chosen = [], None
+    for _, _, _, name, logdir in self.index.candidates(routes):
+      key = os.path.join(logdir, name)
+      fn = os.path.join(self.root, logdir, name)
+
+      # already being uploaded
+      if exclude and fn in exclude:
+        continue
 
-  def list_upload_files(self, metered: bool) -> Iterator[tuple[str, str, str]]:
-    r = self.params.get("AthenadRecentlyViewedRoutes", encoding="utf8")
-    requested_routes = [] if r is None else r.split(",")
+      # limit uploading on metered connections
+      if metered:
+        dt = datetime.timedelta(hours=12)
+        ctime = self.index.ctimes[(logdir, name)]
+        if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
+          continue
 
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
+      # the candidate might have been uploaded or deleted since it was listed
       try:
-        names = os.listdir(path)
+        is_uploaded = not os.path.exists(fn) or getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
       except OSError:
+        is_uploaded = True
+      if is_uploaded:
+        stale.append((logdir, name))
         continue
 
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
-        key = os.path.join(logdir, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
-          continue
-        if is_uploaded:
-          continue
-
-        # limit uploading on metered connections
-        if metered:
-          dt = datetime.timedelta(hours=12)
-          if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
-            continue
+      chosen = name, key, fn
+      break
 
-          if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
-            continue
-
-        yield name, key, fn
-
-  def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
-    upload_files = list(self.list_upload_files(metered))
-
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return name, key, fn
-
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
-
-    return None
+    for logdir, name in stale:
+      self.index.discard(logdir, name)
+    return chosen
 
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -150,13 +415,15 @@ class Uploader:
     if fake_upload:
       return FakeResponse()
 
-    with open(fn, "rb") as f:
-      content = f.read()
-      if key.endswith('.zst') and not fn.endswith('.zst'):
-        content = zstd.compress(content, LOG_COMPRESSION_LEVEL)
+    compress = key.endswith('.zst') and not fn.endswith('.zst')
+    upload_fn = compressed_cache.get_compressed(fn) if compress else fn
 
-      with io.BytesIO(content) as data:
-        return requests.put(url, data=data, headers=headers, timeout=10)
+    # streamed from disk, the compressed copy is kept until the upload goes through
+    with open(upload_fn, "rb") as f:
+      resp = requests.put(url, data=UploadReader(f, self.limiter, self.stats), headers=headers, timeout=10)
+    if compress and resp.status_code in (200, 201, 401, 403):
+      compressed_cache.evict(upload_fn)
+    return resp
 
   def upload(self, name: str, key: str, fn: str, network_type: int, metered: bool) -> bool:
     try:
@@ -204,22 +471,23 @@ class Uploader:
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=last_exc, key=key, fn=fn, sz=sz)
+      self.stats.file_done()
 
     return success
 
+  def upload_file(self, name: str, key: str, fn: str, network_type: int, metered: bool) -> bool:
+    # qlogs and bootlogs need to be compressed before uploading
+    if key.endswith(('qlog', 'rlog')) or (key.startswith('boot/') and not key.endswith('.zst')):
+      key += ".zst"
+
+    return self.upload(name, key, fn, network_type, metered)
 
   def step(self, network_type: int, metered: bool) -> bool | None:
     d = self.next_file_to_upload(metered)
     if d is None:
       return None
 
-    name, key, fn = d
-
-    # qlogs and bootlogs need to be compressed before uploading
-    if key.endswith(('qlog', 'rlog')) or (key.startswith('boot/') and not key.endswith('.zst')):
-      key += ".zst"
-
-    return self.upload(name, key, fn, network_type, metered)
+    return self.upload_file(*d, network_type, metered)
 
 
 def main(exit_event: threading.Event = None) -> None:
@@ -242,27 +510,60 @@ def main(exit_event: threading.Event = None) -> None:
 
   sm = messaging.SubMaster(['deviceState'])
   uploader = Uploader(dongle_id, Paths.log_root())
+  pool = ThreadPoolExecutor(max_workers=max(concurrency_override, *UPLOAD_CONCURRENCY.values()), thread_name_prefix='upload')
+  active: dict[Future, str] = {}
 
+  # failed files are retried with their own exponential backoff, file -> (backoff, retry time)
+  failed: dict[str, tuple[float, float]] = {}
   backoff = 0.1
-  while not exit_event.is_set():
-    sm.update(0)
-    offroad = params.get_bool("IsOffroad")
-    network_type = sm['deviceState'].networkType if not force_wifi else NetworkType.wifi
-    if network_type == NetworkType.none:
+  try:
+    while not exit_event.is_set():
+      sm.update(0)
+      offroad = params.get_bool("IsOffroad")
+      network_type = sm['deviceState'].networkType if not force_wifi else NetworkType.wifi
+      if network_type == NetworkType.none:
+        if allow_sleep:
+          time.sleep(60 if offroad else 5)
+        continue
+
+      network_type_raw, metered = sm['deviceState'].networkType.raw, sm['deviceState'].networkMetered
+      limit = uploader.max_concurrency(NetworkType.wifi if force_wifi else network_type_raw, metered)
+
+      now = time.monotonic()
+      for f in [f for f in active if f.done()]:
+        fn = active.pop(f)
+        if f.result():
+          failed.pop(fn, None)
+        else:
+          file_backoff = min(failed.get(fn, (0.1, 0.))[0] * 2, UPLOAD_BACKOFF_MAX)
+          failed[fn] = (file_backoff, now + file_backoff + random.uniform(0, file_backoff))
+          cloudlog.info("upload backoff %r for %s", file_backoff, fn)
+      # forget files that weren't retried in time, e.g. because they were deleted
+      failed = {fn: v for fn, v in failed.items() if now < v[1] + UPLOAD_BACKOFF_MAX}
+
+      exclude = set(active.values()) | {fn for fn, (_, retry_time) in failed.items() if now < retry_time}
+      while len(active) < limit:
+        d = uploader.next_file_to_upload(metered, exclude=exclude)
+        if d is None:
+          break
+        active[pool.submit(uploader.upload_file, *d, network_type_raw, metered)] = d[2]
+        exclude.add(d[2])
+
+      backoff = 0.1 if active else (60 if offroad else 5)
+
+      uploader.stats.log(network_type_raw, metered, len(active))
       if allow_sleep:
-        time.sleep(60 if offroad else 5)
-      continue
-
-    success = uploader.step(sm['deviceState'].networkType.raw, sm['deviceState'].networkMetered)
-    if success is None:
-      backoff = 60 if offroad else 5
-    elif success:
-      backoff = 0.1
-    else:
-      cloudlog.info("upload backoff %r", backoff)
-      backoff = min(backoff*2, 120)
-    if allow_sleep:
-      time.sleep(backoff + random.uniform(0, backoff))
+        timeout = backoff + random.uniform(0, backoff)
+        retry_times = [retry_time for _, retry_time in failed.values() if retry_time > now]
+        if retry_times:
+          timeout = min(timeout, min(retry_times) - now)
+        if active:
+          # wake up as soon as a slot frees up
+          wait(active, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+          exit_event.wait(timeout)
+  finally:
+    pool.shutdown(wait=True)
 
 
 if __name__ == "__main__":
@@ -1,22 +1,97 @@
 import os
 import errno
+import threading
+from collections import OrderedDict
+
+# uploader, deleter and athenad run for days, so the cache is bounded and entries are
+# keyed by inode, not path. setting an xattr changes the ctime of the file, which is
+# how values set by other processes are noticed.
+MAX_ENTRIES = 16384
+
+_cached_attributes: OrderedDict[tuple[int, int, str], tuple[int, bytes | None]] = OrderedDict()
+# (st_dev, st_ino) -> cached attribute names, so a file's entries are dropped without a scan
+_inode_attrs: dict[tuple[int, int], set[str]] = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _drop_attr(key: tuple[int, int, str]) -> None:
+  attrs = _inode_attrs.get(key[:2])
+  if attrs is not None:
+    attrs.discard(key[2])
+    if not attrs:
+      del _inode_attrs[key[:2]]
+
+
+def _store(key: tuple[int, int, str], ctime_ns: int, value: bytes | None) -> None:
+  with _lock:
+    _cached_attributes[key] = (ctime_ns, value)
+    _cached_attributes.move_to_end(key)
+    _inode_attrs.setdefault(key[:2], set()).add(key[2])
+    while len(_cached_attributes) > MAX_ENTRIES:
+      evicted, _ = _cached_attributes.popitem(last=False)
+      _drop_attr(evicted)
+      _stats["evictions"] += 1
 
-_cached_attributes: dict[tuple, bytes | None] = {}
 
 def getxattr(path: str, attr_name: str) -> bytes | None:
-  key = (path, attr_name)
-  if key not in _cached_attributes:
-    try:
-      response = os.getxattr(path, attr_name)
-    except OSError as e:
-      # ENODATA means attribute hasn't been set
-      if e.errno == errno.ENODATA:
-        response = None
-      else:
-        raise
-    _cached_attributes[key] = response
-  return _cached_attributes[key]
+  st = os.stat(path)
+  key = (st.st_dev, st.st_ino, attr_name)
+  with _lock:
+    entry = _cached_attributes.get(key)
+    if entry is not None and entry[0] == st.st_ctime_ns:
+      _cached_attributes.move_to_end(key)
+      _stats["hits"] += 1
+      return entry[1]
+    _stats["misses"] += 1
+
+  try:
+    response = os.getxattr(path, attr_name)
+  except OSError as e:
+    # ENODATA means attribute hasn't been set
+    if e.errno == errno.ENODATA:
+      response = None
+    else:
+      invalidate(path)
+      raise
+  _store(key, st.st_ctime_ns, response)
+  return response
+
 
 def setxattr(path: str, attr_name: str, attr_value: bytes) -> None:
-  _cached_attributes.pop((path, attr_name), None)
-  return os.setxattr(path, attr_name, attr_value)
+  try:
+    os.setxattr(path, attr_name, attr_value)
+  except OSError:
+    invalidate(path)
+    raise
+
+  st = os.stat(path)
+  _store((st.st_dev, st.st_ino, attr_name), st.st_ctime_ns, attr_value)
+
+
+def invalidate(path: str | None = None, st: os.stat_result | None = None) -> None:
+  """
+  Drops the cached attributes of a file, or everything when neither path nor st is given.
+  Pass the stat taken before unlinking a file, since a deleted path can't be looked up anymore.
+  """
+  if st is None and path is not None:
+    try:
+      st = os.stat(path)
+    except OSError:
+      return
+
+  with _lock:
+    if st is None:
+      _cached_attributes.clear()
+      _inode_attrs.clear()
+      return
+
+    inode = (st.st_dev, st.st_ino)
+    for attr_name in _inode_attrs.pop(inode, ()):
+      del _cached_attributes[(*inode, attr_name)]
+
+
+def cache_info() -> dict[str, int | float]:
+  with _lock:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {**_stats, "size": len(_cached_attributes), "hit_rate": _stats["hits"] / lookups if lookups else 0.}
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import datetime
+import gc
 import os
 import signal
 import sys
@@ -11,8 +12,9 @@ import openpilot.system.sentry as sentry
 from openpilot.common.params import Params, ParamKeyType
 from openpilot.common.text_window import TextWindow
 from openpilot.system.hardware import HARDWARE, PC
+from openpilot.system.manager import startup_profiler
 from openpilot.system.manager.helpers import unblock_stdout, write_onroad_params, save_bootlog
-from openpilot.system.manager.process import ensure_running
+from openpilot.system.manager.process import ENABLE_ZYGOTE, ensure_running
 from openpilot.system.manager.process_config import managed_processes
 from openpilot.system.athena.registration import register, UNREGISTERED_DONGLE_ID
 from openpilot.common.swaglog import cloudlog, add_file_handler
@@ -97,8 +99,19 @@ def manager_init() -> None:
                        device=HARDWARE.get_device_type())
 
   # preimport all processes
+  startup_profiler.start("manager")
   for p in managed_processes.values():
-    p.prepare()
+    with startup_profiler.span(f"prepare {p.name}", "prepare"):
+      p.prepare()
+  startup_profiler.milestone("prepared", write=True)
+  startup_profiler.stop()
+
+  # python daemons are forked from here with everything already imported,
+  # collect once so they don't inherit garbage from the imports. freezing what's left
+  # once, rather than at every fork, keeps the manager's own later garbage collectable
+  gc.collect()
+  if ENABLE_ZYGOTE:
+    gc.freeze()
 
 
 def manager_cleanup() -> None:
@@ -16,15 +16,57 @@ import openpilot.system.sentry as sentry
 from openpilot.common.basedir import BASEDIR
 from openpilot.common.params import Params
 from openpilot.common.swaglog import cloudlog
+from openpilot.system.manager import startup_profiler
 
 WATCHDOG_FN = "/dev/shm/wd_"
 ENABLE_WATCHDOG = os.getenv("NO_WATCHDOG") is None
 
+# python daemons are forked from the manager, which has already imported all of them in prepare().
+# the manager freezes that heap once in manager_init, so the collector in the child doesn't walk the inherited
+# objects, which would touch, and so copy, nearly every page the daemon shares with the manager.
+ENABLE_ZYGOTE = os.getenv("NO_ZYGOTE") is None
 
-def launcher(proc: str, name: str) -> None:
+
+def report_first_message(name: str, start_time: float) -> None:
+  """Logs the time from the manager starting the daemon until it first publishes through a PubMaster"""
+  send = messaging.PubMaster.send
+
+  def first_send(self, s, dat):
+    messaging.PubMaster.send = send
+    cloudlog.event("process_first_message", daemon=name, service=s, time_to_first_message=time.monotonic() - start_time)
+    startup_profiler.milestone("first_message", write=True, service=s)
+    startup_profiler.stop()
+    return send(self, s, dat)
+
+  messaging.PubMaster.send = first_send
+
+
+def report_car_params() -> None:
+  """Marks when the daemon got past waiting for CarParams, nearly all of them parse it with log_from_bytes"""
+  log_from_bytes = messaging.log_from_bytes
+
+  def hooked_log_from_bytes(dat, struct=log.Event):
+    if struct is car.CarParams:
+      messaging.log_from_bytes = log_from_bytes
+      startup_profiler.milestone("carParams", write=True)
+    return log_from_bytes(dat, struct)
+
+  messaging.log_from_bytes = hooked_log_from_bytes
+
+
+def launcher(proc: str, name: str, start_time: float = None) -> None:
   try:
+    if startup_profiler.start(name) is not None:
+      startup_profiler.milestone("spawn", ts=start_time)
+      startup_profiler.milestone("launcher")
+      report_car_params()
+
+    if start_time is not None:
+      report_first_message(name, start_time)
+
     # import the process
     mod = importlib.import_module(proc)
+    startup_profiler.milestone("imported")
 
     # rename the process
     setproctitle(proc)
@@ -37,6 +79,7 @@ def launcher(proc: str, name: str) -> None:
     sentry.set_tag("daemon", name)
 
     # exec the process
+    startup_profiler.milestone("main", write=True)
     mod.main()
   except KeyboardInterrupt:
     cloudlog.warning(f"child {proc} got SIGINT")
@@ -221,7 +264,7 @@ class PythonProcess(ManagerProcess):
       return
 
     cloudlog.info(f"starting python {self.module}")
-    self.proc = Process(name=self.name, target=self.launcher, args=(self.module, self.name))
+    self.proc = Process(name=self.name, target=self.launcher, args=(self.module, self.name, time.monotonic()))
     self.proc.start()
     self.watchdog_seen = False
     self.shutting_down = False
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Opt-in startup tracing for managed processes, enabled by setting STARTUP_PROFILE to an output directory.
+
+The manager traces the imports of each process's prepare(). Every python daemon then traces the imports
+it still does after being forked, and its startup milestones: spawn, imported, main, carParams and its
+first published message. Each process writes its events in the Chrome trace format to
+STARTUP_PROFILE/<name>.<pid>.json, all on the same monotonic clock.
+
+Combine them into one flame chart for chrome://tracing or ui.perfetto.dev, and compare against an older run:
+  ./startup_profiler.py <dir> -o startup.json [--compare old_startup.json]
+"""
+import argparse
+import contextlib
+import glob
+import importlib.abc
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+PROFILE_DIR = os.getenv("STARTUP_PROFILE")
+
+MILESTONES = ["spawn", "launcher", "imported", "main", "carParams", "first_message"]
+
+
+def now_us() -> float:
+  return time.monotonic() * 1e6
+
+
+class StartupProfiler:
+  def __init__(self, name: str):
+    self.name = name
+    self.pid = os.getpid()
+    self.events: list[dict] = []
+
+  def complete(self, name: str, cat: str, start_us: float, end_us: float, **args) -> None:
+    self.events.append({"name": name, "cat": cat, "ph": "X", "ts": start_us, "dur": end_us - start_us,
+                        "pid": self.pid, "tid": self.pid, "args": args})
+
+  @contextlib.contextmanager
+  def span(self, name: str, cat: str, **args):
+    start = now_us()
+    try:
+      yield
+    finally:
+      self.complete(name, cat, start, now_us(), **args)
+
+  def milestone(self, name: str, ts: float = None, **args) -> None:
+    self.events.append({"name": name, "cat": "milestone", "ph": "i", "s": "p", "ts": now_us() if ts is None else ts * 1e6,
+                        "pid": self.pid, "tid": self.pid, "args": args})
+
+  def write(self) -> str:
+    assert PROFILE_DIR is not None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    fn = os.path.join(PROFILE_DIR, f"{self.name}.{self.pid}.json")
+    meta = {"name": "process_name", "ph": "M", "pid": self.pid, "tid": self.pid, "args": {"name": self.name}}
+    with open(fn + ".tmp", "w") as f:
+      json.dump([meta] + self.events, f)
+    os.replace(fn + ".tmp", fn)
+    return fn
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+  """Times exec_module of every module found by the other finders, like -X importtime"""
+  def find_spec(self, fullname, path, target=None):
+    for finder in sys.meta_path:
+      if finder is self or not hasattr(finder, "find_spec"):
+        continue
+      spec = finder.find_spec(fullname, path, target)
+      if spec is not None:
+        break
+    else:
+      return None
+
+    loader = spec.loader
+    exec_module = getattr(loader, "exec_module", None)
+    # builtin and frozen importers are shared classes, not per module loaders
+    if exec_module is None or isinstance(loader, type):
+      return spec
+
+    def timed_exec_module(module):
+      if profiler is None:
+        return exec_module(module)
+      with profiler.span(fullname, "import"):
+        return exec_module(module)
+
+    try:
+      loader.exec_module = timed_exec_module
+    except AttributeError:
+      pass
+    return spec
+
+
+profiler: StartupProfiler | None = None
+
+
+def start(name: str) -> StartupProfiler | None:
+  """Starts a new trace for this process, dropping any events inherited from the manager"""
+  global profiler
+  if PROFILE_DIR is None:
+    return None
+
+  profiler = StartupProfiler(name)
+  if not any(isinstance(f, ImportTimer) for f in sys.meta_path):
+    sys.meta_path.insert(0, ImportTimer())
+  return profiler
+
+
+def stop() -> None:
+  global profiler
+  profiler = None
+  sys.meta_path[:] = [f for f in sys.meta_path if not isinstance(f, ImportTimer)]
+
+
+def milestone(name: str, ts: float = None, write: bool = False, **args) -> None:
+  """Marks a startup milestone at ts, time.monotonic() seconds, or now"""
+  if profiler is not None:
+    profiler.milestone(name, ts, **args)
+    if write:
+      profiler.write()
+
+
+def span(name: str, cat: str, **args):
+  if profiler is None:
+    return contextlib.nullcontext()
+  return profiler.span(name, cat, **args)
+
+
+# *** report ***
+
+def load_traces(path: str) -> list[dict]:
+  events = []
+  for fn in sorted(glob.glob(os.path.join(path, "*.json"))):
+    with open(fn) as f:
+      events += json.load(f)
+  return events
+
+
+def summarize(events: list[dict]) -> dict[str, dict]:
+  names = {e["pid"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+  by_pid: dict[int, list[dict]] = defaultdict(list)
+  for e in events:
+    if e["ph"] != "M":
+      by_pid[e["pid"]].append(e)
+
+  summary = {}
+  for pid, evs in by_pid.items():
+    imports = sorted((e for e in evs if e["cat"] == "import"), key=lambda e: e["ts"])
+
+    # self time of each import, without the time spent in its nested imports
+    self_us = {id(e): e["dur"] for e in imports}
+    stack: list[dict] = []
+    for e in imports:
+      while stack and e["ts"] >= stack[-1]["ts"] + stack[-1]["dur"]:
+        stack.pop()
+      if stack:
+        self_us[id(stack[-1])] -= e["dur"]
+      stack.append(e)
+
+    spawn = next((e for e in evs if e["name"] == "spawn"), None)
+    t0 = spawn["ts"] if spawn is not None else min(e["ts"] for e in evs)
+    milestones = {e["name"]: (e["ts"] - t0) / 1e3 for e in evs if e["cat"] == "milestone"}
+    top = sorted(imports, key=lambda e: self_us[id(e)], reverse=True)[:10]
+    summary[names.get(pid, str(pid))] = {
+      "imports_ms": sum(self_us.values()) / 1e3,
+      "milestones_ms": milestones,
+      "prepare_ms": {e["name"]: e["dur"] / 1e3 for e in evs if e["cat"] == "prepare"},
+      "top_imports_ms": {e["name"]: self_us[id(e)] / 1e3 for e in top},
+    }
+  return summary
+
+
+def print_summary(summary: dict[str, dict], compare: dict[str, dict] | None = None) -> None:
+  columns = ["imports_ms"] + MILESTONES
+
+  def row(s: dict) -> dict[str, float]:
+    return {"imports_ms": s["imports_ms"], **s["milestones_ms"]}
+
+  print(f"{'process':<20}" + "".join(f"{c:>18}" for c in columns))
+  for name, s in sorted(summary.items(), key=lambda x: x[1]["milestones_ms"].get("first_message", float("inf"))):
+    cur, old = row(s), row(compare[name]) if compare and name in compare else {}
+    line = f"{name:<20}"
+    for c in columns:
+      if c not in cur:
+        line += f"{'-':>18}"
+        continue
+      delta = f"({cur[c] - old[c]:+.0f})" if c in old else ""
+      line += f"{cur[c]:>10.0f}{delta:>8}"
+    print(line)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Combine the startup traces of the managed processes")
+  parser.add_argument("dir", help="STARTUP_PROFILE directory of a run")
+  parser.add_argument("-o", "--output", default="startup_profile.json", help="combined Chrome trace and summary")
+  parser.add_argument("--compare", help="combined output of an older run to compare against")
+  args = parser.parse_args()
+
+  events = load_traces(args.dir)
+  summary = summarize(events)
+  with open(args.output, "w") as f:
+    json.dump({"traceEvents": events, "summary": summary}, f)
+
+  compare = None
+  if args.compare:
+    with open(args.compare) as f:
+      compare = json.load(f)["summary"]
+  print_summary(summary, compare)
+  print(f"\nwrote {args.output}, open it in chrome://tracing or ui.perfetto.dev")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,40 @@
+import importlib
+import sys
+import time
+
+from openpilot.system.manager import startup_profiler
+
+
+class TestStartupProfiler:
+  def test_import_tree(self, tmp_path, monkeypatch):
+    pkg = tmp_path / "startup_profiler_pkg"
+    pkg.mkdir()
+    (pkg / "__init__.py").write_text("import time\ntime.sleep(0.01)\nfrom . import child\n")
+    (pkg / "child.py").write_text("import time\ntime.sleep(0.05)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(startup_profiler, "PROFILE_DIR", str(tmp_path / "out"))
+
+    # the imports sleep on a fake clock, so the timings are exact however loaded the machine is
+    clock_us = [1e6]
+    def sleep(seconds):
+      clock_us[0] += seconds * 1e6
+    monkeypatch.setattr(time, "sleep", sleep)
+    monkeypatch.setattr(startup_profiler, "now_us", lambda: clock_us[0])
+
+    try:
+      startup_profiler.start("test")
+      startup_profiler.milestone("spawn")
+      importlib.import_module("startup_profiler_pkg")
+      startup_profiler.milestone("imported", write=True)
+    finally:
+      startup_profiler.stop()
+      sys.modules.pop("startup_profiler_pkg", None)
+      sys.modules.pop("startup_profiler_pkg.child", None)
+    assert not any(isinstance(f, startup_profiler.ImportTimer) for f in sys.meta_path)
+
+    summary = startup_profiler.summarize(startup_profiler.load_traces(str(tmp_path / "out")))["test"]
+    top = summary["top_imports_ms"]
+    # parent's self time excludes its child
+    assert top["startup_profiler_pkg.child"] == 50
+    assert top["startup_profiler_pkg"] == 10
+    assert summary["imports_ms"] == summary["milestones_ms"]["imported"] == 60
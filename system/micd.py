@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import os
+import threading
 import numpy as np
 from functools import cache
 
@@ -12,20 +14,27 @@ FFT_SAMPLES = 4096
 REFERENCE_SPL = 2e-5  # newtons/m^2
 SAMPLE_RATE = 44100
 SAMPLE_BUFFER = 4096  # approx 100ms
+FFT_HOP = int(os.getenv("MICD_FFT_HOP", str(FFT_SAMPLES)))  # samples between windows, less than FFT_SAMPLES overlaps them
+RING_SAMPLES = FFT_SAMPLES + 4 * SAMPLE_BUFFER  # room for the audio thread to run ahead of update()
 
 
 @cache
 def get_a_weighting_filter():
-  # Calculate the A-weighting filter
+  # Calculate the A-weighting filter, for the positive frequencies of an rfft
   # https://en.wikipedia.org/wiki/A-weighting
-  freqs = np.fft.fftfreq(FFT_SAMPLES, d=1 / SAMPLE_RATE)
+  freqs = np.fft.rfftfreq(FFT_SAMPLES, d=1 / SAMPLE_RATE)
   A = 12194 ** 2 * freqs ** 4 / ((freqs ** 2 + 20.6 ** 2) * (freqs ** 2 + 12194 ** 2) * np.sqrt((freqs ** 2 + 107.7 ** 2) * (freqs ** 2 + 737.9 ** 2)))
   return A / np.max(A)
 
 
+@cache
+def get_window():
+  return np.hanning(FFT_SAMPLES)
+
+
 def calculate_spl(measurements):
   # https://www.engineeringtoolbox.com/sound-pressure-d_711.html
-  sound_pressure = np.sqrt(np.mean(measurements ** 2))  # RMS of amplitudes
+  sound_pressure = np.sqrt(np.dot(measurements, measurements) / len(measurements))  # RMS of amplitudes
   if sound_pressure > 0:
     sound_pressure_level = 20 * np.log10(sound_pressure / REFERENCE_SPL)  # dB
   else:
@@ -34,11 +43,40 @@ def calculate_spl(measurements):
 
 
 def apply_a_weighting(measurements: np.ndarray) -> np.ndarray:
-  # Generate a Hanning window of the same length as the audio measurements
-  measurements_windowed = measurements * np.hanning(len(measurements))
-
-  # Apply the A-weighting filter to the signal
-  return np.abs(np.fft.ifft(np.fft.fft(measurements_windowed) * get_a_weighting_filter()))
+  # Apply a Hanning window and the A-weighting filter to FFT_SAMPLES real samples
+  spectrum = np.fft.rfft(measurements * get_window())
+  spectrum *= get_a_weighting_filter()
+  return np.abs(np.fft.irfft(spectrum, n=FFT_SAMPLES))
+
+
+class RingBuffer:
+  """Preallocated sample buffer. Every sample is stored twice, so the latest samples are always a contiguous view"""
+  def __init__(self, size: int):
+    self.size = size
+    self.buf = np.zeros(2 * size)
+    self.pos = 0
+    self.count = 0  # total samples written
+
+  def write(self, samples: np.ndarray) -> None:
+    n = len(samples)
+    self.count += n
+    if n > self.size:
+      samples = samples[-self.size:]
+      n = self.size
+
+    first = min(n, self.size - self.pos)
+    self.buf[self.pos:self.pos + first] = samples[:first]
+    self.buf[self.pos + self.size:self.pos + self.size + first] = samples[:first]
+    if first < n:
+      self.buf[:n - first] = samples[first:]
+      self.buf[self.size:self.size + n - first] = samples[first:]
+    self.pos = (self.pos + n) % self.size
+
+  def latest(self, n: int, offset: int = 0) -> np.ndarray:
+    """View of the n samples that end offset samples before the newest one"""
+    assert n + offset <= self.size
+    start = self.pos + self.size - n - offset
+    return self.buf[start:start + n]
 
 
 class Mic:
@@ -46,13 +84,18 @@ class Mic:
     self.rk = Ratekeeper(RATE)
     self.pm = messaging.PubMaster(['microphone'])
 
-    self.measurements = np.empty(0)
+    self.lock = threading.Lock()
+    self.ring = RingBuffer(RING_SAMPLES)
+    self.next_window_end = FFT_SAMPLES
+    self.frame = np.zeros(FFT_SAMPLES)
 
     self.sound_pressure = 0
     self.sound_pressure_weighted = 0
     self.sound_pressure_level_weighted = 0
 
   def update(self):
+    self.process()
+
     msg = messaging.new_message('microphone', valid=True)
     msg.microphone.soundPressure = float(self.sound_pressure)
     msg.microphone.soundPressureWeighted = float(self.sound_pressure_weighted)
@@ -63,23 +106,34 @@ class Mic:
     self.rk.keep_time()
 
   def callback(self, indata, frames, time, status):
+    # runs on the audio thread, only copies into the preallocated ring buffer
+    with self.lock:
+      self.ring.write(indata[:, 0])
+
+  def process(self) -> bool:
     """
     Using amplitude measurements, calculate an uncalibrated sound pressure and sound pressure level.
     Then apply A-weighting to the raw amplitudes and run the same calculations again.
 
     Logged A-weighted equivalents are rough approximations of the human-perceived loudness.
+    Only the newest complete window is processed, older ones would be overwritten before they're sent.
     """
-
-    self.measurements = np.concatenate((self.measurements, indata[:, 0]))
-
-    while self.measurements.size >= FFT_SAMPLES:
-      measurements = self.measurements[:FFT_SAMPLES]
-
-      self.sound_pressure, _ = calculate_spl(measurements)
-      measurements_weighted = apply_a_weighting(measurements)
-      self.sound_pressure_weighted, self.sound_pressure_level_weighted = calculate_spl(measurements_weighted)
-
-      self.measurements = self.measurements[FFT_SAMPLES:]
+    with self.lock:
+      written = self.ring.count
+      if written < self.next_window_end:
+        return False
+
+      window_end = self.next_window_end + (written - self.next_window_end) // FFT_HOP * FFT_HOP
+      offset = written - window_end
+      if offset + FFT_SAMPLES > self.ring.size:
+        window_end, offset = written, 0
+      np.copyto(self.frame, self.ring.latest(FFT_SAMPLES, offset))
+    self.next_window_end = window_end + FFT_HOP
+
+    self.sound_pressure, _ = calculate_spl(self.frame)
+    measurements_weighted = apply_a_weighting(self.frame)
+    self.sound_pressure_weighted, self.sound_pressure_level_weighted = calculate_spl(measurements_weighted)
+    return True
 
   @retry(attempts=7, delay=3)
   def get_stream(self, sd):
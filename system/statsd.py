@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
+import math
 import os
+import struct
 import zmq
 import time
 from pathlib import Path
-from collections import defaultdict
 from datetime import datetime, UTC
 from typing import NoReturn
 
@@ -14,13 +15,149 @@ from openpilot.common.swaglog import cloudlog
 from openpilot.system.hardware import HARDWARE
 from openpilot.common.file_helpers import atomic_write_in_dir
 from openpilot.system.version import get_build_metadata
-from openpilot.system.loggerd.config import STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S
+from openpilot.system.loggerd.config import STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S, STATS_PERCENTILES
 
 
 class METRIC_TYPE:
   GAUGE = 'g'
   SAMPLE = 'sa'
 
+# binary metric: magic byte, type byte, float64 value, then the utf-8 name.
+# text metrics ("name:value|type") are still accepted, they can't start with a zero byte
+BINARY_MAGIC = b'\x00'
+BINARY_HEADER = struct.Struct('<ccd')
+BINARY_TYPES = {METRIC_TYPE.GAUGE: b'g', METRIC_TYPE.SAMPLE: b's'}
+BINARY_TYPES_INV = {v: k for k, v in BINARY_TYPES.items()}
+
+
+def encode_metric(name: str, value: float, metric_type: str) -> bytes:
+  return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_TYPES[metric_type], value) + name.encode()
+
+
+def decode_metric(metric: bytes) -> tuple[str, float, str]:
+  """Returns name, value and type of a binary or text metric, raises ValueError if it's malformed"""
+  if metric[:1] == BINARY_MAGIC:
+    try:
+      _, metric_type, value = BINARY_HEADER.unpack_from(metric)
+      return metric[BINARY_HEADER.size:].decode(), value, BINARY_TYPES_INV[metric_type]
+    except (struct.error, KeyError) as e:
+      raise ValueError(f"malformed binary metric: {metric!r}") from e
+
+  name_value, sep, metric_type = metric.decode().partition('|')
+  name, _, value = name_value.partition(':')
+  if not sep:
+    raise ValueError(f"malformed metric: {metric!r}")
+  return name, float(value), metric_type
+
+
+class QuantileSketch:
+  """Mergeable quantile sketch with bounded memory (DDSketch)
+
+  Values are counted in logarithmically sized buckets, so every quantile is within
+  relative_accuracy of a value that was actually added. Once there are more than
+  max_buckets, the buckets closest to zero are collapsed together.
+  Count, sum, min and max are exact.
+  """
+  def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 1024):
+    self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.max_buckets = max_buckets
+    self.positive: dict[int, int] = {}
+    self.negative: dict[int, int] = {}
+    self.zero_count = 0
+    self.count = 0
+    self.sum = 0.0
+    self.min = math.inf
+    self.max = -math.inf
+
+  def _key(self, value: float) -> int:
+    return math.ceil(math.log(value) / self.log_gamma)
+
+  def _value(self, key: int) -> float:
+    return 2 * self.gamma ** key / (self.gamma + 1)
+
+  def add(self, value: float) -> None:
+    if not math.isfinite(value):
+      return
+
+    if value > 1e-9:
+      k = self._key(value)
+      self.positive[k] = self.positive.get(k, 0) + 1
+    elif value < -1e-9:
+      k = self._key(-value)
+      self.negative[k] = self.negative.get(k, 0) + 1
+    else:
+      self.zero_count += 1
+
+    self.count += 1
+    self.sum += value
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+    if len(self.positive) + len(self.negative) > self.max_buckets:
+      self._collapse()
+
+  def merge(self, other: 'QuantileSketch') -> None:
+    assert self.gamma == other.gamma, "can only merge sketches with the same accuracy"
+    for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+      for k, n in other_buckets.items():
+        buckets[k] = buckets.get(k, 0) + n
+    self.zero_count += other.zero_count
+    self.count += other.count
+    self.sum += other.sum
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    if len(self.positive) + len(self.negative) > self.max_buckets:
+      self._collapse()
+
+  def _collapse(self) -> None:
+    # fold the smallest magnitude buckets into the next one, the large values are the interesting ones
+    for buckets in (self.negative, self.positive):
+      excess = len(self.positive) + len(self.negative) - self.max_buckets
+      if excess <= 0 or len(buckets) < 2:
+        continue
+      keys = sorted(buckets)
+      n = min(excess, len(keys) - 1)
+      target = keys[n]
+      for k in keys[:n]:
+        buckets[target] += buckets.pop(k)
+
+  def quantile(self, q: float) -> float:
+    if self.count == 0:
+      return math.nan
+
+    # same rank as the sorted list this replaces
+    rank = int(round(q * (self.count - 1)))
+    if rank == 0:
+      return self.min
+    if rank == self.count - 1:
+      return self.max
+
+    seen = 0
+    for k in sorted(self.negative, reverse=True):
+      seen += self.negative[k]
+      if seen > rank:
+        return max(-self._value(k), self.min)
+    seen += self.zero_count
+    if seen > rank:
+      return 0.0
+    for k in sorted(self.positive):
+      seen += self.positive[k]
+      if seen > rank:
+        return min(self._value(k), self.max)
+    return self.max
+
+  def stats(self, percentiles=STATS_PERCENTILES) -> dict[str, float]:
+    stats = {
+      'count': self.count,
+      'min': self.min,
+      'max': self.max,
+      'mean': self.sum / self.count,
+    }
+    for percentile in percentiles:
+      stats[f"p{round(percentile * 100, 3):g}"] = self.quantile(percentile)
+    return stats
+
+
 class StatLog:
   def __init__(self):
     self.pid = None
@@ -40,23 +177,23 @@ class StatLog:
     if self.zctx is not None:
       self.zctx.term()
 
-  def _send(self, metric: str) -> None:
+  def _send(self, metric: bytes) -> None:
     if os.getpid() != self.pid:
       self.connect()
 
     try:
-      self.sock.send_string(metric, zmq.NOBLOCK)
+      self.sock.send(metric, zmq.NOBLOCK)
     except zmq.error.Again:
       # drop :/
       pass
 
   def gauge(self, name: str, value: float) -> None:
-    self._send(f"{name}:{value}|{METRIC_TYPE.GAUGE}")
+    self._send(encode_metric(name, value, METRIC_TYPE.GAUGE))
 
-  # Samples will be recorded in a buffer and at aggregation time,
+  # Samples will be recorded in a sketch and at aggregation time,
   # statistical properties will be logged (mean, count, percentiles, ...)
   def sample(self, name: str, value: float):
-    self._send(f"{name}:{value}|{METRIC_TYPE.SAMPLE}")
+    self._send(encode_metric(name, value, METRIC_TYPE.SAMPLE))
 
 
 def main() -> NoReturn:
@@ -104,7 +241,7 @@ def main() -> NoReturn:
   idx = 0
   last_flush_time = time.monotonic()
   gauges = {}
-  samples: dict[str, list[float]] = defaultdict(list)
+  samples: dict[str, QuantileSketch] = {}
   try:
     while True:
       started_prev = sm['deviceState'].started
@@ -113,16 +250,16 @@ def main() -> NoReturn:
       # Update metrics
       while True:
         try:
-          metric = sock.recv_string(zmq.NOBLOCK)
+          metric = sock.recv(zmq.NOBLOCK)
           try:
-            metric_type = metric.split('|')[1]
-            metric_name = metric.split(':')[0]
-            metric_value = float(metric.split('|')[0].split(':')[1])
+            metric_name, metric_value, metric_type = decode_metric(metric)
 
             if metric_type == METRIC_TYPE.GAUGE:
               gauges[metric_name] = metric_value
             elif metric_type == METRIC_TYPE.SAMPLE:
-              samples[metric_name].append(metric_value)
+              if metric_name not in samples:
+                samples[metric_name] = QuantileSketch()
+              samples[metric_name].add(metric_value)
             else:
               cloudlog.event("unknown metric type", metric_type=metric_type)
           except Exception:
@@ -139,22 +276,9 @@ def main() -> NoReturn:
         for key, value in gauges.items():
           result += get_influxdb_line(f"gauge.{key}", value, current_time, tags)
 
-        for key, values in samples.items():
-          values.sort()
-          sample_count = len(values)
-          sample_sum = sum(values)
-
-          stats = {
-            'count': sample_count,
-            'min': values[0],
-            'max': values[-1],
-            'mean': sample_sum / sample_count,
-          }
-          for percentile in [0.05, 0.5, 0.95]:
-            value = values[int(round(percentile * (sample_count - 1)))]
-            stats[f"p{int(percentile * 100)}"] = value
-
-          result += get_influxdb_line(f"sample.{key}", stats, current_time, tags)
+        for key, sketch in samples.items():
+          if sketch.count > 0:
+            result += get_influxdb_line(f"sample.{key}", sketch.stats(), current_time, tags)
 
         # clear intermediate data
         gauges.clear()
@@ -0,0 +1,66 @@
+import tracemalloc
+
+import numpy as np
+
+from openpilot.system import micd
+
+
+def synthetic_signal(n, seed=0):
+  rng = np.random.default_rng(seed)
+  t = np.arange(n) / micd.SAMPLE_RATE
+  return 0.3 * np.sin(2 * np.pi * 440 * t) + 0.1 * np.sin(2 * np.pi * 60 * t) + 0.01 * rng.standard_normal(n)
+
+
+def reference_a_weighting(measurements):
+  freqs = np.fft.fftfreq(len(measurements), d=1 / micd.SAMPLE_RATE)
+  A = 12194 ** 2 * freqs ** 4 / ((freqs ** 2 + 20.6 ** 2) * (freqs ** 2 + 12194 ** 2) * np.sqrt((freqs ** 2 + 107.7 ** 2) * (freqs ** 2 + 737.9 ** 2)))
+  return np.abs(np.fft.ifft(np.fft.fft(measurements * np.hanning(len(measurements))) * A / np.max(A)))
+
+
+class TestMicd:
+  def test_a_weighting_matches_fft(self):
+    x = synthetic_signal(micd.FFT_SAMPLES)
+    np.testing.assert_allclose(micd.apply_a_weighting(x), reference_a_weighting(x), atol=1e-12)
+
+  def test_ring_buffer(self):
+    ring = micd.RingBuffer(10)
+    data = np.arange(27, dtype=float)
+    for block in np.array_split(data, 6):
+      ring.write(block)
+    assert ring.count == 27
+    np.testing.assert_array_equal(ring.latest(10), data[-10:])
+    np.testing.assert_array_equal(ring.latest(4, offset=3), data[-7:-3])
+
+    ring.write(np.arange(100, 125, dtype=float))
+    np.testing.assert_array_equal(ring.latest(10), np.arange(115, 125))
+
+  def test_windows(self, mocker):
+    mocker.patch.object(micd, "FFT_HOP", micd.FFT_SAMPLES // 2)
+    mic = micd.Mic()
+    x = synthetic_signal(micd.FFT_SAMPLES * 3)
+    blocks = x.reshape(-1, micd.FFT_SAMPLES // 2, 1)
+
+    mic.callback(blocks[0], len(blocks[0]), None, None)
+    assert not mic.process()
+    for i, block in enumerate(blocks[1:], start=2):
+      mic.callback(block, len(block), None, None)
+      assert mic.process()
+      window = x[i * len(block) - micd.FFT_SAMPLES:i * len(block)]
+      assert mic.sound_pressure == micd.calculate_spl(window)[0]
+      np.testing.assert_allclose(mic.sound_pressure_weighted, micd.calculate_spl(reference_a_weighting(window))[0], rtol=1e-12)
+
+  def test_callback_no_allocation(self):
+    mic = micd.Mic()
+    block = synthetic_signal(micd.SAMPLE_BUFFER)[:, None]
+    mic.callback(block, len(block), None, None)
+
+    tracemalloc.start()
+    try:
+      before = tracemalloc.get_traced_memory()[0]
+      tracemalloc.reset_peak()
+      for _ in range(100):
+        mic.callback(block, len(block), None, None)
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+    assert peak - before < block.nbytes // 4
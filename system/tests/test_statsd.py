@@ -0,0 +1,58 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from openpilot.system.statsd import METRIC_TYPE, QuantileSketch, decode_metric, encode_metric
+
+
+class TestStatsd:
+  @pytest.mark.parametrize("metric_type", [METRIC_TYPE.GAUGE, METRIC_TYPE.SAMPLE])
+  def test_wire_format(self, metric_type):
+    assert decode_metric(encode_metric("cpu0_usage_percent", 12.5, metric_type)) == ("cpu0_usage_percent", 12.5, metric_type)
+    assert decode_metric(f"power_draw:1.25|{metric_type}".encode()) == ("power_draw", 1.25, metric_type)
+
+  @pytest.mark.parametrize("metric", [b"power_draw", b"power_draw:|sa", b"\x00g", b"\x00x" + bytes(8) + b"name"])
+  def test_malformed(self, metric):
+    with pytest.raises(ValueError):
+      decode_metric(metric)
+
+  def test_quantiles(self):
+    random.seed(0)
+    values = [random.lognormvariate(0, 2) - 1 for _ in range(100_000)]
+    sketch = QuantileSketch()
+    for v in values:
+      sketch.add(v)
+
+    values.sort()
+    stats = sketch.stats(percentiles=(0.05, 0.5, 0.95, 0.999))
+    assert stats['count'] == len(values)
+    assert stats['min'] == values[0]
+    assert stats['max'] == values[-1]
+    assert stats['mean'] == pytest.approx(np.mean(values))
+    for key, q in (('p5', 0.05), ('p50', 0.5), ('p95', 0.95), ('p99.9', 0.999)):
+      expected = values[int(round(q * (len(values) - 1)))]
+      assert stats[key] == pytest.approx(expected, rel=0.01, abs=1e-9), key
+
+  def test_bounded_and_mergeable(self):
+    a, b, full = QuantileSketch(max_buckets=256), QuantileSketch(max_buckets=256), QuantileSketch(max_buckets=256)
+    values = np.geomspace(1e-6, 1e6, 10_000)
+    for i, v in enumerate(values):
+      (a if i % 2 else b).add(v)
+      full.add(v)
+    a.merge(b)
+
+    assert len(a.positive) <= 256
+    assert a.count == full.count
+    # collapsing only touches the smallest values
+    assert a.quantile(0.95) == pytest.approx(full.quantile(0.95), rel=0.02)
+    assert a.quantile(0.95) == pytest.approx(values[int(round(0.95 * 9999))], rel=0.01)
+
+  def test_non_finite(self):
+    sketch = QuantileSketch()
+    for v in (math.nan, math.inf, 0.0, -2.0):
+      sketch.add(v)
+    assert sketch.count == 2
+    assert sketch.quantile(0.0) == -2.0
+    assert sketch.quantile(1.0) == 0.0
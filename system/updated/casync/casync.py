@@ -1,16 +1,20 @@
 #!/usr/bin/env python3
-import io
+import gc
 import lzma
 import os
 import pathlib
 import struct
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
 from collections import defaultdict, namedtuple
 from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from typing import IO
 
+import numpy as np
 import requests
 from Crypto.Hash import SHA512
 from openpilot.system.updated.casync import tar
@@ -31,9 +35,16 @@ CHUNK_DOWNLOAD_RETRIES = 3
 
 CAIBX_DOWNLOAD_TIMEOUT = 120
 
+# remote chunks are fetched, decompressed and verified in parallel, since on slow links
+# the extract time is dominated by the round trip of each chunk request
+EXTRACT_WORKERS = 8
+
 Chunk = namedtuple('Chunk', ['sha', 'offset', 'length'])
 ChunkDict = dict[bytes, Chunk]
 
+CA_TABLE_ENTRY_DTYPE = np.dtype([('end', '<u8'), ('sha', 'V32')])
+CHUNK_INDEX_DTYPE = np.dtype([('sha', 'V32'), ('offset', '<u8'), ('length', '<u8')])
+
 
 class ChunkReader(ABC):
   @abstractmethod
@@ -66,7 +77,14 @@ class RemoteChunkReader(ChunkReader):
   def __init__(self, url: str) -> None:
     super().__init__()
     self.url = url
-    self.session = requests.Session()
+    self._local = threading.local()
+
+  @property
+  def session(self) -> requests.Session:
+    # one session per thread, requests.Session isn't thread-safe
+    if not hasattr(self._local, 'session'):
+      self._local.session = requests.Session()
+    return self._local.session
 
   def read(self, chunk: Chunk) -> bytes:
     sha_hex = chunk.sha.hex()
@@ -106,100 +124,203 @@ class DirectoryTarChunkReader(BinaryChunkReader):
     os.unlink(self.f.name)
 
 
-def parse_caibx(caibx_path: str) -> list[Chunk]:
-  """Parses the chunks from a caibx file. Can handle both local and remote files.
-  Returns a list of chunks with hash, offset and length"""
-  caibx: io.BufferedIOBase
+def parse_caibx_index(caibx_path: str) -> np.ndarray:
+  """Parses the chunk table of a caibx file. Can handle both local and remote files.
+  Returns a CHUNK_INDEX_DTYPE array with hash, offset and length of every chunk"""
   if os.path.isfile(caibx_path):
-    caibx = open(caibx_path, 'rb')
+    with open(caibx_path, 'rb') as f:
+      caibx = f.read()
   else:
     resp = requests.get(caibx_path, timeout=CAIBX_DOWNLOAD_TIMEOUT)
     resp.raise_for_status()
-    caibx = io.BytesIO(resp.content)
-
-  caibx.seek(0, os.SEEK_END)
-  caibx_len = caibx.tell()
-  caibx.seek(0, os.SEEK_SET)
+    caibx = resp.content
 
   # Parse header
-  length, magic, flags, min_size, _, max_size = struct.unpack("<QQQQQQ", caibx.read(CA_HEADER_LEN))
+  length, magic, flags, min_size, _, max_size = struct.unpack_from("<QQQQQQ", caibx, 0)
   assert flags == flags
   assert length == CA_HEADER_LEN
   assert magic == CA_FORMAT_INDEX
 
   # Parse table header
-  length, magic = struct.unpack("<QQ", caibx.read(CA_TABLE_HEADER_LEN))
+  length, magic = struct.unpack_from("<QQ", caibx, CA_HEADER_LEN)
   assert magic == CA_FORMAT_TABLE
 
-  # Parse chunks
-  num_chunks = (caibx_len - CA_HEADER_LEN - CA_TABLE_MIN_LEN) // CA_TABLE_ENTRY_LEN
-  chunks = []
+  # Parse chunks, each entry holds the end offset of its chunk
+  num_chunks = (len(caibx) - CA_HEADER_LEN - CA_TABLE_MIN_LEN) // CA_TABLE_ENTRY_LEN
+  entries = np.frombuffer(caibx, dtype=CA_TABLE_ENTRY_DTYPE, count=num_chunks, offset=CA_HEADER_LEN + CA_TABLE_HEADER_LEN)
 
-  offset = 0
-  for i in range(num_chunks):
-    new_offset = struct.unpack("<Q", caibx.read(8))[0]
+  index = np.empty(num_chunks, dtype=CHUNK_INDEX_DTYPE)
+  index['sha'] = entries['sha']
+  index['offset'][:1] = 0
+  index['offset'][1:] = entries['end'][:-1]
+  index['length'] = entries['end'] - index['offset']
 
-    sha = caibx.read(32)
-    length = new_offset - offset
+  # unsigned, so offsets going backwards fail the max size check too
+  assert np.all(index['length'] <= max_size)
 
-    assert length <= max_size
+  # Last chunk can be smaller
+  assert np.all(index['length'][:-1] >= min_size)
 
-    # Last chunk can be smaller
-    if i < num_chunks - 1:
-      assert length >= min_size
+  return index
 
-    chunks.append(Chunk(sha, offset, length))
-    offset = new_offset
 
-  caibx.close()
-  return chunks
+def chunks_from_index(index: np.ndarray) -> list[Chunk]:
+  # hundreds of thousands of small allocations, without pausing the gc most of the time goes to collections
+  gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    shas = index['sha'].tobytes()
+    return list(map(Chunk, [shas[i:i + 32] for i in range(0, len(shas), 32)], index['offset'].tolist(), index['length'].tolist()))
+  finally:
+    if gc_enabled:
+      gc.enable()
+
+
+def parse_caibx(caibx_path: str) -> list[Chunk]:
+  """Parses the chunks from a caibx file. Can handle both local and remote files.
+  Returns a list of chunks with hash, offset and length"""
+  return chunks_from_index(parse_caibx_index(caibx_path))
 
 
 def build_chunk_dict(chunks: list[Chunk]) -> ChunkDict:
   """Turn a list of chunks into a dict for faster lookups based on hash.
   Keep first chunk since it's more likely to be already downloaded."""
-  r = {}
-  for c in chunks:
-    if c.sha not in r:
-      r[c.sha] = c
-  return r
+  return {c.sha: c for c in reversed(chunks)}
 
 
-def extract(target: list[Chunk],
-            sources: list[tuple[str, ChunkReader, ChunkDict]],
-            out_path: str,
-            progress: Callable[[int], None] = None):
-  stats: dict[str, int] = defaultdict(int)
+@dataclass
+class ExtractPlan:
+  source: np.ndarray  # per target chunk, index of the local source that has it, or -1 when it has to be downloaded
+  source_bytes: dict[str, int]  # bytes of the target each local source provides
+  remote: np.ndarray  # unique chunks to download, in target order
 
-  mode = 'rb+' if os.path.exists(out_path) else 'wb'
-  with open(out_path, mode) as out:
-    for cur_chunk in target:
+  @property
+  def remote_bytes(self) -> int:
+    """Uncompressed size of the download"""
+    return int(self.remote['length'].sum())
 
-      # Find source for desired chunk
-      for name, chunk_reader, store_chunks in sources:
-        if cur_chunk.sha in store_chunks:
-          bts = chunk_reader.read(store_chunks[cur_chunk.sha])
 
-          # Check length
-          if len(bts) != cur_chunk.length:
-            continue
+def plan_extract(target: np.ndarray, sources: list[tuple[str, np.ndarray]]) -> ExtractPlan:
+  """Decides which local source provides each target chunk, earlier sources first like extract does,
+  based on their indexes only. Everything else is downloaded once per unique chunk."""
+  source = np.full(len(target), -1, dtype=np.int32)
+  source_bytes = {}
+  for i, (name, index) in enumerate(sources):
+    todo = np.flatnonzero(source < 0)
+    found = todo[np.isin(target['sha'][todo], index['sha'])]
+    source[found] = i
+    source_bytes[name] = int(target['length'][found].sum())
 
-          # Check hash
-          if SHA512.new(bts, truncate="256").digest() != cur_chunk.sha:
-            continue
+  remote = target[source < 0]
+  _, first = np.unique(remote['sha'], return_index=True)
+  return ExtractPlan(source, source_bytes, remote[np.sort(first)])
 
-          # Write to output
-          out.seek(cur_chunk.offset)
-          out.write(bts)
 
-          stats[name] += cur_chunk.length
+def read_chunk(reader: ChunkReader, store_chunks: ChunkDict, chunk: Chunk) -> bytes | None:
+  """Reads a chunk from a source, returns None if the source doesn't have it or the data doesn't match"""
+  if chunk.sha not in store_chunks:
+    return None
+  bts = reader.read(store_chunks[chunk.sha])
 
-          if progress is not None:
-            progress(sum(stats.values()))
+  # Check length
+  if len(bts) != chunk.length:
+    return None
 
-          break
+  # Check hash
+  if SHA512.new(bts, truncate="256").digest() != chunk.sha:
+    return None
+
+  return bts
+
+
+def extract(target: list[Chunk],
+            sources: list[tuple[str, ChunkReader, ChunkDict]],
+            out_path: str,
+            progress: Callable[[int], None] = None,
+            workers: int = EXTRACT_WORKERS):
+  """Local sources are tried in order on the calling thread. Chunks none of them have are
+  fetched from the remote sources on a pool of workers while the local pass continues,
+  and written out of order. Each remote chunk is only fetched once, repeated chunks are
+  resolved after the first copy is written."""
+  stats: dict[str, int] = defaultdict(int)
+  local_sources = [s for s in sources if not isinstance(s[1], RemoteChunkReader)]
+  remote_sources = [s for s in sources if isinstance(s[1], RemoteChunkReader)]
+
+  total = 0
+  def done(name: str, length: int):
+    nonlocal total
+    stats[name] += length
+    total += length
+    if progress is not None:
+      progress(total)
+
+  def read_local(chunk: Chunk) -> tuple[str, bytes] | None:
+    for name, chunk_reader, store_chunks in local_sources:
+      bts = read_chunk(chunk_reader, store_chunks, chunk)
+      if bts is not None:
+        return name, bts
+    return None
+
+  def fetch(chunk: Chunk) -> str:
+    for name, chunk_reader, store_chunks in remote_sources:
+      bts = read_chunk(chunk_reader, store_chunks, chunk)
+      if bts is not None:
+        os.pwrite(fd, bts, chunk.offset)
+        return name
+    raise RuntimeError("Desired chunk not found in provided stores")
+
+  def collect(in_flight: dict[Future, Chunk], block: bool):
+    finished, _ = wait(in_flight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+    for f in finished:
+      name, chunk = f.result(), in_flight.pop(f)
+      fetched_from[chunk.sha] = name
+      done(name, chunk.length)
+
+  mode = 'rb+' if os.path.exists(out_path) else 'wb+'
+  with open(out_path, mode) as out, ThreadPoolExecutor(max_workers=workers) as pool:
+    fd = out.fileno()
+    fetched: dict[bytes, Chunk] = {}  # sha -> first chunk requested from a remote
+    fetched_from: dict[bytes, str] = {}
+    repeated: list[Chunk] = []
+    in_flight: dict[Future, Chunk] = {}
+
+    try:
+      for cur_chunk in target:
+        if cur_chunk.sha in fetched:
+          # wait for the first copy, the target itself could be a source for it
+          repeated.append(cur_chunk)
+          continue
+
+        local = read_local(cur_chunk)
+        if local is not None:
+          name, bts = local
+          os.pwrite(fd, bts, cur_chunk.offset)
+          done(name, cur_chunk.length)
+        else:
+          fetched[cur_chunk.sha] = cur_chunk
+          in_flight[pool.submit(fetch, cur_chunk)] = cur_chunk
+          if len(in_flight) >= 2 * workers:  # bound the memory held by downloaded chunks
+            collect(in_flight, block=True)
+
+        if in_flight:
+          collect(in_flight, block=False)
+
+      while in_flight:
+        collect(in_flight, block=True)
+    finally:
+      for f in in_flight:
+        f.cancel()
+
+    for cur_chunk in repeated:
+      local = read_local(cur_chunk)
+      if local is not None:
+        name, bts = local
       else:
-        raise RuntimeError("Desired chunk not found in provided stores")
+        # copy from the first fetched occurrence, which was verified on download
+        name = fetched_from[cur_chunk.sha]
+        bts = os.pread(fd, cur_chunk.length, fetched[cur_chunk.sha].offset)
+      os.pwrite(fd, bts, cur_chunk.offset)
+      done(name, cur_chunk.length)
 
   return stats
 
@@ -1,8 +1,17 @@
 import pytest
+import http.server
+import io
+import lzma
 import os
 import pathlib
 import tempfile
+import struct
 import subprocess
+import threading
+from functools import partial
+
+import numpy as np
+from Crypto.Hash import SHA512
 
 from openpilot.system.updated.casync import casync
 from openpilot.system.updated.casync import tar
@@ -262,3 +271,172 @@ class TestCasyncDirectory:
     assert stats['remote'] > 0
     assert stats['cache'] > 0
     assert stats['cache'] > stats['remote']
+
+
+def make_store(store_path, contents, chunk_size):
+  """Writes a casync chunk store for contents split in fixed size chunks, returns the target chunks"""
+  target = []
+  for offset in range(0, len(contents), chunk_size):
+    bts = contents[offset:offset + chunk_size]
+    sha = SHA512.new(bts, truncate="256").digest()
+    target.append(casync.Chunk(sha, offset, len(bts)))
+
+    chunk_dir = os.path.join(store_path, sha.hex()[:4])
+    os.makedirs(chunk_dir, exist_ok=True)
+    with open(os.path.join(chunk_dir, sha.hex() + ".cacnk"), 'wb') as f:
+      f.write(lzma.compress(bts))
+  return target
+
+
+def make_caibx(caibx_path, target, min_size=1, max_size=1 << 20):
+  with open(caibx_path, 'wb') as f:
+    f.write(struct.pack("<QQQQQQ", casync.CA_HEADER_LEN, casync.CA_FORMAT_INDEX, casync.FLAGS, min_size, max_size // 2, max_size))
+    f.write(struct.pack("<QQ", 0xffffffffffffffff, casync.CA_FORMAT_TABLE))
+    for c in target:
+      f.write(struct.pack("<Q", c.offset + c.length) + c.sha)
+    f.write(struct.pack("<QQQQQ", 0, 0, casync.CA_HEADER_LEN, casync.CA_TABLE_HEADER_LEN + 40 * (len(target) + 1),
+                        casync.CA_FORMAT_TABLE_TAIL_MARKER))
+
+
+class TestIndex:
+  def test_parse(self, tmp_path):
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(100, 1000, 500)
+    offsets = np.cumsum(lengths) - lengths
+    # include shas ending in zero bytes, which must survive the round trip
+    shas = [rng.bytes(32) if i % 7 else rng.bytes(30) + bytes(2) for i in range(len(lengths))]
+    target = [casync.Chunk(*c) for c in zip(shas, offsets.tolist(), lengths.tolist(), strict=True)]
+    make_caibx(tmp_path / 'test.caibx', target, min_size=100, max_size=1000)
+
+    assert casync.parse_caibx(str(tmp_path / 'test.caibx')) == target
+    index = casync.parse_caibx_index(str(tmp_path / 'test.caibx'))
+    assert index['length'].tolist() == lengths.tolist()
+
+    with pytest.raises(AssertionError):
+      make_caibx(tmp_path / 'test.caibx', target, min_size=100, max_size=900)
+      casync.parse_caibx(str(tmp_path / 'test.caibx'))
+
+  def test_plan(self, tmp_path):
+    data = [os.urandom(100) for _ in range(10)]
+    contents = b''.join(data[i] for i in [0, 1, 2, 3, 1, 4, 5, 5, 6, 0])
+    target = make_store(str(tmp_path / 'store'), contents, 100)
+    make_caibx(tmp_path / 'target.caibx', target)
+    seed = make_store(str(tmp_path / 'seed_store'), b''.join(data[i] for i in [2, 3, 6, 7]), 100)
+    make_caibx(tmp_path / 'seed.caibx', seed)
+
+    target_index = casync.parse_caibx_index(str(tmp_path / 'target.caibx'))
+    plan = casync.plan_extract(target_index, [('seed', casync.parse_caibx_index(str(tmp_path / 'seed.caibx')))])
+    assert plan.source.tolist() == [-1, -1, 0, 0, -1, -1, -1, -1, 0, -1]
+    assert plan.source_bytes == {'seed': 300}
+    assert plan.remote['offset'].tolist() == [0, 100, 500, 600]
+    assert plan.remote_bytes == 400
+
+    # matches what extract ends up downloading
+    sources = [('seed', casync.BinaryChunkReader(io.BytesIO(b''.join(data[i] for i in [2, 3, 6, 7]))), casync.build_chunk_dict(seed))]
+    sources += [('remote', casync.RemoteChunkReader(str(tmp_path / 'store')), casync.build_chunk_dict(target))]
+    stats = casync.extract(target, sources, str(tmp_path / 'out'))
+    assert stats['seed'] == plan.source_bytes['seed']
+    with open(tmp_path / 'out', 'rb') as f:
+      assert f.read() == contents
+
+
+class TestExtract:
+  """Tests the extract engine against a chunk store served from a local directory"""
+
+  @classmethod
+  def setup_class(cls):
+    cls.tmpdir = tempfile.TemporaryDirectory()
+    cls.store_fn = os.path.join(cls.tmpdir.name, 'store')
+
+    chunk_a = bytes(i % 256 for i in range(1024)) * 4
+    chunk_b = bytes((256 - i) % 256 for i in range(1024)) * 4
+    cls.contents = chunk_a + chunk_b + bytes(4096) + os.urandom(4096 * 64) + chunk_a + chunk_b + os.urandom(1000)
+    cls.target = make_store(cls.store_fn, cls.contents, 4096)
+
+    hashes = [c.sha for c in cls.target]
+    assert len(hashes) > len(set(hashes))
+
+    handler = partial(http.server.SimpleHTTPRequestHandler, directory=cls.store_fn)
+    handler.log_message = lambda *args: None
+    cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    cls.store_url = f"http://127.0.0.1:{cls.server.server_port}/"
+
+  @classmethod
+  def teardown_class(cls):
+    cls.server.shutdown()
+    cls.tmpdir.cleanup()
+
+  def setup_method(self):
+    self.target_fn = os.path.join(self.tmpdir.name, next(tempfile._get_candidate_names()))
+    self.seed_fn = os.path.join(self.tmpdir.name, next(tempfile._get_candidate_names()))
+
+  def teardown_method(self):
+    for fn in [self.target_fn, self.seed_fn]:
+      try:
+        os.unlink(fn)
+      except FileNotFoundError:
+        pass
+
+  def read_target(self):
+    with open(self.target_fn, 'rb') as f:
+      return f.read()
+
+  @pytest.mark.parametrize("workers", [1, 8])
+  @pytest.mark.parametrize("http", [False, True], ids=["dir", "http"])
+  def test_remote(self, workers, http):
+    store = self.store_url if http else self.store_fn
+    sources = [('remote', casync.RemoteChunkReader(store), casync.build_chunk_dict(self.target))]
+
+    progress = []
+    stats = casync.extract(self.target, sources, self.target_fn, progress.append, workers=workers)
+
+    assert self.read_target() == self.contents
+    assert stats['remote'] == len(self.contents)
+    assert progress == sorted(progress)
+    assert progress[-1] == len(self.contents)
+    assert len(progress) == len(self.target)
+
+  def test_seed_priority(self):
+    with open(self.seed_fn, 'wb') as seed_f:
+      seed_f.write(self.contents[:len(self.contents) // 2])
+
+    sources = [('seed', casync.FileChunkReader(self.seed_fn), casync.build_chunk_dict(self.target))]
+    sources += [('remote', casync.RemoteChunkReader(self.store_url), casync.build_chunk_dict(self.target))]
+    stats = casync.extract(self.target, sources, self.target_fn)
+
+    assert self.read_target() == self.contents
+    assert stats['seed'] >= len(self.contents) // 2 - 4096
+    assert stats['seed'] + stats['remote'] == len(self.contents)
+
+  def test_chunk_reuse(self):
+    """Repeated chunks are only downloaded once, and are read back from the target"""
+    with open(self.target_fn, 'wb'):
+      pass
+
+    sources = [('target', casync.FileChunkReader(self.target_fn), casync.build_chunk_dict(self.target))]
+    sources += [('remote', casync.RemoteChunkReader(self.store_fn), casync.build_chunk_dict(self.target))]
+    stats = casync.extract(self.target, sources, self.target_fn)
+
+    assert self.read_target() == self.contents
+    unique = {c.sha: c.length for c in self.target}
+    assert stats['remote'] == sum(unique.values())
+    assert stats['target'] == len(self.contents) - stats['remote']
+
+  def test_already_done(self):
+    with open(self.target_fn, 'wb') as f:
+      f.write(self.contents)
+
+    sources = [('target', casync.FileChunkReader(self.target_fn), casync.build_chunk_dict(self.target))]
+    sources += [('remote', casync.RemoteChunkReader(self.store_url), casync.build_chunk_dict(self.target))]
+    stats = casync.extract(self.target, sources, self.target_fn)
+
+    assert self.read_target() == self.contents
+    assert stats['target'] == len(self.contents)
+    assert stats['remote'] == 0
+
+  def test_missing_chunk(self):
+    target = self.target + [casync.Chunk(b'\x00' * 32, len(self.contents), 10)]
+    sources = [('remote', casync.RemoteChunkReader(self.store_fn), casync.build_chunk_dict(self.target))]
+    with pytest.raises(RuntimeError):
+      casync.extract(target, sources, self.target_fn)
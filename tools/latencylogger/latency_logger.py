@@ -8,6 +8,7 @@ from bisect import bisect_left, bisect_right
 from collections import defaultdict
 
 from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.latencylogger.latency_stats import print_summary, route_latencies, summarize
 
 DEMO_ROUTE = "9f583b1d93915c31|2022-05-18--10-49-51--0"
 
@@ -223,14 +224,20 @@ if __name__ == "__main__":
   parser.add_argument("--demo", action="store_true", help="Use the demo route instead of providing one")
   parser.add_argument("--plot", action="store_true", help="If a plot should be generated")
   parser.add_argument("--offset", action="store_true", help="Vertically offset service to better visualize overlap")
-  parser.add_argument("route_or_segment_name", nargs='?', help="The route to print")
+  parser.add_argument("--summary", action="store_true", help="Print percentiles of each stage's latency over whole routes instead of every frame")
+  parser.add_argument("route_or_segment_name", nargs='*', help="The route to print, or the routes to summarize")
 
   if len(sys.argv) == 1:
     parser.print_help()
     sys.exit()
   args = parser.parse_args()
 
-  r = DEMO_ROUTE if args.demo else args.route_or_segment_name.strip()
+  routes = [DEMO_ROUTE] if args.demo else [r.strip() for r in args.route_or_segment_name]
+  if args.summary or len(routes) > 1:
+    print_summary(summarize(route_latencies(routes)))
+    sys.exit()
+
+  r = routes[0]
   lr = LogReader(r, sort_by_time=True)
 
   data, _ = get_timestamps(lr)
@@ -0,0 +1,123 @@
+import multiprocessing
+import operator
+
+import numpy as np
+
+from openpilot.tools.lib.logreader import LogReader
+
+# per service, the fields needed to join the camerad -> modeld -> plannerd -> controlsd chain, with their dtypes
+COLUMNS = {
+  'roadCameraState': [('frameId', 'u4'), ('timestampSof', 'u8'), ('processingTime', 'f4')],
+  'modelV2': [('frameId', 'u4'), ('modelExecutionTime', 'f4'), ('gpuExecutionTime', 'f4')],
+  'longitudinalPlan': [('modelMonoTime', 'u8'), ('solverExecutionTime', 'f4')],
+  'controlsState': [('lateralPlanMonoTime', 'u8')],
+  'sendcan': [],
+}
+PERCENTILES = (50, 90, 99)
+
+
+def extract_columns(lr) -> dict[str, np.ndarray]:
+  """One structured array per service, with logMonoTime and the fields in COLUMNS"""
+  getters = {s: operator.attrgetter(*[f for f, _ in fields]) if len(fields) else None for s, fields in COLUMNS.items()}
+  rows: dict[str, list] = {s: [] for s in COLUMNS}
+  for msg in lr:
+    service = msg.which()
+    if service not in rows:
+      continue
+    getter = getters[service]
+    if getter is None:
+      rows[service].append((msg.logMonoTime,))
+    elif len(COLUMNS[service]) == 1:
+      rows[service].append((msg.logMonoTime, getter(getattr(msg, service))))
+    else:
+      rows[service].append((msg.logMonoTime, *getter(getattr(msg, service))))
+  return {s: np.array(rows[s], dtype=[('logMonoTime', 'u8'), *COLUMNS[s]]) for s in COLUMNS}
+
+
+def concat_columns(parts: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+  ret = {}
+  for s in COLUMNS:
+    arr = np.concatenate([p[s] for p in parts]) if len(parts) else extract_columns([])[s]
+    ret[s] = arr[np.argsort(arr['logMonoTime'], kind='stable')]
+  return ret
+
+
+def join(left: np.ndarray, right: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """Indices into left and right of every left key that's also in right, matched to its first occurrence in right"""
+  order = np.argsort(right, kind='stable')
+  right_sorted = right[order]
+  pos = np.searchsorted(right_sorted, left)
+  found = pos < len(right_sorted)
+  found[found] = right_sorted[pos[found]] == left[found]
+  return np.flatnonzero(found), order[pos[found]]
+
+
+def compute_latencies(cols: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+  """Per stage latencies in milliseconds, one value per camera frame that made it through that stage"""
+  cam, model, plan, controls, sendcan = (cols[s] for s in ('roadCameraState', 'modelV2', 'longitudinalPlan', 'controlsState', 'sendcan'))
+  ret: dict[str, np.ndarray] = {}
+
+  # camerad: start of frame to published, and the processing time it reports
+  sof = cam['timestampSof'].astype(np.int64)
+  ret['camerad'] = (cam['logMonoTime'].astype(np.int64) - sof) / 1e6
+  ret['camerad.processingTime'] = cam['processingTime'] * 1e3
+
+  # modeld: the camera frame it ran on, by frameId
+  m_idx, c_idx = join(model['frameId'], cam['frameId'])
+  model_t = model['logMonoTime'][m_idx].astype(np.int64)
+  model_sof = sof[c_idx]
+  ret['modeld'] = (model_t - cam['logMonoTime'][c_idx].astype(np.int64)) / 1e6
+  ret['modeld.modelExecutionTime'] = model['modelExecutionTime'] * 1e3
+  ret['modeld.gpuExecutionTime'] = model['gpuExecutionTime'] * 1e3
+
+  # plannerd and controlsd reference the model by its logMonoTime
+  model_mono = model['logMonoTime'][m_idx]
+  p_idx, pm_idx = join(plan['modelMonoTime'], model_mono)
+  ret['plannerd'] = (plan['logMonoTime'][p_idx].astype(np.int64) - model_t[pm_idx]) / 1e6
+  ret['plannerd.solverExecutionTime'] = plan['solverExecutionTime'] * 1e3
+
+  # controlsd runs at 100Hz, only the first controlsState after each model counts
+  cm_idx, cs_idx = join(model_mono, controls['lateralPlanMonoTime'])
+  controls_t = controls['logMonoTime'][cs_idx].astype(np.int64)
+  ret['controlsd'] = (controls_t - model_t[cm_idx]) / 1e6
+
+  # sendcan is published right before controlsState
+  sc_idx = np.searchsorted(sendcan['logMonoTime'], controls['logMonoTime'][cs_idx], side='right') - 1
+  valid = sc_idx >= 0
+  ret['end_to_end'] = (sendcan['logMonoTime'][sc_idx[valid]].astype(np.int64) - model_sof[cm_idx][valid]) / 1e6
+  return ret
+
+
+def route_columns(route: str, num_processes: int) -> dict[str, np.ndarray]:
+  lr = LogReader(route, sort_by_time=True)
+  return concat_columns(list(lr.imap_segments(num_processes, extract_columns, desc=route)))
+
+
+def route_latencies(routes: list[str], num_processes: int = multiprocessing.cpu_count()) -> dict[str, np.ndarray]:
+  """Latencies of every route, segments are read in parallel. Routes are joined separately since frame ids restart"""
+  latencies: dict[str, list[np.ndarray]] = {}
+  for route in routes:
+    for stage, values in compute_latencies(route_columns(route, num_processes)).items():
+      latencies.setdefault(stage, []).append(values)
+  return {stage: np.concatenate(values) for stage, values in latencies.items()}
+
+
+def summarize(latencies: dict[str, np.ndarray], percentiles=PERCENTILES) -> dict[str, dict[str, float]]:
+  ret = {}
+  for stage, values in latencies.items():
+    if len(values) == 0:
+      continue
+    ret[stage] = {'count': len(values), 'mean': float(np.mean(values)), 'max': float(np.max(values))}
+    for p, v in zip(percentiles, np.percentile(values, percentiles), strict=True):
+      ret[stage][f'p{p}'] = float(v)
+  return ret
+
+
+def print_summary(summary: dict[str, dict[str, float]]) -> None:
+  if not len(summary):
+    print("No frames found, is the route missing roadCameraState or modelV2?")
+    return
+  columns = list(next(iter(summary.values())).keys())
+  print(f"{'stage (ms)':<30}" + "".join(f"{c:>10}" for c in columns))
+  for stage, stats in summary.items():
+    print(f"{stage:<30}{stats['count']:>10}" + "".join(f"{stats[c]:>10.2f}" for c in columns[1:]))
@@ -0,0 +1,61 @@
+import numpy as np
+
+from cereal import messaging
+from openpilot.tools.latencylogger.latency_stats import compute_latencies, concat_columns, extract_columns, join, summarize
+
+MS = int(1e6)
+
+
+def synthetic_log(n_frames):
+  msgs = []
+  for frame_id in range(n_frames):
+    sof = (frame_id + 1) * 50 * MS
+
+    cam = messaging.new_message('roadCameraState')
+    cam.logMonoTime = sof + 30 * MS
+    cam.roadCameraState.frameId = frame_id
+    cam.roadCameraState.timestampSof = sof
+    msgs.append(cam)
+
+    if frame_id % 10 == 9:
+      continue  # dropped by modeld
+    model = messaging.new_message('modelV2')
+    model.logMonoTime = sof + 55 * MS
+    model.modelV2.frameId = frame_id
+    msgs.append(model)
+
+    plan = messaging.new_message('longitudinalPlan')
+    plan.logMonoTime = sof + 60 * MS
+    plan.longitudinalPlan.modelMonoTime = model.logMonoTime
+    msgs.append(plan)
+
+    for i in range(5):
+      sendcan = messaging.new_message('sendcan', 0)
+      sendcan.logMonoTime = sof + (62 + 10 * i) * MS
+      controls = messaging.new_message('controlsState')
+      controls.logMonoTime = sendcan.logMonoTime + MS
+      controls.controlsState.lateralPlanMonoTime = model.logMonoTime
+      msgs += [sendcan, controls]
+  return [m.as_reader() for m in sorted(msgs, key=lambda m: m.logMonoTime)]
+
+
+class TestLatencyStats:
+  def test_join(self):
+    left_idx, right_idx = join(np.array([5, 1, 7, 3]), np.array([3, 9, 5, 5, 1]))
+    np.testing.assert_array_equal(left_idx, [0, 1, 3])
+    np.testing.assert_array_equal(right_idx, [2, 4, 0])
+
+  def test_latencies(self):
+    msgs = synthetic_log(40)
+    # split into segments, they're joined back in time order
+    cols = concat_columns([extract_columns(msgs[i:i + 50]) for i in range(0, len(msgs), 50)])
+    latencies = compute_latencies(cols)
+
+    assert len(latencies['camerad']) == 40
+    assert len(latencies['modeld']) == 36
+    for stage, expected in (('camerad', 30), ('modeld', 25), ('plannerd', 5), ('controlsd', 8), ('end_to_end', 62)):
+      np.testing.assert_allclose(latencies[stage], expected, err_msg=stage)
+
+    summary = summarize(latencies)
+    assert summary['end_to_end']['count'] == 36
+    assert summary['end_to_end']['p99'] == 62
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import bz2
+from collections import deque
 from functools import cache, partial
 import multiprocessing
 import capnp
@@ -28,6 +29,13 @@ RawLogIterable = Iterable[bytes]
 
 
 def save_log(dest, log_msgs, compress=True):
+  if not (compress and dest.endswith((".bz2", ".zst"))):
+    # write the messages as they come instead of joining them all in memory first
+    with open(dest, "wb") as f:
+      for msg in log_msgs:
+        f.write(msg.as_builder().to_bytes())
+    return
+
   dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
 
   if compress and dest.endswith(".bz2"):
@@ -293,13 +301,27 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
   def _run_on_segment(self, func, i):
     return func(self._get_lr(i))
 
+  def imap_segments(self, num_processes, func, desc=None):
+    """Yields func's result for each segment in order. At most 2 * num_processes results are pending at once,
+    so memory use doesn't grow with the length of the route when the consumer is slower than the pool"""
+    run = partial(self._run_on_segment, func)
+    num_segs = len(self.logreader_identifiers)
+    with multiprocessing.Pool(num_processes) as pool, tqdm.tqdm(total=num_segs, desc=desc) as pbar:
+      pending: deque[multiprocessing.pool.AsyncResult] = deque()
+      for i in range(num_segs):
+        pending.append(pool.apply_async(run, (i,)))
+        if len(pending) >= 2 * num_processes:
+          yield pending.popleft().get()
+          pbar.update()
+      while len(pending):
+        yield pending.popleft().get()
+        pbar.update()
+
   def run_across_segments(self, num_processes, func, desc=None):
-    with multiprocessing.Pool(num_processes) as pool:
-      ret = []
-      num_segs = len(self.logreader_identifiers)
-      for p in tqdm.tqdm(pool.imap(partial(self._run_on_segment, func), range(num_segs)), total=num_segs, desc=desc):
-        ret.extend(p)
-      return ret
+    ret = []
+    for p in self.imap_segments(num_processes, func, desc):
+      ret.extend(p)
+    return ret
 
   def reset(self):
     self.logreader_identifiers = self._parse_identifiers(self.identifier)
@@ -10,7 +10,7 @@ import requests
 from parameterized import parameterized
 
 from cereal import log as capnp_log
-from openpilot.tools.lib.logreader import LogIterable, LogReader, comma_api_source, parse_indirect, ReadMode, InternalUnavailableException
+from openpilot.tools.lib.logreader import LogIterable, LogReader, comma_api_source, parse_indirect, ReadMode, InternalUnavailableException, save_log
 from openpilot.tools.lib.route import SegmentRange
 from openpilot.tools.lib.url_file import URLFileException
 
@@ -24,6 +24,10 @@ def noop(segment: LogIterable):
   return segment
 
 
+def noop_times(segment: LogIterable):
+  return [m.logMonoTime for m in segment]
+
+
 @contextlib.contextmanager
 def setup_source_scenario(mocker, is_internal=False):
   internal_source_mock = mocker.patch("openpilot.tools.lib.logreader.internal_source")
@@ -184,6 +188,19 @@ class TestLogReader:
     lr = LogReader(f"{TEST_ROUTE}/0:4")
     assert len(lr.run_across_segments(4, noop)) == len(list(lr))
 
+  def test_imap_segments(self, tmp_path):
+    fns = []
+    for i in range(5):
+      fn = str(tmp_path / f"rlog{i}")
+      msgs = [capnp_log.Event.new_message(logMonoTime=i * 100 + j, clocks={}).as_reader() for j in range(10)]
+      save_log(fn, msgs, compress=False)
+      fns.append(fn)
+
+    lr = LogReader(fns)
+    times = list(lr.imap_segments(2, noop_times))
+    assert times == [[i * 100 + j for j in range(10)] for i in range(5)]
+    assert lr.run_across_segments(2, noop_times) == [t for seg in times for t in seg]
+
   @pytest.mark.slow
   def test_auto_mode(self, subtests, mocker):
     lr = LogReader(f"{TEST_ROUTE}/0/q")
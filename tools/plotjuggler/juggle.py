@@ -12,7 +12,7 @@ from functools import partial
 
 from openpilot.common.basedir import BASEDIR
 from openpilot.selfdrive.car.fingerprints import MIGRATION
-from openpilot.tools.lib.logreader import LogReader, ReadMode, save_log
+from openpilot.tools.lib.logreader import LogReader, ReadMode
 
 juggle_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -71,28 +71,43 @@ def start_juggler(fn=None, dbc=None, layout=None, route_or_segment_name=None):
 
 
 def process(can, lr):
-  return [d for d in lr if can or d.which() not in ['can', 'sendcan']]
+  """Serialized messages of a segment, with the car name and fingerprint of its first carParams.
+  Bytes are much cheaper to send back from the pool than capnp readers"""
+  dat = []
+  car = None
+  for msg in lr:
+    which = msg.which()
+    if not can and which in ('can', 'sendcan'):
+      continue
+    if car is None and which == 'carParams':
+      car = (msg.carParams.carName, msg.carParams.carFingerprint)
+    dat.append(msg.as_builder().to_bytes())
+  return b"".join(dat), car
+
+
+def get_dbc(car_name, fingerprint):
+  try:
+    DBC = __import__(f"openpilot.selfdrive.car.{car_name}.values", fromlist=['DBC']).DBC
+    return DBC[MIGRATION.get(fingerprint, fingerprint)]['pt']
+  except Exception:
+    return None
 
 
 def juggle_route(route_or_segment_name, can, layout, dbc=None):
   sr = LogReader(route_or_segment_name, default_mode=ReadMode.AUTO_INTERACTIVE)
 
-  all_data = sr.run_across_segments(24, partial(process, can))
+  # each segment is written out as soon as it's processed, so memory use doesn't grow with the route
+  with tempfile.NamedTemporaryFile(suffix='.rlog', dir=juggle_dir) as tmp:
+    infer_dbc = dbc is None
+    for dat, car in sr.imap_segments(24, partial(process, can)):
+      tmp.write(dat)
 
-  # Infer DBC name from logs
-  if dbc is None:
-    for cp in [m for m in all_data if m.which() == 'carParams']:
-      try:
-        DBC = __import__(f"openpilot.selfdrive.car.{cp.carParams.carName}.values", fromlist=['DBC']).DBC
-        fingerprint = cp.carParams.carFingerprint
-        dbc = DBC[MIGRATION.get(fingerprint, fingerprint)]['pt']
-      except Exception:
-        pass
-      break
+      # Infer DBC name from the first carParams
+      if infer_dbc and car is not None:
+        dbc = get_dbc(*car)
+        infer_dbc = False
+    tmp.flush()
 
-  with tempfile.NamedTemporaryFile(suffix='.rlog', dir=juggle_dir) as tmp:
-    save_log(tmp.name, all_data, compress=False)
-    del all_data
     start_juggler(tmp.name, dbc, layout, route_or_segment_name)
 
 
@@ -4,9 +4,11 @@ import signal
 import subprocess
 import time
 
+from cereal import log
 from openpilot.common.basedir import BASEDIR
 from openpilot.common.timeout import Timeout
-from openpilot.tools.plotjuggler.juggle import DEMO_ROUTE, install
+from openpilot.tools.lib.logreader import LogReader, save_log
+from openpilot.tools.plotjuggler.juggle import DEMO_ROUTE, install, juggle_route
 
 PJ_DIR = os.path.join(BASEDIR, "tools/plotjuggler")
 
@@ -31,6 +33,30 @@ class TestPlotJuggler:
 
       assert "Raw file read failed" not in output
 
+  def test_juggle_route_streams(self, tmp_path, mocker):
+    segments = []
+    for i in range(3):
+      msgs = [log.Event.new_message(logMonoTime=i * 10, can=[]), log.Event.new_message(logMonoTime=i * 10 + 1, clocks={})]
+      if i > 0:
+        msgs.append(log.Event.new_message(logMonoTime=i * 10 + 2, carParams={'carName': f'car{i}', 'carFingerprint': f'fp{i}'}))
+      segments.append(str(tmp_path / f"rlog{i}"))
+      save_log(segments[-1], [m.as_reader() for m in msgs])
+
+    out = {}
+    def start_juggler(fn, dbc, layout, route_or_segment_name):
+      with open(fn, 'rb') as f:
+        out['msgs'] = [(m.logMonoTime, m.which()) for m in log.Event.read_multiple_bytes(f.read())]
+      out['dbc'] = dbc
+
+    get_dbc = mocker.patch("openpilot.tools.plotjuggler.juggle.get_dbc", return_value="dbc1")
+    mocker.patch("openpilot.tools.plotjuggler.juggle.start_juggler", side_effect=start_juggler)
+    mocker.patch("openpilot.tools.plotjuggler.juggle.LogReader", side_effect=lambda *args, **kwargs: LogReader(segments))
+
+    juggle_route("route", False, None)
+    get_dbc.assert_called_once_with("car1", "fp1")
+    assert out['dbc'] == "dbc1"
+    assert out['msgs'] == [(1, 'clocks'), (11, 'clocks'), (12, 'carParams'), (21, 'clocks'), (22, 'carParams')]
+
   # TODO: also test that layouts successfully load
   def test_layouts(self, subtests):
     bad_strings = (
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Collects the rings written by processes running with MSG_TRACE=1 into a Chrome
+JSON trace, which can be opened in ui.perfetto.dev next to a system trace from record.sh.
+
+Each process gets a track per service. Publishes are shown as instants with a flow
+arrow to every process that received the message, and the time between a
+SubMaster receiving a message and the process reading it is shown as a slice.
+
+  MSG_TRACE=1 ./system/manager/manager.py
+  ./tools/profiling/perfetto/msgtrace.py -o msgtrace.json
+"""
+import argparse
+import json
+
+import numpy as np
+
+from cereal.messaging import trace
+
+PERCENTILES = (50, 90, 99)
+
+
+def to_us(t: int) -> float:
+  return t / 1e3
+
+
+def build_trace(rings: list[trace.Ring]) -> list[dict]:
+  events: list[dict] = []
+  tids: set[tuple[int, int]] = set()
+
+  published = {}
+  for ring in rings:
+    events.append({"ph": "M", "name": "process_name", "pid": ring.pid, "args": {"name": ring.name}})
+    for e in ring.events:
+      if e.kind == trace.PUBLISH:
+        published[(e.service, e.mono)] = (ring.pid, e.t)
+
+  flow_id = 0
+  for ring in rings:
+    received = {}
+    for e in ring.events:
+      tid = trace.SERVICE_INDEX[e.service] + 1
+      tids.add((ring.pid, tid))
+      key = (e.service, e.mono)
+
+      if e.kind == trace.PUBLISH:
+        events.append({"ph": "X", "name": e.service, "cat": "publish", "pid": ring.pid, "tid": tid, "ts": to_us(e.t), "dur": 0,
+                       "args": {"logMonoTime": e.mono}})
+      elif e.kind == trace.RECEIVE:
+        received[key] = e
+        if key in published:
+          pub_pid, pub_t = published[key]
+          flow_id += 1
+          events.append({"ph": "s", "name": e.service, "cat": "msg", "id": flow_id, "pid": pub_pid,
+                         "tid": tid, "ts": to_us(pub_t)})
+          events.append({"ph": "f", "bp": "e", "name": e.service, "cat": "msg", "id": flow_id, "pid": ring.pid,
+                         "tid": tid, "ts": to_us(e.t)})
+      elif e.kind == trace.CONSUME and key in received:
+        recv = received.pop(key)
+        events.append({"ph": "X", "name": e.service, "cat": "consume", "pid": ring.pid, "tid": tid, "ts": to_us(recv.t),
+                       "dur": to_us(e.t - recv.t), "args": {"logMonoTime": e.mono}})
+
+    # received but never read, e.g. overwritten by a newer message first
+    for e in received.values():
+      events.append({"ph": "X", "name": e.service, "cat": "receive", "pid": ring.pid, "tid": trace.SERVICE_INDEX[e.service] + 1,
+                     "ts": to_us(e.t), "dur": 0, "args": {"logMonoTime": e.mono}})
+
+  for pid, tid in sorted(tids):
+    events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": trace.SERVICES[tid - 1]}})
+  return events
+
+
+def print_stats(rings: list[trace.Ring]) -> None:
+  hops = trace.stats(rings)
+  header = "  ".join(f"p{p:<6}" for p in PERCENTILES)
+  print(f"{'service':<28}{'hop':<18}{'n':>8}  {header}  max (ms)")
+  for s in sorted(hops):
+    for hop, lat in hops[s].items():
+      if not lat:
+        continue
+      ms = np.array(lat) / 1e6
+      pct = "  ".join(f"{v:7.3f}" for v in np.percentile(ms, PERCENTILES))
+      print(f"{s:<28}{hop:<18}{len(ms):>8}  {pct}  {ms.max():7.3f}")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Collect MSG_TRACE rings into a Perfetto compatible trace",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("-o", "--output", default="msgtrace.json", help="Chrome JSON trace to write")
+  parser.add_argument("--dir", default=None, help="directory holding the rings, defaults to /dev/shm")
+  parser.add_argument("--clear", action="store_true", help="remove the rings after collecting them")
+  args = parser.parse_args()
+
+  rings = list(trace.iter_rings(args.dir))
+  if not rings:
+    raise SystemExit(f"no message traces found in {args.dir or trace.trace_dir()}, run with MSG_TRACE=1")
+
+  with open(args.output, "w") as f:
+    json.dump({"traceEvents": build_trace(rings), "displayTimeUnit": "ns"}, f)
+  print(f"wrote {sum(len(r.events) for r in rings)} events from {len(rings)} processes to {args.output}\n")
+  print_stats(rings)
+
+  if args.clear:
+    trace.clear(args.dir)
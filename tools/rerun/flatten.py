@@ -0,0 +1,158 @@
+import operator
+from collections import defaultdict
+
+import numpy as np
+
+from cereal import log
+
+BATCH_SIZE = 4096  # messages of a service per temporal batch
+
+NUMERIC_TYPES = {'bool', 'int8', 'int16', 'int32', 'int64', 'uint8', 'uint16', 'uint32', 'uint64', 'float32', 'float64'}
+
+# kinds of plan entries
+SCALAR, SCALAR_LIST, STRUCT, STRUCT_LIST = range(4)
+
+
+class Plan:
+  """The fields of a struct schema that hold numbers, precomputed once per schema"""
+  def __init__(self):
+    self.scalars: list[str] = []
+    self.pointers: list[tuple[str, int, Plan | None]] = []  # structs and lists, only plotted if they're set
+    self.union: dict[str, tuple[int, Plan | None]] = {}
+    self._bound: dict[str, tuple] = {}
+
+  def bind(self, key: str) -> tuple:
+    """Entity paths under key, with a getter that reads all the scalar fields in one call"""
+    if key not in self._bound:
+      getter = operator.attrgetter(*self.scalars) if len(self.scalars) > 1 else None
+      scalar_keys = tuple(f"{key}/{name}" for name in self.scalars)
+      self._bound[key] = (scalar_keys, getter)
+    return self._bound[key]
+
+
+_plans: dict[int, Plan] = {}
+
+
+def _field_entry(field):
+  """(kind, sub plan) of a field, or None if nothing in it can be plotted"""
+  if field.proto.which() == 'group':
+    return STRUCT, compile_plan(field.schema)
+
+  field_type = field.proto.slot.type
+  which = field_type.which()
+  if which in NUMERIC_TYPES:
+    return SCALAR, None
+  elif which == 'struct':
+    return STRUCT, compile_plan(field.schema)
+  elif which == 'list':
+    element_type = field_type.list.elementType.which()
+    if element_type in NUMERIC_TYPES:
+      return SCALAR_LIST, None
+  return None
+
+
+def compile_plan(schema) -> Plan:
+  schema_id = schema.node.id
+  if schema_id in _plans:
+    return _plans[schema_id]
+
+  # cached before it's filled in, so recursive structs refer back to it
+  plan = _plans[schema_id] = Plan()
+  union_fields = set(schema.union_fields)
+  for name, field in schema.fields.items():
+    entry = _field_entry(field)
+    if entry is None:
+      continue
+    if name in union_fields:
+      plan.union[name] = entry
+    elif entry[0] == SCALAR:
+      plan.scalars.append(name)
+    else:
+      plan.pointers.append((name, *entry))
+  return plan
+
+
+def _flatten_field(msg, name, kind, sub, key, out):
+  if kind == SCALAR:
+    out.append((f"{key}/{name}", getattr(msg, name)))
+  elif kind == STRUCT:
+    _flatten_struct(getattr(msg, name), sub, f"{key}/{name}", out)
+  elif kind == SCALAR_LIST:
+    out.extend((f"{key}/{name}/{i}", v) for i, v in enumerate(getattr(msg, name)))
+
+
+def _flatten_struct(msg, plan, key, out):
+  scalar_keys, getter = plan.bind(key)
+  if getter is not None:
+    out.extend(zip(scalar_keys, getter(msg), strict=True))
+  elif len(scalar_keys):
+    out.append((scalar_keys[0], getattr(msg, plan.scalars[0])))
+
+  for name, kind, sub in plan.pointers:
+    # unset pointer fields aren't plotted, same as to_dict() leaves them out
+    if msg._has(name):
+      _flatten_field(msg, name, kind, sub, key, out)
+
+  if len(plan.union):
+    # the active union member is, even if it's unset
+    active = msg.which()
+    if active in plan.union:
+      _flatten_field(msg, active, *plan.union[active], key, out)
+
+
+class ServiceFlattener:
+  """Flattens the messages of a service into (entity path, value) pairs, following a plan compiled once from the schema"""
+  def __init__(self, service: str):
+    self.service = service
+    field = log.Event.schema.fields[service]
+    field_type = field.proto.slot.type.which()
+    self.kind: int | None = None
+    self.plan = None
+    if field_type == 'struct':
+      self.kind, self.plan = STRUCT, compile_plan(field.schema)
+    elif field_type == 'list' and field.proto.slot.type.list.elementType.which() == 'struct':
+      self.kind, self.plan = STRUCT_LIST, compile_plan(field.schema.elementType)
+
+  def flatten(self, msg) -> list[tuple[str, float]]:
+    out: list[tuple[str, float]] = []
+    if self.kind == STRUCT:
+      _flatten_struct(getattr(msg, self.service), self.plan, self.service, out)
+    elif self.kind == STRUCT_LIST:
+      for i, item in enumerate(getattr(msg, self.service)):
+        _flatten_struct(item, self.plan, f"{self.service}/{i}", out)
+    return out
+
+
+class ColumnBatcher:
+  """Collects flattened messages into a time and a value column per entity path.
+  Each service's columns are handed to send() as numpy arrays every batch_size messages of that service"""
+  def __init__(self, send, batch_size: int = BATCH_SIZE):
+    self.send = send
+    self.batch_size = batch_size
+    self.flatteners: dict[str, ServiceFlattener] = {}
+    self.columns: dict[str, dict[str, tuple[list[float], list[float]]]] = defaultdict(dict)
+    self.counts: dict[str, int] = defaultdict(int)
+
+  def add(self, msg) -> None:
+    service = msg.which()
+    if service not in self.flatteners:
+      self.flatteners[service] = ServiceFlattener(service)
+
+    t = msg.logMonoTime / 1e9
+    columns = self.columns[service]
+    for entity_path, value in self.flatteners[service].flatten(msg):
+      if entity_path not in columns:
+        columns[entity_path] = ([], [])
+      times, values = columns[entity_path]
+      times.append(t)
+      values.append(value)
+
+    self.counts[service] += 1
+    if self.counts[service] >= self.batch_size:
+      self.flush(service)
+
+  def flush(self, service: str | None = None) -> None:
+    for s in ([service] if service is not None else list(self.columns)):
+      for entity_path, (times, values) in self.columns.pop(s, {}).items():
+        self.send(entity_path, np.array(times, dtype=np.float64), np.array(values, dtype=np.float64))
+      self.counts[s] = 0
@@ -6,15 +6,16 @@ import multiprocessing
 import rerun as rr
 import rerun.blueprint as rrb
 from functools import partial
-from collections import defaultdict
 
 from cereal.services import SERVICE_LIST
 from openpilot.tools.rerun.camera_reader import probe_packet_info, CameraReader, CameraConfig, CameraType
+from openpilot.tools.rerun.flatten import ColumnBatcher
 from openpilot.tools.lib.logreader import LogReader
 from openpilot.tools.lib.route import Route, SegmentRange
 
 
 NUM_CPUS = multiprocessing.cpu_count()
+NUM_DECODERS = max(1, NUM_CPUS // 4)  # ffmpeg already decodes hevc with several threads
 DEMO_ROUTE = "a2a0ccea32023010|2023-07-27--13-01-19"
 RR_TIMELINE_NAME = "Timeline"
 RR_WIN = "openpilot logs"
@@ -71,30 +72,12 @@ class Rerunner:
     return blueprint
 
   @staticmethod
-  def _parse_msg(msg, parent_key=''):
-    stack = [(msg, parent_key)]
-    while stack:
-      current_msg, current_parent_key = stack.pop()
-      if isinstance(current_msg, list):
-        for index, item in enumerate(current_msg):
-          new_key = f"{current_parent_key}/{index}"
-          if isinstance(item, (int, float)):
-            yield new_key, item
-          elif isinstance(item, dict):
-            stack.append((item, new_key))
-      elif isinstance(current_msg, dict):
-        for key, value in current_msg.items():
-          new_key = f"{current_parent_key}/{key}"
-          if isinstance(value, (int, float)):
-            yield new_key, value
-          elif isinstance(value, dict):
-            stack.append((value, new_key))
-          elif isinstance(value, list):
-            for index, item in enumerate(value):
-              if isinstance(item, (int, float)):
-                yield f"{new_key}/{index}", item
-      else:
-        pass  # Not a plottable value
+  def _send_columns(entity_path, times, values):
+    rr.log_temporal_batch(
+      entity_path,
+      times=[rr.TimeSecondsBatch(RR_TIMELINE_NAME, times)],
+      components=[rr.components.ScalarBatch(values)]
+    )
 
   @staticmethod
   @rr.shutdown_at_exit
@@ -103,23 +86,13 @@ class Rerunner:
     rr.connect()
     rr.send_blueprint(blueprint)
 
-    log_msgs = defaultdict(lambda: defaultdict(list))
+    # columns are sent every BATCH_SIZE messages of a service instead of after the whole segment
+    batcher = ColumnBatcher(Rerunner._send_columns)
     for msg in lr:
-      msg_type = msg.which()
-
-      if msg_type == "thumbnail":
+      if msg.which() == "thumbnail":
         continue
-
-      for entity_path, dat in Rerunner._parse_msg(msg.to_dict()[msg_type], msg_type):
-        log_msgs[entity_path]["times"].append(msg.logMonoTime / 1e9)
-        log_msgs[entity_path]["data"].append(dat)
-
-    for entity_path, log_msg in log_msgs.items():
-      rr.log_temporal_batch(
-        entity_path,
-        times=[rr.TimeSecondsBatch(RR_TIMELINE_NAME, log_msg["times"])],
-        components=[rr.components.ScalarBatch(log_msg["data"])]
-      )
+      batcher.add(msg)
+    batcher.flush()
 
     return []
 
@@ -140,7 +113,7 @@ class Rerunner:
     startup_blueprint = self._create_blueprint()
     self.lr.run_across_segments(NUM_CPUS, partial(self._process_log_msgs, startup_blueprint), desc="Log messages")
     for cam_type, cr in self.camera_readers.items():
-      cr.run_across_segments(NUM_CPUS, partial(self._process_cam_readers, startup_blueprint, cam_type, cr.h, cr.w), desc=cam_type)
+      cr.run_across_segments(NUM_DECODERS, partial(self._process_cam_readers, startup_blueprint, cam_type, cr.h, cr.w), desc=cam_type)
 
     rr.send_blueprint(self._create_blueprint())
 
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from cereal import log, messaging
+from cereal.services import SERVICE_LIST
+from openpilot.tools.rerun.flatten import ColumnBatcher, ServiceFlattener
+
+
+def parse_dict(msg, parent_key):
+  # plottable values of msg.to_dict(), the way they were found before the schema was precompiled
+  if isinstance(msg, list):
+    for index, item in enumerate(msg):
+      if isinstance(item, dict):
+        yield from parse_dict(item, f"{parent_key}/{index}")
+  elif isinstance(msg, dict):
+    for key, value in msg.items():
+      new_key = f"{parent_key}/{key}"
+      if isinstance(value, (int, float)):
+        yield new_key, value
+      elif isinstance(value, dict):
+        yield from parse_dict(value, new_key)
+      elif isinstance(value, list):
+        yield from ((f"{new_key}/{i}", v) for i, v in enumerate(value) if isinstance(v, (int, float)))
+
+
+def new_message(service):
+  if log.Event.schema.fields[service].proto.slot.type.which() == 'list':
+    return messaging.new_message(service, 2)
+  return messaging.new_message(service)
+
+
+class TestFlatten:
+  @pytest.mark.parametrize("service", sorted(SERVICE_LIST.keys()))
+  def test_matches_to_dict(self, service):
+    try:
+      msg = new_message(service).as_reader()
+    except Exception:
+      pytest.skip("can't build an empty message of this type")
+    assert dict(ServiceFlattener(service).flatten(msg)) == dict(parse_dict(msg.to_dict()[service], service))
+
+  def test_lists_and_unions(self):
+    msg = messaging.new_message('carParams')
+    msg.carParams.lateralTuning.init('torque').kp = 2.
+    msg.carParams.longitudinalTuning.kpV = [1., 0.5]
+    msg = msg.as_reader()
+
+    flat = dict(ServiceFlattener('carParams').flatten(msg))
+    assert flat == dict(parse_dict(msg.to_dict()['carParams'], 'carParams'))
+    assert flat['carParams/lateralTuning/torque/kp'] == 2.
+    assert flat['carParams/longitudinalTuning/kpV/1'] == 0.5
+    assert not any(k.startswith('carParams/lateralTuning/pid') for k in flat)
+
+  def test_batches(self):
+    sent = []
+    batcher = ColumnBatcher(lambda *args: sent.append(args), batch_size=3)
+    for i in range(7):
+      for service in ('carState', 'gpsLocationExternal'):
+        msg = messaging.new_message(service)
+        msg.logMonoTime = i * int(1e9)
+        if service == 'carState':
+          msg.carState.vEgo = i
+        batcher.add(msg.as_reader())
+    batcher.flush()
+
+    v_ego = [(times, values) for path, times, values in sent if path == 'carState/vEgo']
+    assert [len(t) for t, _ in v_ego] == [3, 3, 1]
+    np.testing.assert_array_equal(np.concatenate([t for t, _ in v_ego]), np.arange(7))
+    np.testing.assert_array_equal(np.concatenate([v for _, v in v_ego]), np.arange(7))